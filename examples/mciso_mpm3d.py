@@ -99,11 +99,18 @@ def init():
         J[i] = 1
 
 
-mciso = tina.MCISO((n_grid, n_grid, n_grid))
+# screen-space fluid instead of marching cubes, no meshing every frame
+use_fluid = True
 
 scene = tina.Scene(smoothing=True, maxfaces=2**18, ibl=True, ssao=True)
 material = tina.PBR(metallic=0.15, roughness=0.0)
-scene.add_object(mciso, material)
+if use_fluid:
+    pars = tina.FieldParticles(x, radius=0.012, color=(0.6, 0.8, 1.0))
+    fluid = tina.FluidRaster(scene.engine, maxpars=n_particles, absorption=[1.2, 0.5, 0.2])
+    scene.add_object(pars, material, raster=fluid)
+else:
+    mciso = tina.MCISO((n_grid, n_grid, n_grid))
+    scene.add_object(mciso, material)
 
 #boundbox = tina.MeshToWire(tina.MeshTransform(tina.MeshModel('assets/cube.obj'), tina.scale(0.5) @ tina.translate(1)))
 #scene.add_object(boundbox)
@@ -125,7 +132,8 @@ while gui.running:
     for s in range(steps):
         substep()
 
-    mciso.march(x, w0=2, rad=0, sig=0)
+    if not use_fluid:
+        mciso.march(x, w0=2, rad=0, sig=0)
 
     # tina.writeobj(f'/tmp/{gui.frame:04d}.obj', tina.export_connective_mesh(mciso))
     # np.save(f'/tmp/{gui.frame:04d}.npy', x.to_numpy())
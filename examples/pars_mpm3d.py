@@ -100,7 +100,7 @@ def init():
 
 
 scene = tina.Scene(maxpars=n_particles, bgcolor=ti.hex_to_rgb(0xaaaaff))
-pars = tina.SimpleParticles(n_particles, radius=0.01)
+pars = tina.FieldParticles(x, radius=0.01)
 color = tina.Diffuse(color=ti.hex_to_rgb(0xffaaaa))
 scene.add_object(pars, color)
 
@@ -119,7 +119,6 @@ while gui.running:
     for s in range(steps):
         substep()
 
-    pars.set_particles(x.to_numpy())
     scene.render()
 
     gui.set_image(scene.img)
@@ -269,6 +269,10 @@ class MPMSolver:
 
     @ti.kernel
     def get_num_particles(self) -> int:
+        return self.get_npars()
+
+    @ti.func
+    def get_npars(self):
         return ti.length(self.particle, [])
 
     @ti.kernel
@@ -306,7 +310,7 @@ def main():
         mciso = tina.MCISO(mpm.res)
         scene.add_object(mciso, tina.Classic())
     else:
-        pars = tina.SimpleParticles(radius=0.01)
+        pars = tina.FieldParticles(mpm.x, radius=0.01, npars=mpm.get_npars)
         scene.add_object(pars, tina.Classic())
 
     wire = tina.MeshToWire(tina.PrimitiveMesh.asset('cube'))
@@ -344,10 +348,6 @@ def main():
             mpm.step()
         if use_mciso:
             mciso.march(mpm.x, w0.value, rad.value, sig.value)
-        else:
-            pars.set_particles(mpm.get_particle_pos())
-            #colors = np.array(list(map(ti.hex_to_rgb, [0x068587, 0xED553B, 0xEEEEF0])))
-            #pars.set_particle_colors(colors[mpm.material.to_numpy()])
         scene.render()
         gui.set_image(scene.img)
         gui.show()
@@ -0,0 +1,23 @@
+import taichi as ti
+import tina
+
+ti.init(ti.gpu)
+
+obj = tina.readobj('assets/monkey.obj')
+chain = tina.make_lod_chain(obj, nlevels=4, ratio=0.5)
+for i, lod in enumerate(chain):
+    print(f'level {i}: {len(lod["f"])} faces')
+    assert i == 0 or len(lod['f']) < len(chain[i - 1]['f'])
+
+scene = tina.Scene(smoothing=True)
+model = tina.MeshLOD([tina.MeshModel(lod) for lod in chain], threshold=256)
+scene.add_object(model)
+
+gui = ti.GUI('lod', scene.res)
+scene.init_control(gui, center=[0, 0, 0], radius=3)
+
+while gui.running:
+    scene.input(gui)
+    scene.render()
+    gui.set_image(scene.img)
+    gui.show()
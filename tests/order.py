@@ -0,0 +1,27 @@
+import taichi as ti
+import time
+import tina
+
+nframes = 32
+orders = ['scanline', 'tiled', 'morton']
+
+for order in orders:
+    ti.init(ti.cpu)
+
+    scene = tina.PTScene(smoothing=True, pixel_order=order)
+    scene.add_object(tina.MeshModel('assets/monkey.obj'), tina.Lambert())
+    scene.add_object(tina.MeshTransform(tina.MeshModel('assets/plane.obj'),
+            tina.translate([0, 0, 4]) @ tina.eularXYZ([ti.pi / 2, 0, 0])
+            @ tina.scale(0.1)), tina.Lamp(color=64))
+    scene.update()
+
+    scene.render(nsteps=4)  # warm up JIT
+    ti.sync()
+    t0 = time.time()
+    for i in range(nframes):
+        scene.render(nsteps=4)
+    ti.sync()
+    t1 = time.time()
+
+    nrays = scene.engine.nrays * scene.engine.spp_per_launch * nframes
+    print(f'{order:>10}: {nrays / (t1 - t0) / 1e6:.3f} M primary rays/s')
@@ -7,13 +7,13 @@ def main(filename, radius=0.05):
     ti.init(ti.gpu)
 
     pos = np.load(filename).astype(np.float32)
-    scene = tina.Scene((1024, 768))
-    pars = tina.SimpleParticles(maxpars=len(pos))
+    x = ti.Vector.field(3, float, len(pos))
+    scene = tina.Scene((1024, 768), maxpars=len(pos))
+    pars = tina.FieldParticles(x, radius=float(radius))
     scene.add_object(pars)
 
     gui = ti.GUI('particles', scene.res, fast_gui=True)
-    pars.set_particles(pos)
-    pars.set_particle_radii(np.ones(len(pos), dtype=np.float32) * radius)
+    x.from_numpy(pos)
     while gui.running:
         scene.input(gui)
         scene.render()
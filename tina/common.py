@@ -259,6 +259,30 @@ def ranprint(*args, **kwargs):
     func(kwargs.get('r', 1e-3))
 
 
+def object_version(obj):
+    '''
+    :param obj: (Mesh | Pars | Voxl) a scene object
+    :return: the current version of the object, None if it does not track its changes
+    '''
+
+    if not hasattr(obj, 'get_version'):
+        return None
+    return obj.get_version()
+
+
+def object_bounding_box(obj):
+    '''
+    :param obj: (Mesh | Pars) a scene object
+    :return: (np.array[2, 3]) world space minimum and maximum corners, None if unknown
+
+    :note: volumes only report their local bounding box, inside kernels
+    '''
+
+    if not hasattr(obj, 'get_bounding_box') or hasattr(obj, 'sample_volume'):
+        return None
+    return obj.get_bounding_box()
+
+
 class namespace(dict):
     def __getattr__(self, name):
         try:
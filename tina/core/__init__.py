@@ -1,8 +1,13 @@
 if __import__('tina').lazyguard:
     from .engine import *
+    from .hiz import *
+    from .cache import *
+    from .binner import *
     from .triangle import *
     from .particle import *
+    from .fluid import *
     from .wireframe import *
     from .volume import *
     from .shader import *
+    from .deferred import *
     from .lighting import *
@@ -0,0 +1,130 @@
+from ..common import *
+
+
+@ti.data_oriented
+class TileBinner:
+    def __init__(self, engine, maxprims, tilesize=8, maxbinned=None):
+        '''
+        :param engine: (Engine) the engine whose visibility buffer is written
+        :param maxprims: (int) max number of primitives to be binned
+        :param tilesize: (int) edge length of a screen tile in pixels
+        :param maxbinned: (int) capacity of the tile lists, primitives beyond it are rasterized one by one
+
+        Sorts the screen rectangles of primitives into tile lists, then
+        resolves each pixel in one thread against the primitives of its
+        tile, without atomics on the visibility buffer
+
+        The raster using it should provide ti.funcs prim_depth(f, p),
+        returning (inside, depth) at a sample position, and
+        rasterize_prim(f, bot, top) for the overflown primitives
+        '''
+
+        self.engine = engine
+        self.res = engine.res
+        self.tilesize = tilesize
+        self.order = tina.TiledOrder(self.res, self.tilesize)
+        self.ntiles = self.order.ntiles
+        self.maxbinned = maxbinned or maxprims * 4
+
+        self.bot = ti.Vector.field(2, int, maxprims)
+        self.top = ti.Vector.field(2, int, maxprims)
+        self.visible = ti.field(int, maxprims)
+        self.nvisible = ti.field(int, ())
+        self.overflow = ti.field(int, maxprims)
+        self.noverflow = ti.field(int, ())
+
+        self.tile_count = ti.field(int, self.ntiles)
+        self.tile_base = ti.field(int, self.ntiles)
+        self.tile_cursor = ti.field(int, self.ntiles)
+        self.binned = ti.field(int, self.maxbinned)
+        self.nbinned = ti.field(int, ())
+
+    @ti.kernel
+    def clear(self):
+        self.nvisible[None] = 0
+        self.noverflow[None] = 0
+        self.nbinned[None] = 0
+        for T in ti.grouped(self.tile_count):
+            self.tile_count[T] = 0
+
+    @ti.func
+    def add(self, f, bot, top):
+        '''
+        :param f: (int) id of the primitive
+        :param bot: (Vector) lower-left pixel of its screen rectangle, inclusive
+        :param top: (Vector) upper-right pixel of its screen rectangle, inclusive
+        '''
+
+        self.bot[f] = bot
+        self.top[f] = top
+        tbot, ttop = bot // self.tilesize, top // self.tilesize
+        tsize = ttop - tbot + 1
+        n = tsize.x * tsize.y
+        if ti.atomic_add(self.nbinned[None], n) + n <= self.maxbinned:
+            self.visible[ti.atomic_add(self.nvisible[None], 1)] = f
+            for T in ti.grouped(ti.ndrange((tbot.x, ttop.x + 1), (tbot.y, ttop.y + 1))):
+                ti.atomic_add(self.tile_count[T], 1)
+        else:
+            # give the space back, so that smaller primitives still fit
+            ti.atomic_sub(self.nbinned[None], n)
+            self.overflow[ti.atomic_add(self.noverflow[None], 1)] = f
+
+    def render(self, raster):
+        '''
+        :param raster: the raster owning the primitives added since clear
+        '''
+
+        self._offsets()
+        self._fill()
+        self._resolve(raster)
+        self._overflow(raster)
+
+    @ti.kernel
+    def _offsets(self):
+        for _ in range(1):  # serial prefix sum over tiles
+            base = 0
+            for i, j in ti.ndrange(self.ntiles.x, self.ntiles.y):
+                self.tile_base[i, j] = base
+                self.tile_cursor[i, j] = base
+                base += self.tile_count[i, j]
+
+    @ti.kernel
+    def _fill(self):
+        for i in range(self.nvisible[None]):
+            f = self.visible[i]
+            tbot, ttop = self.bot[f] // self.tilesize, self.top[f] // self.tilesize
+            for T in ti.grouped(ti.ndrange((tbot.x, ttop.x + 1), (tbot.y, ttop.y + 1))):
+                self.binned[ti.atomic_add(self.tile_cursor[T], 1)] = f
+
+    @ti.kernel
+    def _resolve(self, raster: ti.template()):
+        for i in range(self.order.get_nthreads()):
+            P = self.order.get_pixel(i)
+            if not self.order.contains(P):
+                continue
+
+            T = P // self.tilesize
+            pos = float(P) + self.engine.bias[None]
+            best_key, best_depth, found = self.engine.vbuf[P], 0, 0
+            base = self.tile_base[T]
+            for j in range(base, base + self.tile_count[T]):
+                f = self.binned[j]
+                if any(P < self.bot[f]) or any(P > self.top[f]):
+                    continue
+                inside, depth = raster.prim_depth(f, pos)
+                idepth = int(depth * self.engine.maxdepth)
+                if inside and -self.engine.maxdepth <= idepth <= self.engine.maxdepth:
+                    key = self.engine.make_visibility_key(idepth, f)
+                    if key < best_key:
+                        best_key, best_depth, found = key, idepth, 1
+
+            # each pixel is owned by one thread here, no atomics needed
+            if found:
+                self.engine.vbuf[P] = best_key
+                self.engine.depth[P] = min(self.engine.depth[P], best_depth)
+
+    @ti.kernel
+    def _overflow(self, raster: ti.template()):
+        for i in range(self.noverflow[None]):
+            f = self.overflow[i]
+            raster.rasterize_prim(f, self.bot[f], self.top[f])
@@ -0,0 +1,106 @@
+from ..common import *
+
+
+class ObjectCache:
+    def __init__(self, maxelems, maxobjects=1024, release=None, align=1):
+        '''
+        :param maxelems: (int) number of element slots shared by all cached objects
+        :param maxobjects: (int) max number of objects cached at the same time
+        :param release: (callable) called with (base, size) when a range is freed
+        :param align: (int) alignment of range bases, so that no group of align elements spans two objects
+
+        Keeps a persistent range of raster buffers for each object, so that
+        objects whose version did not change need not be uploaded again
+
+        Each cached object also gets a small integer slot, which rasters
+        store per element to look up per-object draw state
+        '''
+
+        self.allocator = tina.RangeAllocator(maxelems, align)
+        self.slots = tina.RangeAllocator(maxobjects)
+        self.maxobjects = maxobjects
+        self.release = release
+        self.entries = {}
+        self.generation = 0
+
+    def clear(self):
+        for entry in self.entries.values():
+            self._release(entry.base)
+        self.allocator.clear()
+        self.slots.clear()
+        self.entries.clear()
+        self.generation += 1
+
+    def get_top(self):
+        '''
+        :return: (int) end of the highest range in use
+        '''
+
+        return self.allocator.get_top()
+
+    def _malloc(self, size):
+        try:
+            return self.allocator.malloc(size)
+        except RuntimeError:
+            self.clear()  # evict everything, they will be uploaded again
+            return self.allocator.malloc(size)
+
+    def _release(self, base):
+        # the whole allocated range, so that no stale element is left in the padding
+        if self.release is not None:
+            self.release(base, self.allocator.used_chunk[base])
+
+    def acquire_all(self, objs, count, upload):
+        '''
+        :param objs: (list) objects to be rasterized together
+        :return: (list) entries of the objects, all valid at the same time
+
+        :note: retries once if the cache had to evict objects on the way
+        '''
+
+        for attempt in range(2):
+            generation = self.generation
+            entries = [self.acquire(obj, lambda: count(obj),
+                lambda entry: upload(obj, entry)) for obj in objs]
+            if self.generation == generation:
+                return entries
+        raise RuntimeError('Out of memory! objects do not fit in raster buffers')
+
+    def acquire(self, obj, count, upload):
+        '''
+        :param obj: (Mesh | Pars) the object to be rasterized
+        :param count: (callable) returns the number of elements of obj
+        :param upload: (callable) uploads obj into the given entry's (base, size, slot)
+        :return: (namespace) base, size and slot of the range holding obj
+
+        :note: objects without get_version are uploaded every time
+        '''
+
+        version = object_version(obj)
+        entry = self.entries.get(obj)
+        if entry is not None and version is not None and entry.version == version:
+            return entry
+
+        size = count()
+        if entry is None:
+            if len(self.entries) >= self.maxobjects:
+                self.clear()
+            base = self._malloc(size)
+            slot = self.slots.malloc(1)
+            entry = namespace(base=base, size=size, slot=slot, version=None)
+            self.entries[obj] = entry
+
+        elif entry.size != size:
+            del self.entries[obj]
+            self._release(entry.base)
+            self.allocator.free(entry.base)
+            generation = self.generation
+            base = self._malloc(size)
+            if self.generation != generation:  # evicted while allocating
+                entry['slot'] = self.slots.malloc(1)
+            entry['base'], entry['size'] = base, size
+            self.entries[obj] = entry
+
+        entry['version'] = version
+        upload(entry)
+        return entry
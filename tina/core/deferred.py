@@ -0,0 +1,107 @@
+from ..advans import *
+from .shader import IShader, calc_viewdir
+
+
+class GBufferShader(IShader):
+    def __init__(self, gbuf, mtlid=0):
+        '''
+        :param gbuf: (DeferredShading) the G-buffer to write into
+        :param mtlid: (int) material id for rasters not drawing through a material table
+
+        Writes the surface attributes of each pixel instead of shading it
+        '''
+
+        self.gbuf = gbuf
+        self.mtlid = mtlid
+
+    def clear_buffer(self):
+        pass
+
+    @ti.func
+    def shade_material(self, mtlid, engine, P, p, f, pos, normal, texcoord, color):
+        self.gbuf.norm[P] = normal
+        self.gbuf.coor[P] = texcoord
+        self.gbuf.color[P] = color
+        self.gbuf.mtlid[P] = mtlid
+
+    @ti.func
+    def shade_color(self, engine, P, p, f, pos, normal, texcoord, color):
+        self.shade_material(self.mtlid, engine, P, p, f, pos, normal, texcoord, color)
+
+
+@ti.data_oriented
+class DeferredShading:
+    def __init__(self, img, lighting, mtltab, norm=None, coor=None, mtlid=None,
+            pixel_order='scanline'):
+        '''
+        :param img: (Vector.field) image to shade into
+        :param lighting: (Lighting | SkyboxLighting) lighting of the scene
+        :param mtltab: (MaterialTable) materials indexed by material id
+        :param norm: (Vector.field) normal buffer to share, allocated if not specified
+        :param coor: (Vector.field) texcoord buffer to share, allocated if not specified
+        :param mtlid: (field) material id buffer to share, allocated if not specified
+
+        Shades every pixel once in screen space from a G-buffer written by
+        the geometry pass, so that the number of rasterization kernels does
+        not grow with the number of materials
+
+        :note: position is reconstructed from engine.depth, like SSR does
+        '''
+
+        self.res = tovector(img.shape)
+        self.order = tina.make_pixel_order(self.res, pixel_order)
+        self.img = img
+        self.lighting = lighting
+        self.mtltab = mtltab
+        self.norm = norm if norm is not None else ti.Vector.field(3, float, self.res)
+        self.coor = coor if coor is not None else ti.Vector.field(2, float, self.res)
+        self.mtlid = mtlid if mtlid is not None else ti.field(int, self.res)
+        self.color = ti.Vector.field(3, float, self.res)
+        self.shader = GBufferShader(self)
+
+        ti.materialize_callback(self.clear_buffer)
+
+    @ti.kernel
+    def clear_buffer(self):
+        for P in ti.grouped(self.mtlid):
+            self.norm[P] = 0
+            self.mtlid[P] = -1
+
+    def render(self, engine):
+        '''
+        :param engine: (Engine) engine holding the depth of the geometry pass
+
+        Resolve the G-buffer into self.img, background pixels are left untouched
+        '''
+
+        # recompiles when materials are added to the table
+        self._render(engine, len(self.mtltab.materials))
+
+    @ti.kernel
+    def _render(self, engine: ti.template(), nmaterials: ti.template()):
+        for i in range(ti.static(self.order.get_nthreads())):
+            P = self.order.get_pixel(i)
+            if not self.order.contains(P):
+                continue
+            if self.mtlid[P] != -1:
+                self.render_at(engine, P)
+
+    @ti.func
+    def render_at(self, engine, P):
+        normal = self.norm[P]
+        p = P + engine.bias[None]
+        vpos = V23(engine.from_viewport(p), engine.depth[P] / engine.maxdepth)
+        pos = mapply_pos(engine.V2W[None], vpos)
+        viewdir = calc_viewdir(engine, p)
+        material = self.mtltab.get(self.mtlid[P])
+
+        tina.Input.spec_g_pars({
+            'pos': pos,
+            'color': self.color[P],
+            'normal': normal,
+            'texcoord': self.coor[P],
+        })
+
+        self.img[P] = self.lighting.shade_color(material, pos, normal, viewdir)
+
+        tina.Input.clear_g_pars()
@@ -9,7 +9,14 @@ class Engine:
         self.res = tovector((res_x, res_y) if isinstance(res_x, int) else res_x)
 
         self.depth = ti.field(int, self.res)
-        self.maxdepth = 2**30
+        self.maxdepth = 2**23 - 1
+
+        # visibility buffer: (depth << 40) | (drawid << 24) | primitive
+        self.vbuf = ti.field(ti.i64, self.res)
+        self.drawid = ti.field(int, ())
+        self.ndraws = 0
+        self.maxdraws = 2**16
+        self.maxprims = 2**24
 
         self.W2V = ti.Matrix.field(4, 4, float, ())
         self.V2W = ti.Matrix.field(4, 4, float, ())
@@ -52,6 +59,40 @@ class Engine:
     def to_viewspace(self, p):
         return mapply_pos(self.W2V[None], p)
 
+    @ti.func
+    def outside_frustum(self, bmin, bmax):
+        '''
+        :return: 1 if the world space box is entirely outside one of the clipping planes
+        '''
+
+        outcode = 63
+        for i in ti.static(range(8)):
+            corner = V(bmax.x if i & 1 else bmin.x,
+                       bmax.y if i & 2 else bmin.y,
+                       bmax.z if i & 4 else bmin.z)
+            outcode &= self.clip_outcode(self.to_clipspace(corner))
+        return int(outcode != 0)
+
+    @ti.func
+    def to_clipspace(self, p):
+        res, rew = mapply(self.W2V[None], p, 1)
+        return V34(res, rew)
+
+    @ti.func
+    def clip_outcode(self, h):
+        '''
+        :param h: (Vector) clip space position
+        :return: (int) bit mask of the clipping planes h is outside of
+        '''
+
+        code = 0
+        for k in ti.static(range(3)):
+            if h[k] < -h.w:
+                code |= 1 << k * 2
+            if h[k] > h.w:
+                code |= 2 << k * 2
+        return code
+
     @ti.func
     def from_viewspace(self, p):
         return mapply_pos(self.V2W[None], p)
@@ -64,10 +105,85 @@ class Engine:
     def from_viewport(self, p):
         return p / self.res * 2 - 1
 
-    @ti.kernel
     def clear_depth(self):
+        self._clear_depth()
+        self.begin_frame()
+
+    @ti.kernel
+    def _clear_depth(self):
         for P in ti.grouped(self.depth):
-            self.depth[P] = self.maxdepth
+            self.clear_at(P)
+
+    @ti.func
+    def clear_at(self, P):
+        # keys with the max depth never resolve, whatever their draw id
+        self.depth[P] = self.maxdepth
+        self.vbuf[P] = ti.cast(self.maxdepth, ti.i64) << 40
+
+    def pixel_traffic(self):
+        return 0, 4 + 8
+
+    def begin_frame(self):
+        '''
+        Restart the draw ids, call this whenever the visibility buffer is
+        cleared other than by clear_depth, e.g. through clear_at
+        '''
+
+        self.ndraws = 0
+        self._set_drawid(0)
+
+    def begin_draw(self):
+        '''
+        Start a new draw, primitives written by the following rasterization
+        pass are resolved by the matching resolve_visibility pass
+
+        :note: at most maxdraws - 1 draws between two calls to begin_frame
+        '''
+
+        if self.ndraws + 1 >= self.maxdraws:
+            raise RuntimeError(f'Too many draws! at most {self.maxdraws - 1} per frame')
+        self.ndraws += 1
+        self._set_drawid(self.ndraws)
+
+    @ti.kernel
+    def _set_drawid(self, drawid: int):
+        self.drawid[None] = drawid
+
+    @ti.func
+    def make_visibility_key(self, depth, f):
+        return (ti.cast(depth, ti.i64) << 40) | (ti.cast(
+            self.drawid[None], ti.i64) << 24) | ti.cast(f, ti.i64)
+
+    @ti.func
+    def write_visibility(self, P, depth, f):
+        '''
+        Atomically keep the closest primitive of a pixel, depth and
+        primitive id are packed into one 64-bit word so they never tear
+
+        :return: 1 if the primitive is the closest so far
+
+        :note: depths outside [-maxdepth, maxdepth] are dropped, they would overflow the key
+        '''
+
+        won = 0
+        if -self.maxdepth <= depth <= self.maxdepth:
+            key = self.make_visibility_key(depth, f)
+            if ti.atomic_min(self.vbuf[P], key) > key:
+                ti.atomic_min(self.depth[P], depth)
+                won = 1
+        return won
+
+    @ti.func
+    def resolve_visibility(self, P):
+        '''
+        :return: the closest primitive of a pixel if it belongs to the current draw, -1 otherwise
+        '''
+
+        key = self.vbuf[P]
+        f = -1
+        if key >> 40 < self.maxdepth and (key >> 24) & (self.maxdraws - 1) == self.drawid[None]:
+            f = int(key & (self.maxprims - 1))
+        return f
 
     def set_camera(self, view, proj):
         W2V = proj @ view
@@ -0,0 +1,213 @@
+from ..advans import *
+from .shader import calc_view_ray
+
+
+@ti.data_oriented
+class FluidRaster:
+    def __init__(self, engine, maxpars=MAX, smoothing=4.0, maxblur=16,
+            niters=2, range_scale=2.0, absorption=0.0, **extra_options):
+        '''
+        :param engine: (Engine) the engine to draw into
+        :param maxpars: (int) max number of particles
+        :param smoothing: (float) radius of the depth smoothing filter, in particle radii
+        :param maxblur: (int) max radius of the depth smoothing filter, in pixels
+        :param niters: (int) number of depth smoothing iterations
+        :param range_scale: (float) depth range of the smoothing filter, in particle radii
+        :param absorption: (float | 3 * [float]) absorption coefficient of the liquid, per world unit of thickness
+
+        Screen-space fluid rendering (van der Laan et al. 2009), particles
+        are drawn as depth sprites by a ParticleRaster, their depth is
+        smoothed by a narrow-range filter (Truong and Yuksel 2018), and
+        normals are reconstructed from the smoothed surface for shading
+
+        The particle color is attenuated by exp(-absorption * thickness),
+        where the thickness is accumulated over all particles of a pixel
+
+        :note: add particles to scene with raster=FluidRaster(scene.engine) to render them as liquid
+        '''
+
+        self.engine = engine
+        self.res = self.engine.res
+        self.smoothing = smoothing
+        self.maxblur = maxblur
+        self.niters = niters
+        self.range_scale = range_scale
+        self.pars = tina.ParticleRaster(engine, maxpars, **extra_options)
+
+        # ray distance of the surface, -1 for no liquid
+        self.tbuf = ti.field(float, self.res)
+        self.torig = ti.field(float, self.res)
+        self.tmp = ti.field(float, self.res)
+        self.frad = ti.field(float, self.res)
+        self.thick = ti.field(float, self.res)
+        self.absorption = ti.Vector.field(3, float, ())
+
+        @ti.materialize_callback
+        def init_absorption():
+            self.absorption[None] = absorption if isinstance(absorption,
+                    (tuple, list)) else [absorption] * 3
+
+    def set_object(self, pars):
+        '''
+        :param pars: (Pars) the particles to be rendered as liquid next
+        '''
+
+        self.pars.set_object(pars)
+
+    def render_occup(self):
+        self.pars.render_occup()
+        self._extract(self.pars.source)
+        for i in range(self.niters):
+            self._smooth(self.tbuf, self.tmp, 0)
+            self._smooth(self.tmp, self.tbuf, 1)
+        self._resolve()
+        self.thick.fill(0)
+        self._accumulate(self.pars.source)
+
+    @ti.kernel
+    def _extract(self, src: ti.template()):
+        for P in ti.grouped(self.tbuf):
+            self.tbuf[P] = -1
+            f = self.engine.resolve_visibility(P)
+            if f == -1:
+                continue
+
+            # depth of the sphere surface rather than of the flat sprite
+            p = float(P) + self.engine.bias[None]
+            ro, rd = calc_view_ray(self.engine, p)
+            Al = src.get_particle_position(f)
+            Rl = src.get_particle_radius(f)
+            oc = ro - Al
+            b = oc.dot(rd)
+            c = oc.norm_sqr() - Rl**2
+            self.tbuf[P] = max(0, -b - ti.sqrt(max(0, b**2 - c)))
+            self.torig[P] = self.tbuf[P]
+            self.frad[P] = Rl
+
+    @ti.func
+    def pixel_size(self, p, t):
+        ro, rd = calc_view_ray(self.engine, p)
+        ro1, rd1 = calc_view_ray(self.engine, p + V(1., 0.))
+        return max((ro1 + rd1 * t - ro - rd * t).norm(), eps)
+
+    @ti.kernel
+    def _smooth(self, src: ti.template(), dst: ti.template(), axis: ti.template()):
+        for P in ti.grouped(dst):
+            t0 = src[P]
+            dst[P] = t0
+            if t0 < 0:
+                continue
+
+            Rl = self.frad[P]
+            p = float(P) + self.engine.bias[None]
+            r = min(int(self.smoothing * Rl / self.pixel_size(p, t0)), self.maxblur)
+            sigma = max(r, 1) * 0.5
+            thresh = Rl * self.range_scale
+            tsum, wsum = 0.0, 0.0
+            for k in range(-r, r + 1):
+                Q = P + V(k * (1 - axis), k * axis)
+                Q = clamp(Q, 0, self.res - 1)
+                t = src[Q]
+                if t < 0 or t > t0 + thresh:  # background, or surfaces behind
+                    continue
+                t = max(t, t0 - thresh)  # narrow range, clamp surfaces in front
+                w = ti.exp(-0.5 * (k / sigma)**2)
+                tsum += w * t
+                wsum += w
+            if wsum > 0:
+                dst[P] = tsum / wsum
+
+    @ti.func
+    def get_surface_pos(self, P):
+        p = float(P) + self.engine.bias[None]
+        ro, rd = calc_view_ray(self.engine, p)
+        return ro + rd * self.tbuf[P]
+
+    @ti.kernel
+    def _resolve(self):
+        for P in ti.grouped(self.tbuf):
+            f = self.engine.resolve_visibility(P)
+            if f == -1 or self.tbuf[P] < 0:
+                continue
+
+            # smoothing may only pull the surface forward, pushing it back
+            # would put the liquid behind what it occluded in the depth test
+            self.tbuf[P] = min(self.tbuf[P], self.torig[P])
+
+            # later draws and post-processing see the smoothed surface
+            pos = self.get_surface_pos(P)
+            depth = clamp(self.engine.to_viewspace(pos).z, -1, 1)
+            idepth = int(depth * self.engine.maxdepth)
+            self.engine.vbuf[P] = self.engine.make_visibility_key(idepth, f)
+            self.engine.depth[P] = idepth
+
+    @ti.kernel
+    def _accumulate(self, src: ti.template()):
+        for f in ti.smart(self.pars.get_particles_range()):
+            Av, Rv = self.pars.cen[f], self.pars.rad[f]
+            if not -1 <= Av.z <= 1:
+                continue
+            Rl = src.get_particle_radius(f)
+            a = self.engine.to_viewport(Av)
+            r = Rv * 0.5 * self.res
+            if all(r < 0.5):
+                # sub-pixel, spread the sphere volume over its pixel
+                P = ifloor(a - self.engine.bias[None] + 0.5)
+                if all(P >= 0) and all(P < self.res):
+                    self.thick[P] += 4 / 3 * ti.pi * Rl * r.x * r.y
+                continue
+
+            bot, top = ifloor(a - r), iceil(a + r)
+            bot, top = max(bot, 0), min(top, self.res - 1)
+            for P in ti.grouped(ti.ndrange((bot.x, top.x + 1), (bot.y, top.y + 1))):
+                p = float(P) + self.engine.bias[None]
+                d = (self.engine.from_viewport(p) - Av.xy) / Rv
+                if d.norm_sqr() <= 1:
+                    self.thick[P] += 2 * Rl * ti.sqrt(1 - d.norm_sqr())
+
+    @ti.func
+    def get_surface_delta(self, P, E):
+        # take the side closer in depth, so that edges stay sharp
+        pos, t0 = self.get_surface_pos(P), self.tbuf[P]
+        Qn, Qp = min(P + E, self.res - 1), max(P - E, 0)
+        tn, tp = self.tbuf[Qn], self.tbuf[Qp]
+        ret = V(0., 0., 0.)
+        if tn >= 0 and (tp < 0 or abs(tn - t0) <= abs(tp - t0)):
+            ret = self.get_surface_pos(Qn) - pos
+        elif tp >= 0:
+            ret = pos - self.get_surface_pos(Qp)
+        return ret
+
+    @ti.func
+    def get_surface_normal(self, P):
+        DX = self.get_surface_delta(P, V(1, 0))
+        DY = self.get_surface_delta(P, V(0, 1))
+        normal = DX.cross(DY).normalized()
+        p = float(P) + self.engine.bias[None]
+        ro, rd = calc_view_ray(self.engine, p)
+        if normal.dot(rd) > 0:
+            normal = -normal
+        return normal
+
+    def render_color(self, shader):
+        self._render_color(shader, self.pars.source)
+
+    @ti.kernel
+    def _render_color(self, shader: ti.template(), src: ti.template()):
+        for P in ti.grouped(self.engine.vbuf):
+            f = self.engine.resolve_visibility(P)
+            if f == -1 or self.tbuf[P] < 0:
+                continue
+
+            p = float(P) + self.engine.bias[None]
+            pos = self.get_surface_pos(P)
+            normal = self.get_surface_normal(P)
+            texcoord = V(0., 0.)
+            color = src.get_particle_color(f)
+            color *= ti.exp(-self.absorption[None] * self.thick[P])
+
+            if ti.static(hasattr(shader, 'shade_material')):
+                mtlid = self.pars.get_source_mtlid(src, f)
+                shader.shade_material(mtlid, self.engine, P, p, f, pos, normal, texcoord, color)
+            else:
+                shader.shade_color(self.engine, P, p, f, pos, normal, texcoord, color)
@@ -0,0 +1,109 @@
+from ..advans import *
+
+
+@ti.data_oriented
+class DepthPyramid:
+    def __init__(self, res, op='max'):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param op: (str) 'max' keeps the farthest depth of each texel, for occlusion culling; 'min' keeps the nearest, for ray marching
+
+        Hierarchical depth buffer, each level halves the resolution of the
+        previous one and reduces 2x2 texels of it with op
+        '''
+
+        assert op in ['max', 'min'], op
+        self.res = tovector(res)
+        self.op = op
+        self.levels = []
+        size = self.res.entries
+        while True:
+            self.levels.append(ti.field(int, size))
+            if max(size) <= 1:
+                break
+            size = [(s + 1) // 2 for s in size]
+        self.nlevels = len(self.levels)
+
+    @ti.func
+    def reduce(self, a, b):
+        ret = a
+        if ti.static(self.op == 'max'):
+            ret = max(a, b)
+        else:
+            ret = min(a, b)
+        return ret
+
+    @ti.kernel
+    def build(self, engine: ti.template()):
+        '''
+        :param engine: (Engine) engine whose depth buffer is to be reduced
+        '''
+
+        for P in ti.grouped(self.levels[0]):
+            self.levels[0][P] = engine.depth[P]
+        for l in ti.static(range(1, self.nlevels)):
+            src, dst = ti.static(self.levels[l - 1], self.levels[l])
+            top = ti.Vector(src.shape) - 1
+            for P in ti.grouped(dst):
+                val = src[P * 2]
+                for Q in ti.static(ti.grouped(ti.ndrange(2, 2))):
+                    val = self.reduce(val, src[min(P * 2 + Q, top)])
+                dst[P] = val
+
+    @ti.func
+    def query(self, bot, top):
+        '''
+        :return: the reduced depth over the pixels from bot to top, inclusive
+        '''
+
+        # coarsest level where the rectangle spans at most 2x2 texels
+        size = max(top - bot)
+        level = 0
+        while (size >> level) > 1 and level < self.nlevels - 1:
+            level += 1
+
+        ret = self.levels[0][bot]
+        for l in ti.static(range(self.nlevels)):
+            if level == l:
+                lo, hi = bot >> l, top >> l
+                for P in ti.grouped(ti.ndrange((lo.x, hi.x + 1), (lo.y, hi.y + 1))):
+                    ret = self.reduce(ret, self.levels[l][P])
+        return ret
+
+    @ti.func
+    def occluded(self, engine, bmin, bmax):
+        '''
+        :param engine: (Engine) engine whose camera the pyramid was built with
+        :param bmin: (Vector) minimum corner of a world space bounding box
+        :param bmax: (Vector) maximum corner of a world space bounding box
+        :return: 1 if the box is certainly hidden behind the reduced depth
+
+        :note: only meaningful for op='max'
+        '''
+
+        ret = 1
+        vmin, vmax = V(inf, inf, inf), V(-inf, -inf, -inf)
+        for i in ti.static(range(8)):
+            corner = V(bmax.x if i & 1 else bmin.x,
+                       bmax.y if i & 2 else bmin.y,
+                       bmax.z if i & 4 else bmin.z)
+            res, rew = mapply(engine.W2V[None], corner, 1)
+            if rew <= 0:  # behind the camera, cannot tell
+                ret = 0
+            else:
+                v = res / rew
+                vmin, vmax = min(vmin, v), max(vmax, v)
+
+        if ret and vmin.z < -1:  # crosses the near plane
+            ret = 0
+
+        if ret:
+            # pad one pixel for the sub-pixel jitter of TAA
+            bot = ifloor(engine.to_viewport(vmin)) - 1
+            top = iceil(engine.to_viewport(vmax)) + 1
+            bot, top = max(bot, 0), min(top, self.res - 1)
+            if all(bot <= top):
+                depth = int(min(vmin.z, 1.0) * engine.maxdepth)
+                if depth <= self.query(bot, top):
+                    ret = 0
+        return ret
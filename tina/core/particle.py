@@ -1,24 +1,64 @@
-from ..common import *
+from ..advans import *
+
+
+@ti.kernel
+def _pre_compute_pars_npars(pars: ti.template()) -> int:
+    pars.pre_compute()
+    return pars.get_npars()
 
 
 @ti.data_oriented
 class ParticleRaster:
     def __init__(self, engine, maxpars=MAX, coloring=True,
-            clipping=True, **extra_options):
+            clipping=True, maxobjects=1024, binning=True, tilesize=8,
+            maxbinned=None, **extra_options):
+        '''
+        :param engine: (Engine) the engine to draw into
+        :param maxpars: (int) max number of particles
+        :param coloring: (bool) whether particles have colors of their own
+        :param clipping: (bool) whether to skip particles outside the near and far planes
+        :param maxobjects: (int) max number of particle objects kept in the cache
+        :param binning: (bool) bin particles larger than a pixel into screen tiles
+        :param tilesize: (int) edge length of a screen tile in pixels
+        :param maxbinned: (int) capacity of the tile lists, see TileBinner
+
+        Particles smaller than a pixel on screen are splatted into the
+        single pixel nearest to their center
+
+        Objects with zero_copy set, like FieldParticles, are read directly
+        from their fields when drawn alone, without copying into the cache
+        '''
+
         self.engine = engine
         self.res = self.engine.res
         self.maxpars = maxpars
         self.coloring = coloring
         self.clipping = clipping
 
-        self.occup = ti.field(int, self.res)
+        assert maxpars <= self.engine.maxprims, maxpars
 
+        self.base = ti.field(int, ())
         self.npars = ti.field(int, ())
+        self.cache = tina.ObjectCache(maxpars, maxobjects, self._kill_range)
+        self.source = self  # where the particles are read from
+        self.direct_mtlid = ti.field(int, ())
+        self.objids = ti.field(int, maxpars)
+        ti.materialize_callback(lambda: self.objids.fill(-1))
+        self.objmtl = ti.field(int, maxobjects)
         self.verts = ti.Vector.field(3, float, maxpars)
         self.sizes = ti.field(float, maxpars)
         if self.coloring:
             self.colors = ti.Vector.field(3, float, maxpars)
 
+        # view space center and radii, computed once per draw
+        self.cen = ti.Vector.field(3, float, maxpars)
+        self.rad = ti.Vector.field(2, float, maxpars)
+
+        self.binning = binning
+        if self.binning:
+            self.binner = tina.TileBinner(self.engine, maxpars,
+                    tilesize, maxbinned or maxpars)
+
         @ti.materialize_callback
         def init_pars():
             self.sizes.fill(0.1)
@@ -27,9 +67,17 @@ class ParticleRaster:
 
     @ti.func
     def get_particles_range(self):
-        for i in range(self.npars[None]):
+        for i in range(self.base[None], self.base[None] + self.npars[None]):
             yield i
 
+    @ti.func
+    def get_particle_mtlid(self, f):
+        objid = self.objids[f]
+        mtlid = -1
+        if objid != -1:
+            mtlid = self.objmtl[objid]
+        return mtlid
+
     @ti.func
     def get_particle_position(self, f):
         return self.verts[f]
@@ -42,10 +90,18 @@ class ParticleRaster:
     def get_particle_color(self, f):
         return self.colors[f]
 
+    def set_particles(self, verts):
+        self.source = self
+        self.cache.clear()  # the ranges of cached objects are overwritten
+        self._set_particles(verts)
+
     @ti.kernel
-    def set_particles(self, verts: ti.ext_arr()):
+    def _set_particles(self, verts: ti.ext_arr()):
+        self.base[None] = 0
         self.npars[None] = min(verts.shape[0], self.verts.shape[0])
+        self.objmtl[0] = 0
         for i in range(self.npars[None]):
+            self.objids[i] = 0
             for k in ti.static(range(3)):
                 self.verts[i][k] = verts[i, k]
 
@@ -61,88 +117,223 @@ class ParticleRaster:
             for k in ti.static(range(3)):
                 self.colors[i][k] = colors[i, k]
 
+    def set_object(self, pars):
+        '''
+        :param pars: (Pars) the particles to be rasterized next
+
+        Particles of each object are kept in a range of their own, and only
+        uploaded again when the object version changes
+        '''
+
+        if getattr(pars, 'zero_copy', False):
+            npars = _pre_compute_pars_npars(pars)
+            if npars > self.maxpars:
+                raise RuntimeError(f'Out of memory! {npars} particles, '
+                        f'increase maxpars (currently {self.maxpars})')
+            self.source = pars
+            self._select_direct(npars)
+            return
+
+        self.source = self
+        entry = self.cache.acquire(pars,
+                lambda: _pre_compute_pars_npars(pars),
+                lambda entry: self._set_object(pars, entry.base, entry.size, entry.slot))
+        self._select_object(entry.base, entry.size, entry.slot)
+
+    def set_objects(self, objects):
+        '''
+        :param objects: (list) pairs of (Pars, int), particles and their material ids
+
+        Select several particle objects to be rasterized and shaded together,
+        a ShaderTable passed to render_color picks the shader by material id
+        '''
+
+        assert not any(getattr(pars, 'zero_copy', False) for pars, mtlid in objects), \
+                'zero-copy particles cannot be batched, use set_object'
+        self.source = self
+        entries = self.cache.acquire_all([pars for pars, mtlid in objects],
+                lambda pars: _pre_compute_pars_npars(pars),
+                lambda pars, entry: self._set_object(pars, entry.base, entry.size, entry.slot))
+        objmtl = np.full(self.cache.maxobjects, -1, dtype=np.int32)
+        for entry, (pars, mtlid) in zip(entries, objects):
+            objmtl[entry.slot] = mtlid
+        self.objmtl.from_numpy(objmtl)
+        self._select_range(0, self.cache.get_top())
+
     @ti.kernel
-    def set_object(self, pars: ti.template()):
-        pars.pre_compute()
-        self.npars[None] = pars.get_npars()
-        for i in range(self.npars[None]):
+    def _select_range(self, base: int, npars: int):
+        self.base[None] = base
+        self.npars[None] = npars
+
+    @ti.kernel
+    def _select_object(self, base: int, npars: int, slot: int):
+        self.base[None] = base
+        self.npars[None] = npars
+        self.objmtl[slot] = 0
+
+    @ti.kernel
+    def _select_direct(self, npars: int):
+        self.base[None] = 0
+        self.npars[None] = npars
+        self.direct_mtlid[None] = 0
+
+    @ti.kernel
+    def _kill_range(self, base: int, size: int):
+        for i in range(base, base + size):
+            self.objids[i] = -1
+
+    @ti.kernel
+    def _set_object(self, pars: ti.template(), base: int, npars: int, slot: int):
+        for i in range(npars):
+            j = base + i
+            self.objids[j] = slot
             vert = pars.get_particle_position(i)
-            self.verts[i] = vert
+            self.verts[j] = vert
             size = pars.get_particle_radius(i)
-            self.sizes[i] = size
+            self.sizes[j] = size
             if ti.static(self.coloring):
                 color = pars.get_particle_color(i)
-                self.colors[i] = color
+                self.colors[j] = color
+
+    @ti.func
+    def get_camera_axes(self):
+        DXl = mapply_dir(self.engine.V2W[None], V(1., 0., 0.)).normalized()
+        DYl = mapply_dir(self.engine.V2W[None], V(0., 1., 0.)).normalized()
+        Zl = mapply_dir(self.engine.V2W[None], V(0., 0., 1.)).normalized()
+        return DXl, DYl, Zl
+
+    @ti.func
+    def get_source_mtlid(self, src, f):
+        mtlid = -1
+        if ti.static(src is self):
+            mtlid = self.get_particle_mtlid(f)
+        else:
+            mtlid = self.direct_mtlid[None]
+        return mtlid
+
+    @ti.func
+    def setup_particle(self, src, f):
+        '''
+        :return: whether the particle is visible, whether it is to be splatted, and its screen rectangle
+
+        The projected center and radii are kept for prim_depth and
+        render_color, so that they are computed once per particle
+        '''
+
+        visible = 1
+        if self.get_source_mtlid(src, f) == -1:
+            visible = 0
+        Al = src.get_particle_position(f)
+        Rl = src.get_particle_radius(f)
+        Av = self.engine.to_viewspace(Al)
+        if ti.static(self.clipping):
+            if not -1 <= Av.z <= 1:
+                visible = 0
+
+        DXl, DYl, Zl = self.get_camera_axes()
+        Rv = V(self.engine.to_viewspace(Al + DXl * Rl).x - Av.x,
+               self.engine.to_viewspace(Al + DYl * Rl).y - Av.y)
+        Rv = max(abs(Rv), eps)
+        self.cen[f] = Av
+        self.rad[f] = Rv
+
+        a = self.engine.to_viewport(Av)
+        r = Rv * 0.5 * self.res
+        splat = 0
+        bot, top = ifloor(a - r), iceil(a + r)
+        if all(r < 0.5):
+            # sub-pixel, the pixel whose sample is nearest to the center
+            splat = 1
+            bot = ifloor(a - self.engine.bias[None] + 0.5)
+            top = bot
+            if any(bot < 0) or any(bot >= self.res):
+                visible = 0
+        bot, top = max(bot, 0), min(top, self.res - 1)
+        if any(bot > top):
+            visible = 0
+        return visible, splat, bot, top
+
+    @ti.func
+    def prim_depth(self, f, p):
+        Av, Rv = self.cen[f], self.rad[f]
+        d = (self.engine.from_viewport(p) - Av.xy) / Rv
+        inside = 0
+        if d.norm_sqr() <= 1:
+            inside = 1
+        return inside, Av.z
+
+    @ti.func
+    def rasterize_prim(self, f, bot, top):
+        for P in ti.grouped(ti.ndrange((bot.x, top.x + 1), (bot.y, top.y + 1))):
+            p = float(P) + self.engine.bias[None]
+            inside, depth = self.prim_depth(f, p)
+            if inside:
+                self.engine.write_visibility(P, int(depth * self.engine.maxdepth), f)
 
-    @ti.kernel
     def render_occup(self):
-        for P in ti.grouped(self.occup):
-            self.occup[P] = -1
+        self.engine.begin_draw()
+        if not self.binning:
+            self._render_occup(self.source)
+            return
+
+        self.binner.clear()
+        self._bin_setup(self.source)
+        self.binner.render(self)
+
+    @ti.kernel
+    def _render_occup(self, src: ti.template()):
         for f in ti.smart(self.get_particles_range()):
-            Al = self.get_particle_position(f)
-            Rl = self.get_particle_radius(f)
-            Av = self.engine.to_viewspace(Al)
-            if ti.static(self.clipping):
-                if not -1 <= Av.z <= 1:
-                    continue
-
-            DXl = mapply_dir(self.engine.V2W[None], V(1., 0., 0.)).normalized()
-            DYl = mapply_dir(self.engine.V2W[None], V(0., 1., 0.)).normalized()
-            Rv = V(0., 0.)
-            Rv.x = self.engine.to_viewspace(Al + DXl * Rl).x - Av.x
-            Rv.y = self.engine.to_viewspace(Al + DYl * Rl).y - Av.y
-            Bv = [
-                    Av - V(Rv.x, 0., 0.),
-                    Av + V(Rv.x, 0., 0.),
-                    Av - V(0., Rv.y, 0.),
-                    Av + V(0., Rv.y, 0.),
-            ]
-            a = self.engine.to_viewport(Av)
-            b = [self.engine.to_viewport(Bv) for Bv in Bv]
-
-            bot, top = ifloor(min(b[0], b[2])), iceil(max(b[1], b[3]))
-            bot, top = max(bot, 0), min(top, self.res - 1)
-            for P in ti.grouped(ti.ndrange((bot.x, top.x + 1), (bot.y, top.y + 1))):
-                p = float(P) + self.engine.bias[None]
-                Pv = V23(self.engine.from_viewport(p), Av.z)
-                Pl = self.engine.from_viewspace(Pv)
-                if (Pl - Al).norm_sqr() > Rl**2:
-                    continue
-
-                depth_f = Av.z
-                depth = int(depth_f * self.engine.maxdepth)
-                if ti.atomic_min(self.engine.depth[P], depth) > depth:
-                    if self.engine.depth[P] >= depth:
-                        self.occup[P] = f
+            visible, splat, bot, top = self.setup_particle(src, f)
+            if not visible:
+                continue
+            if splat:
+                depth = int(self.cen[f].z * self.engine.maxdepth)
+                self.engine.write_visibility(bot, depth, f)
+            else:
+                self.rasterize_prim(f, bot, top)
 
     @ti.kernel
-    def render_color(self, shader: ti.template()):
-        for P in ti.grouped(self.occup):
-            f = self.occup[P]
-            if f == -1:
+    def _bin_setup(self, src: ti.template()):
+        for f in ti.smart(self.get_particles_range()):
+            visible, splat, bot, top = self.setup_particle(src, f)
+            if not visible:
                 continue
+            if splat:
+                depth = int(self.cen[f].z * self.engine.maxdepth)
+                self.engine.write_visibility(bot, depth, f)
+            else:
+                self.binner.add(f, bot, top)
+
+    def render_color(self, shader):
+        self._render_color(shader, self.source)
 
-            Al = self.get_particle_position(f)
-            Rl = self.get_particle_radius(f)
-            Av = self.engine.to_viewspace(Al)
-            DXl = mapply_dir(self.engine.V2W[None], V(1., 0., 0.)).normalized()
-            DYl = mapply_dir(self.engine.V2W[None], V(0., 1., 0.)).normalized()
-            Rv = V(0., 0.)
-            Rv.x = self.engine.to_viewspace(Al + DXl * Rl).x - Av.x
-            Rv.y = self.engine.to_viewspace(Al + DYl * Rl).y - Av.y
+    @ti.kernel
+    def _render_color(self, shader: ti.template(), src: ti.template()):
+        for P in ti.grouped(self.engine.vbuf):
+            f = self.engine.resolve_visibility(P)
+            if f == -1:
+                continue
 
+            Al = src.get_particle_position(f)
+            Rl = src.get_particle_radius(f)
+            Av, Rv = self.cen[f], self.rad[f]
             p = float(P) + self.engine.bias[None]
-            Pv = V23(self.engine.from_viewport(p), Av.z)
-            Pl = self.engine.from_viewspace(Pv)
+            d = (self.engine.from_viewport(p) - Av.xy) / Rv
+            if all(Rv * 0.5 * self.res < 0.5):
+                # splatted, the pixel stands for the whole particle, face the camera
+                d = V(0., 0.)
 
-            Dl = (Pl - Al) / Rl
-            Zl = mapply_dir(self.engine.V2W[None], V(0., 0., 1.)).normalized()
-            Dl -= Zl * ti.sqrt(1 - Dl.norm_sqr())
+            DXl, DYl, Zl = self.get_camera_axes()
+            Dl = DXl * d.x + DYl * d.y - Zl * ti.sqrt(max(0, 1 - d.norm_sqr()))
             Dl = Dl.normalized()
 
             normal = Dl
             pos = Al + Dl * Rl
             texcoord = V(0., 0.)
-            color = self.get_particle_color(f)
+            color = src.get_particle_color(f)
 
-            shader.shade_color(self.engine, P, p, f, pos, normal, texcoord, color)
+            if ti.static(hasattr(shader, 'shade_material')):
+                mtlid = self.get_source_mtlid(src, f)
+                shader.shade_material(mtlid, self.engine, P, p, f, pos, normal, texcoord, color)
+            else:
+                shader.shade_color(self.engine, P, p, f, pos, normal, texcoord, color)
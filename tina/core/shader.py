@@ -148,6 +148,28 @@ class ShaderGroup(IShader):
             shader.blend_color(*args)
 
 
+class ShaderTable(IShader):
+    def __init__(self, shaders=()):
+        '''
+        :param shaders: (list) shaders indexed by material id
+
+        Dispatches shading to the shader of each primitive's material,
+        used by rasters that draw several objects in one launch
+        '''
+
+        self.shaders = shaders
+
+    @ti.func
+    def shade_material(self, mtlid, engine, P, p, f, pos, normal, texcoord, color):
+        for i, shader in ti.static(enumerate(self.shaders)):
+            if mtlid == i:
+                shader.shade_color(engine, P, p, f, pos, normal, texcoord, color)
+
+    @ti.func
+    def shade_color(self, engine, P, p, f, pos, normal, texcoord, color):
+        self.shade_material(0, engine, P, p, f, pos, normal, texcoord, color)
+
+
 class RTXShader(IShader):
     def __init__(self, img, lighting, geom, material):
         super().__init__(img)
@@ -181,3 +203,15 @@ class BackgroundShader(IShader):
     def shade_background(self, P, dir):
         res = self.lighting.background(dir)
         self.img[P] = res
+
+    @ti.func
+    def apply_at(self, engine, image, P, color):
+        # as a post-processing stage, see PostPipeline
+        ret = color
+        if engine.depth[P] >= engine.maxdepth:
+            ro, rd = calc_view_ray(engine, float(P) + engine.bias[None])
+            ret = self.lighting.background(rd)
+        return ret
+
+    def pixel_traffic(self):
+        return 4, 0
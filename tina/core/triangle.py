@@ -1,10 +1,36 @@
-from ..common import *
+from ..advans import *
+
+
+@ti.kernel
+def _pre_compute_mesh_nfaces(mesh: ti.template()) -> int:
+    mesh.pre_compute()
+    return mesh.get_nfaces()
 
 
 @ti.data_oriented
 class TriangleRaster:
     def __init__(self, engine, maxfaces=MAX, smoothing=False, texturing=False,
-            culling=True, clipping=True, **extra_options):
+            culling=True, clipping=True, binning=True, tilesize=8,
+            maxbinned=None, maxobjects=1024, clustering=False, occlusion=False,
+            clustersize=64, maxinstances=4096, maxprims=None, **extra_options):
+        '''
+        :param engine: (Engine) the rasterization engine
+        :param maxfaces: (int) max number of faces
+        :param smoothing: (bool) interpolate vertex normals
+        :param texturing: (bool) interpolate texture coordinates
+        :param culling: (bool) skip back-facing faces
+        :param clipping: (bool) skip faces entirely outside the view cube
+        :param binning: (bool) bin faces into screen tiles and rasterize per pixel
+        :param tilesize: (int) edge length of a screen tile in pixels
+        :param maxbinned: (int) capacity of the tile lists, faces beyond it are rasterized per face, see TileBinner
+        :param maxobjects: (int) max number of meshes kept in the face buffers
+        :param clustering: (bool) keep bounds of meshes and face clusters for cull_clusters
+        :param occlusion: (bool) the same as clustering, for a Scene with occlusion culling
+        :param clustersize: (int) number of faces in a cluster
+        :param maxinstances: (int) max number of instances of InstancedMesh, 0 to expand them as plain meshes
+        :param maxprims: (int) max number of faces after instancing, maxfaces by default
+        '''
+
         self.engine = engine
         self.res = self.engine.res
         self.maxfaces = maxfaces
@@ -13,23 +39,70 @@ class TriangleRaster:
         self.culling = culling
         self.clipping = clipping
 
-        self.occup = ti.field(int, self.res)
+        self.instancing = maxinstances > 0
+        self.maxprims = maxprims or maxfaces
+        assert self.maxprims <= self.engine.maxprims, self.maxprims
 
+        # faces selected for drawing, virtual face ids with instancing
+        self.base = ti.field(int, ())
         self.nfaces = ti.field(int, ())
+        self.ntop = ti.field(int, ())
+        self.clustering = clustering or occlusion
+        self.clustersize = clustersize if self.clustering else 1
+        self.cache = tina.ObjectCache(maxfaces, maxobjects, self._kill_range,
+                align=self.clustersize)
+        self.objids = ti.field(int, maxfaces)
+        ti.materialize_callback(lambda: self.objids.fill(-1))
+        self.objmtl = ti.field(int, maxobjects)
         self.verts = ti.Vector.field(3, float, (maxfaces, 3))
         if self.smoothing:
             self.norms = ti.Vector.field(3, float, (maxfaces, 3))
         if self.texturing:
             self.coors = ti.Vector.field(2, float, (maxfaces, 3))
 
-        self.bcn = ti.Vector.field(2, float, maxfaces)
-        self.can = ti.Vector.field(2, float, maxfaces)
-        self.boo = ti.Vector.field(2, float, maxfaces)
-        self.coo = ti.Vector.field(2, float, maxfaces)
-        self.wsc = ti.Vector.field(3, float, maxfaces)
+        if self.clustering:
+            nclusters = (maxfaces + self.clustersize - 1) // self.clustersize
+            self.cbmin = ti.Vector.field(3, float, nclusters)
+            self.cbmax = ti.Vector.field(3, float, nclusters)
+            self.obmin = ti.Vector.field(3, float, maxobjects)
+            self.obmax = ti.Vector.field(3, float, maxobjects)
+            self.objvis = ti.field(int, maxobjects)
+            self.cvisible = ti.field(int, nclusters)
+            # clusters that passed the occlusion test last frame
+            self.cprev = ti.field(int, nclusters)
+            self.drawpass = ti.field(int, ())
+            ti.materialize_callback(lambda: self.cvisible.fill(1))
+            ti.materialize_callback(lambda: self.cprev.fill(1))
+
+        # draws: ranges of virtual face ids, each of nfaces * ninstances,
+        # selected by set_objects; with no draws, face ids are stored ones
+        self.maxdraws = maxobjects
+        self.ndraws = ti.field(int, ())
+        self.dstart = ti.field(int, self.maxdraws)
+        self.dbase = ti.field(int, self.maxdraws)
+        self.dnfaces = ti.field(int, self.maxdraws)
+        self.dinst = ti.field(int, self.maxdraws)
+        self.dmtl = ti.field(int, self.maxdraws)
+
+        if self.instancing:
+            self.icache = tina.ObjectCache(maxinstances, maxobjects)
+            self.itrans = ti.Matrix.field(4, 4, float, maxinstances)
+            self.inorm = ti.Matrix.field(3, 3, float, maxinstances)
+            self.icolor = ti.Vector.field(3, float, maxinstances)
+            self.imtl = ti.field(int, maxinstances)
+            self.mtlmap = ti.field(int, maxobjects + maxinstances)
+
+        # inverse of the 2D homogeneous vertex matrix, and clip space z
+        self.edges = ti.Matrix.field(3, 3, float, self.maxprims)
+        self.clz = ti.Vector.field(3, float, self.maxprims)
+
+        self.binning = binning
+        if self.binning:
+            self.binner = tina.TileBinner(self.engine, self.maxprims,
+                    tilesize, maxbinned)
 
     @ti.func
-    def interpolate(self, shader: ti.template(), P, p, f, wei, A, B, C):
+    def interpolate(self, shader: ti.template(), P, p, f, wei, A, B, C, mtlid):
         pos = wei.x * A + wei.y * B + wei.z * C
 
         normal = V(0., 0., 0.)
@@ -45,109 +118,458 @@ class TriangleRaster:
             At, Bt, Ct = self.get_face_texcoords(f)
             texcoord = wei.x * At + wei.y * Bt + wei.z * Ct
 
-        color = V(1., 1., 1.)
-        shader.shade_color(self.engine, P, p, f, pos, normal, texcoord, color)
+        color = self.get_face_color(f)
+        if ti.static(hasattr(shader, 'shade_material')):
+            shader.shade_material(mtlid, self.engine, P, p, f, pos, normal, texcoord, color)
+        else:
+            shader.shade_color(self.engine, P, p, f, pos, normal, texcoord, color)
 
     @ti.func
     def get_faces_range(self):
-        for i in range(self.nfaces[None]):
+        for i in range(self.base[None], self.base[None] + self.nfaces[None]):
             yield i
 
+    @ti.func
+    def locate_face(self, f):
+        '''
+        :return: the stored face, its instance (-1 for none) and draw of a virtual face id
+        '''
+
+        face, inst, d = f, -1, -1
+        if self.ndraws[None] > 0:
+            lo, hi = 0, self.ndraws[None] - 1
+            while lo < hi:  # last draw starting at or before f
+                mid = (lo + hi + 1) // 2
+                if self.dstart[mid] <= f:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            d = lo
+            k = f - self.dstart[d]
+            n = max(self.dnfaces[d], 1)
+            face = self.dbase[d] + k % n
+            if self.dinst[d] != -1:
+                inst = self.dinst[d] + k // n
+        return face, inst, d
+
+    @ti.func
+    def get_face_mtlid(self, f):
+        face, inst, d = self.locate_face(f)
+        objid = self.objids[face]
+        mtlid = -1
+        if objid != -1:
+            if ti.static(self.instancing):
+                local = 0
+                if inst != -1:
+                    local = self.imtl[inst]
+                mtlid = self.mtlmap[self.dmtl[d] + local]
+            else:
+                mtlid = self.objmtl[objid]
+        return mtlid
+
     @ti.func
     def get_face_vertices(self, f):
-        A, B, C = self.verts[f, 0], self.verts[f, 1], self.verts[f, 2]
+        face, inst, d = self.locate_face(f)
+        A, B, C = self.verts[face, 0], self.verts[face, 1], self.verts[face, 2]
+        if ti.static(self.instancing):
+            if inst != -1:
+                A, B, C = [mapply_pos(self.itrans[inst], p) for p in [A, B, C]]
         return A, B, C
 
     @ti.func
     def get_face_normals(self, f):
-        A, B, C = self.norms[f, 0], self.norms[f, 1], self.norms[f, 2]
+        face, inst, d = self.locate_face(f)
+        A, B, C = self.norms[face, 0], self.norms[face, 1], self.norms[face, 2]
+        if ti.static(self.instancing):
+            if inst != -1:
+                A, B, C = [self.inorm[inst] @ n for n in [A, B, C]]
         return A, B, C
 
     @ti.func
     def get_face_texcoords(self, f):
-        A, B, C = self.coors[f, 0], self.coors[f, 1], self.coors[f, 2]
+        face, inst, d = self.locate_face(f)
+        A, B, C = self.coors[face, 0], self.coors[face, 1], self.coors[face, 2]
         return A, B, C
 
+    @ti.func
+    def get_face_color(self, f):
+        color = V(1., 1., 1.)
+        if ti.static(self.instancing):
+            face, inst, d = self.locate_face(f)
+            if inst != -1:
+                color = self.icolor[inst]
+        return color
+
+    def set_object(self, mesh):
+        '''
+        :param mesh: (Mesh) the mesh to be rasterized next
+
+        Faces of each mesh are kept in a range of their own, and only
+        uploaded again when the mesh version changes
+        '''
+
+        if self.instancing:
+            self.set_objects([(mesh, 0)])
+            return
+
+        entry = self.cache.acquire(mesh,
+                lambda: _pre_compute_mesh_nfaces(mesh),
+                lambda entry: self._upload_object(mesh, entry))
+        self._select_object(entry.base, entry.size, entry.slot, self.cache.get_top())
+
+    def set_objects(self, objects):
+        '''
+        :param objects: (list) pairs of (Mesh, int), meshes and their material ids
+
+        Select several meshes to be rasterized and shaded together, a
+        ShaderTable passed to render_color picks the shader by material id
+
+        :note: for an InstancedMesh, the material id may be a list indexed by its per-instance material ids
+        '''
+
+        meshes = [mesh.mesh if self._is_instanced(mesh) else mesh
+                for mesh, mtlid in objects]
+        mtlids = [mtlid[0] if isinstance(mtlid, (list, tuple)) else mtlid
+                for mesh, mtlid in objects]
+        entries = self.cache.acquire_all(meshes,
+                lambda mesh: _pre_compute_mesh_nfaces(mesh),
+                lambda mesh, entry: self._upload_object(mesh, entry))
+        objmtl = np.full(self.cache.maxobjects, -1, dtype=np.int32)
+        for entry, (mesh, _), mtlid in zip(entries, objects, mtlids):
+            if not self._is_instanced(mesh):
+                objmtl[entry.slot] = mtlid
+        self.objmtl.from_numpy(objmtl)
+
+        # only the faces of the given meshes are set up, not the whole cache
+        if len(objects) > self.maxdraws:
+            raise RuntimeError(f'Too many draws! {len(objects)} objects')
+        ientries = {}
+        if self.instancing:
+            instanced = [mesh for mesh, mtlid in objects if self._is_instanced(mesh)]
+            ientries = self.icache.acquire_all(instanced,
+                    lambda imesh: imesh.get_ninstances(),
+                    lambda imesh, entry: self._set_instances(imesh, entry.base, entry.size))
+            ientries = dict(zip(instanced, ientries))
+
+        draws = np.zeros((5, self.maxdraws), dtype=np.int32)
+        mtlmap = []
+        nprims = 0
+        for d, (entry, (mesh, mtlid)) in enumerate(zip(entries, objects)):
+            inst, ninst = -1, 1
+            if self._is_instanced(mesh):
+                # set_instances may have changed the ids since add_object
+                mesh.check_mtlids(len(mtlid) if isinstance(mtlid, (list, tuple)) else 1)
+                inst, ninst = ientries[mesh].base, ientries[mesh].size
+            draws[:, d] = nprims, entry.base, entry.size, inst, len(mtlmap)
+            mtlmap.extend(mtlid if isinstance(mtlid, (list, tuple)) else [mtlid])
+            nprims += entry.size * ninst
+
+        if self.instancing and len(mtlmap) > self.mtlmap.shape[0]:
+            raise RuntimeError(f'Too many materials! {len(mtlmap)} in draws')
+        if nprims > self.maxprims:
+            raise RuntimeError(f'Out of memory! {nprims} faces after instancing, '
+                    f'increase maxprims (currently {self.maxprims})')
+        for field, array in zip([self.dstart, self.dbase, self.dnfaces,
+                self.dinst, self.dmtl], draws):
+            field.from_numpy(array)
+        if self.instancing:
+            mtlmap = np.array(mtlmap + [-1] * (self.mtlmap.shape[0] - len(mtlmap)), dtype=np.int32)
+            self.mtlmap.from_numpy(mtlmap)
+        self._select_draws(len(objects), nprims, self.cache.get_top())
+
+    def _is_instanced(self, mesh):
+        # without instancing, InstancedMesh is expanded like any other mesh
+        return self.instancing and hasattr(mesh, 'get_instance_transform')
+
+    @ti.kernel
+    def _select_draws(self, ndraws: int, nprims: int, top: int):
+        self.ndraws[None] = ndraws
+        self.base[None] = 0
+        self.nfaces[None] = nprims
+        self.ntop[None] = top
+
+    @ti.kernel
+    def _select_object(self, base: int, nfaces: int, slot: int, top: int):
+        self.ndraws[None] = 0
+        self.base[None] = base
+        self.nfaces[None] = nfaces
+        self.ntop[None] = top
+        self.objmtl[slot] = 0
+
+    @ti.kernel
+    def _set_instances(self, imesh: ti.template(), base: int, ninst: int):
+        for i in range(ninst):
+            j = base + i
+            trans = imesh.get_instance_transform(i)
+            linear = ti.Matrix([[trans[k, l] for l in range(3)] for k in range(3)])
+            self.itrans[j] = trans
+            self.inorm[j] = linear.inverse().transpose()
+            self.icolor[j] = imesh.get_instance_color(i)
+            self.imtl[j] = imesh.get_instance_mtlid(i)
+
+    @ti.kernel
+    def _kill_range(self, base: int, size: int):
+        for i in range(base, base + size):
+            self.objids[i] = -1
+
+    def _upload_object(self, mesh, entry):
+        self._set_object(mesh, entry.base, entry.size, entry.slot)
+        if self.clustering:
+            self._update_bounds(entry.base, entry.size, entry.slot)
+
     @ti.kernel
-    def set_object(self, mesh: ti.template()):
-        mesh.pre_compute()
-        self.nfaces[None] = mesh.get_nfaces()
-        for i in range(self.nfaces[None]):
+    def _update_bounds(self, base: int, nfaces: int, slot: int):
+        self.obmin[slot] = V(inf, inf, inf)
+        self.obmax[slot] = V(-inf, -inf, -inf)
+        for c in range(base // self.clustersize,
+                (base + nfaces - 1) // self.clustersize + 1):
+            self.cbmin[c] = V(inf, inf, inf)
+            self.cbmax[c] = V(-inf, -inf, -inf)
+        for f in range(base, base + nfaces):
+            c = f // self.clustersize
+            for k, i in ti.static(ti.ndrange(3, 3)):
+                ti.atomic_min(self.cbmin[c][i], self.verts[f, k][i])
+                ti.atomic_max(self.cbmax[c][i], self.verts[f, k][i])
+                ti.atomic_min(self.obmin[slot][i], self.verts[f, k][i])
+                ti.atomic_max(self.obmax[slot][i], self.verts[f, k][i])
+
+    @ti.func
+    def get_clusters_range(self):
+        for c in range((self.ntop[None] + self.clustersize - 1) // self.clustersize):
+            yield c
+
+    def cull_clusters(self, hiz=None):
+        '''
+        :param hiz: (DepthPyramid) depth pyramid of the occluders drawn after cull_occluders, None to only test the frustum
+
+        Test the selected meshes, then the face clusters of visible ones,
+        against the view frustum and the pyramid; faces of culled clusters
+        are skipped by render_occup
+
+        With hiz, this is the second pass of occlusion culling, only the
+        clusters that pass and were not drawn as occluders are selected,
+        and those that pass are the occluders of the next frame
+
+        :note: call this after set_object(s), requires clustering=True
+        '''
+
+        assert self.clustering, 'cull_clusters requires clustering=True'
+        if hiz is None:
+            self._cull_frustum()
+        else:
+            self._cull_occluded(hiz)
+
+    def cull_occluders(self):
+        '''
+        Select the clusters in the view frustum that were visible last
+        frame, the first pass of occlusion culling; render them, build a
+        DepthPyramid of the engine, then call cull_clusters with it
+
+        As the occluders are drawn with the current camera and geometry,
+        the test stays conservative while the camera and objects move
+
+        :note: call this after set_object(s), requires clustering=True
+        '''
+
+        assert self.clustering, 'cull_occluders requires clustering=True'
+        self._cull_occluders()
+
+    @ti.func
+    def _object_in_frustum(self, slot):
+        vis = 0
+        if self.objmtl[slot] != -1 and all(self.obmin[slot] <= self.obmax[slot]):
+            vis = 1 - self.engine.outside_frustum(self.obmin[slot], self.obmax[slot])
+        return vis
+
+    @ti.func
+    def _cluster_in_frustum(self, c):
+        vis = 0
+        slot = self.objids[c * self.clustersize]
+        if slot != -1 and self.objvis[slot]:
+            vis = 1 - self.engine.outside_frustum(self.cbmin[c], self.cbmax[c])
+        return vis
+
+    @ti.kernel
+    def _cull_frustum(self):
+        self.drawpass[None] = 0
+        for slot in self.objvis:
+            self.objvis[slot] = self._object_in_frustum(slot)
+        for c in ti.smart(self.get_clusters_range()):
+            self.cvisible[c] = self._cluster_in_frustum(c)
+
+    @ti.kernel
+    def _cull_occluders(self):
+        self.drawpass[None] = 1
+        for slot in self.objvis:
+            self.objvis[slot] = self._object_in_frustum(slot)
+        for c in ti.smart(self.get_clusters_range()):
+            self.cvisible[c] = self._cluster_in_frustum(c) * self.cprev[c]
+
+    @ti.kernel
+    def _cull_occluded(self, hiz: ti.template()):
+        self.drawpass[None] = 2
+        for slot in self.objvis:
+            vis = self._object_in_frustum(slot)
+            if vis:
+                vis = 1 - hiz.occluded(self.engine, self.obmin[slot], self.obmax[slot])
+            self.objvis[slot] = vis
+        for c in ti.smart(self.get_clusters_range()):
+            vis = self._cluster_in_frustum(c)
+            if vis:
+                vis = 1 - hiz.occluded(self.engine, self.cbmin[c], self.cbmax[c])
+            drawn = self.cvisible[c]
+            self.cvisible[c] = vis * (1 - drawn)
+            self.cprev[c] = vis
+
+    @ti.kernel
+    def _set_object(self, mesh: ti.template(), base: int, nfaces: int, slot: int):
+        for i in range(nfaces):
+            j = base + i
+            self.objids[j] = slot
             verts = mesh.get_face_verts(i)
             for k in ti.static(range(3)):
-                self.verts[i, k] = verts[k]
+                self.verts[j, k] = verts[k]
             if ti.static(self.smoothing):
                 norms = mesh.get_face_norms(i)
                 for k in ti.static(range(3)):
-                    self.norms[i, k] = norms[k]
+                    self.norms[j, k] = norms[k]
             if ti.static(self.texturing):
                 coors = mesh.get_face_coors(i)
                 for k in ti.static(range(3)):
-                    self.coors[i, k] = coors[k]
+                    self.coors[j, k] = coors[k]
+
+    @ti.func
+    def setup_face(self, f):
+        Al, Bl, Cl = self.get_face_vertices(f)
+        Ah, Bh, Ch = [self.engine.to_clipspace(p) for p in [Al, Bl, Cl]]
+        visible = 1
+        if self.get_face_mtlid(f) == -1:
+            visible = 0
+        if ti.static(self.clustering):
+            face, inst, d = self.locate_face(f)
+            if inst == -1:
+                if not self.cvisible[face // self.clustersize]:
+                    visible = 0
+            elif self.drawpass[None] == 2:
+                # instances are not clustered, drawn in the first pass only
+                visible = 0
+
+        # homogeneous rasterization, see Olano and Greer 1997
+        M = ti.Matrix([[Ah.x, Bh.x, Ch.x], [Ah.y, Bh.y, Ch.y], [Ah.w, Bh.w, Ch.w]])
+        det = M.determinant()
+        if det == 0:
+            visible = 0
+        if ti.static(self.culling):
+            if det < 0:
+                visible = 0
+
+        if ti.static(self.clipping):
+            # trivially reject faces outside one of the clipping planes
+            outcode = 63
+            for h in ti.static([Ah, Bh, Ch]):
+                outcode &= self.engine.clip_outcode(h)
+            if outcode != 0:
+                visible = 0
+
+        # screen bounds of the face clipped by the near plane, there is no
+        # need to clip the other planes as bounds are clamped to the screen
+        bmin, bmax = V(inf, inf), V(-inf, -inf)
+        nfront = 0
+        hs = ti.static([Ah, Bh, Ch])
+        for i in ti.static(range(3)):
+            a, b = ti.static(hs[i], hs[(i + 1) % 3])
+            da, db = a.z + a.w, b.z + b.w
+            if da >= 0:
+                q = a.xy / a.w
+                bmin, bmax = min(bmin, q), max(bmax, q)
+                nfront += 1
+            if (da >= 0) != (db >= 0):
+                c = a + (b - a) * (da / (da - db))
+                q = c.xy / c.w
+                bmin, bmax = min(bmin, q), max(bmax, q)
+        if nfront == 0:
+            visible = 0
+
+        lo = max(self.engine.to_viewport(bmin), -1.)
+        hi = min(self.engine.to_viewport(bmax), float(self.res))
+        bot, top = max(ifloor(lo), 0), min(iceil(hi), self.res - 1)
+        if any(bot > top):
+            visible = 0
+
+        if visible:
+            self.edges[f] = M.inverse()
+            self.clz[f] = V(Ah.z, Bh.z, Ch.z)
+        return visible, bot, top
+
+    @ti.func
+    def face_weights(self, f, p):
+        '''
+        :return: whether p is covered by the face, the perspective-correct barycentric weights of p, and its depth
+        '''
+
+        E = self.edges[f] @ V23(self.engine.from_viewport(p), 1.)
+        depth = E.dot(self.clz[f])
+        inside = 0
+        if all(E >= 0) and E.sum() > 0 and -1 <= depth <= 1:
+            inside = 1
+        wei = E
+        if E.sum() != 0:
+            wei = E / E.sum()
+        return inside, wei, depth
+
+    @ti.func
+    def rasterize_face(self, f, bot, top):
+        for P in ti.grouped(ti.ndrange((bot.x, top.x + 1), (bot.y, top.y + 1))):
+            pos = float(P) + self.engine.bias[None]
+            inside, wei, depth = self.face_weights(f, pos)
+            if inside:
+                self.engine.write_visibility(P, int(depth * self.engine.maxdepth), f)
+
+    @ti.func
+    def prim_depth(self, f, p):
+        inside, wei, depth = self.face_weights(f, p)
+        return inside, depth
+
+    @ti.func
+    def rasterize_prim(self, f, bot, top):
+        self.rasterize_face(f, bot, top)
 
-    @ti.kernel
     def render_occup(self):
-        for P in ti.grouped(self.occup):
-            self.occup[P] = -1
+        self.engine.begin_draw()
+        if not self.binning:
+            self._render_occup()
+            return
+
+        self.binner.clear()
+        self._bin_setup()
+        self.binner.render(self)
+
+    @ti.kernel
+    def _render_occup(self):
         for f in ti.smart(self.get_faces_range()):
-            Al, Bl, Cl = self.get_face_vertices(f)
-            Av, Bv, Cv = [self.engine.to_viewspace(p) for p in [Al, Bl, Cl]]
-            facing = (Bv.xy - Av.xy).cross(Cv.xy - Av.xy)
-            if facing <= 0:
-                if ti.static(self.culling):
-                    continue
-
-            if ti.static(self.clipping):
-                if not all(-1 <= Av <= 1):
-                    if not all(-1 <= Bv <= 1):
-                        if not all(-1 <= Cv <= 1):
-                            continue
-
-            a, b, c = [self.engine.to_viewport(p) for p in [Av, Bv, Cv]]
-
-            bot, top = ifloor(min(a, b, c)), iceil(max(a, b, c))
-            bot, top = max(bot, 0), min(top, self.res - 1)
-            n = (b - a).cross(c - a)
-            bcn = (b - c) / n
-            can = (c - a) / n
-            wscale = 1 / ti.Vector([mapply(self.engine.W2V[None], p, 1)[1] for p in [Al, Bl, Cl]])
-            for P in ti.grouped(ti.ndrange((bot.x, top.x + 1), (bot.y, top.y + 1))):
-                pos = float(P) + self.engine.bias[None]
-                w_bc = (pos - b).cross(bcn)
-                w_ca = (pos - c).cross(can)
-                wei = V(w_bc, w_ca, 1 - w_bc - w_ca) * wscale
-                wei /= wei.x + wei.y + wei.z
-                if all(wei >= 0):
-                    depth_f = wei.x * Av.z + wei.y * Bv.z + wei.z * Cv.z
-                    depth = int(depth_f * self.engine.maxdepth)
-                    if ti.atomic_min(self.engine.depth[P], depth) > depth:
-                        if self.engine.depth[P] >= depth:
-                            self.occup[P] = f
-
-            self.bcn[f] = bcn
-            self.can[f] = can
-            self.boo[f] = b
-            self.coo[f] = c
-            self.wsc[f] = wscale
+            visible, bot, top = self.setup_face(f)
+            if not visible:
+                continue
+            self.rasterize_face(f, bot, top)
+
+    @ti.kernel
+    def _bin_setup(self):
+        for f in ti.smart(self.get_faces_range()):
+            visible, bot, top = self.setup_face(f)
+            if not visible:
+                continue
+            self.binner.add(f, bot, top)
 
     @ti.kernel
     def render_color(self, shader: ti.template()):
-        for P in ti.grouped(self.occup):
-            f = self.occup[P]
+        for P in ti.grouped(self.engine.vbuf):
+            f = self.engine.resolve_visibility(P)
             if f == -1:
                 continue
 
             Al, Bl, Cl = self.get_face_vertices(f)
-
-            bcn = self.bcn[f]
-            can = self.can[f]
-            b = self.boo[f]
-            c = self.coo[f]
-            wscale = self.wsc[f]
             p = float(P) + self.engine.bias[None]
-            w_bc = (p - b).cross(bcn)
-            w_ca = (p - c).cross(can)
-            wei = V(w_bc, w_ca, 1 - w_bc - w_ca) * wscale
-            wei /= wei.x + wei.y + wei.z
+            inside, wei, depth = self.face_weights(f, p)
 
-            self.interpolate(shader, P, p, f, wei, Al, Bl, Cl)
+            mtlid = self.get_face_mtlid(f)
+            self.interpolate(shader, P, p, f, wei, Al, Bl, Cl, mtlid)
@@ -1,18 +1,35 @@
 from ..common import *
 from ..advans import *
+from .shader import calc_view_ray
 
 
 @ti.data_oriented
 class VolumeRaster:
     def __init__(self, engine, N=128, taa=False, density=32,
-            radius=None, gaussian=None, **extra_options):
+            radius=None, gaussian=None, raymarch=False, bricksize=8,
+            marchstep=1.0, cutoff=0.01, **extra_options):
+        '''
+        :param engine: (Engine) the engine to draw into
+        :param N: (int) resolution of the resampled density grid
+        :param taa: (bool) jitter the samples for temporal accumulation
+        :param density: (float) optical depth of a fully dense voxel, times N
+        :param raymarch: (bool) march a ray per pixel instead of splatting every voxel
+        :param bricksize: (int) edge length of the finest cells of the occupancy mip, in voxels
+        :param marchstep: (float) length of a ray marching step, in voxels
+        :param cutoff: (float) transmittance below which rays are terminated
+
+        In ray marching mode, cells of a min/max mip of the density are
+        used to skip empty space, and to integrate homogeneous regions in
+        one step, so that the cost follows the visible, non-empty voxels
+        '''
+
         self.engine = engine
         self.res = self.engine.res
         if radius is None:
             radius = 1 if taa else 8
         if gaussian is None:
             gaussian = not taa
-        if not taa:
+        if not taa and not raymarch:
             density = density * 6
         self.density = density
         self.gaussian = gaussian
@@ -25,15 +42,34 @@ class VolumeRaster:
         self.tmcup = ti.field(float, self.res)
 
         self.L2W = ti.Matrix.field(4, 4, float, ())
+        self.W2L = ti.Matrix.field(4, 4, float, ())
+        self.last_object = None
+
+        self.raymarch = raymarch
+        if self.raymarch:
+            self.marchstep = marchstep
+            self.cutoff = cutoff
+            self.bricksize = bricksize
+            self.mips = []
+            size = (N + bricksize - 1) // bricksize
+            while True:
+                self.mips.append(ti.Vector.field(2, float, (size, size, size)))
+                if size <= 1:
+                    break
+                size = (size + 1) // 2
+            self.nlevels = len(self.mips)
 
         @ti.materialize_callback
         def init_dens():
             self.dens.fill(1)
+            if self.raymarch:
+                self.build_mips()
 
         @ti.materialize_callback
         @ti.kernel
         def init_L2W():
             self.L2W[None] = ti.Matrix.identity(float, 4)
+            self.W2L[None] = ti.Matrix.identity(float, 4)
 
         if self.gaussian:
             self.wei = ti.field(float, self.radius + 1)
@@ -50,14 +86,131 @@ class VolumeRaster:
                 for i in self.wei:
                     self.wei[i] /= total
 
+    def set_object(self, voxl):
+        '''
+        :param voxl: (Voxl) the volume to be rasterized next
+
+        Resampling is skipped when the same volume is set again unchanged
+        '''
+
+        version = object_version(voxl)
+        if version is not None and self.last_object == (voxl, version):
+            return
+        self.last_object = voxl, version
+        self._set_object(voxl)
+        if self.raymarch:
+            self.build_mips()
+
     @ti.kernel
-    def set_object(self, voxl: ti.template()):
+    def _set_object(self, voxl: ti.template()):
         self.L2W[None] = voxl.get_transform()
+        self.W2L[None] = self.L2W[None].inverse()
         for I in ti.grouped(self.dens):
             self.dens[I] = voxl.sample_volume(I / self.N)
 
     def set_volume_density(self, dens):
+        self.last_object = None
         self.dens.from_numpy(dens)
+        if self.raymarch:
+            self.build_mips()
+
+    @ti.kernel
+    def build_mips(self):
+        '''
+        Reduce the density into the min/max mip, cells of the finest
+        level also cover the voxels read by trilinear filtering
+        '''
+
+        B = ti.static(self.bricksize)
+        for C in ti.grouped(self.mips[0]):
+            lo, hi = inf, -inf
+            bot = max(C * B - 1, 0)
+            top = min(C * B + B, self.N - 1)
+            for I in ti.grouped(ti.ndrange((bot.x, top.x + 1),
+                    (bot.y, top.y + 1), (bot.z, top.z + 1))):
+                lo, hi = min(lo, self.dens[I]), max(hi, self.dens[I])
+            self.mips[0][C] = V(lo, hi)
+        for l in ti.static(range(1, self.nlevels)):
+            src, dst = ti.static(self.mips[l - 1], self.mips[l])
+            top = ti.Vector(src.shape) - 1
+            for C in ti.grouped(dst):
+                val = src[C * 2]
+                for D in ti.static(ti.grouped(ti.ndrange(2, 2, 2))):
+                    other = src[min(C * 2 + D, top)]
+                    val = V(min(val.x, other.x), max(val.y, other.y))
+                dst[C] = val
+
+    @ti.func
+    def sample_density(self, g):
+        # trilinear filtering at grid position g, voxel centers at I + 0.5
+        g = clamp(g - 0.5, 0, self.N - 1)
+        I = min(ifloor(g), self.N - 2)
+        w = g - I
+        ret = 0.0
+        for D in ti.static(ti.grouped(ti.ndrange(2, 2, 2))):
+            fac = 1.0
+            for k in ti.static(range(3)):
+                fac *= w[k] if D[k] else 1 - w[k]
+            ret += self.dens[I + D] * fac
+        return ret
+
+    @ti.func
+    def cell_exit(self, go, gd, bot, top):
+        # ray parameter where the ray leaves the box from bot to top
+        t1 = (bot - go) / gd
+        t2 = (top - go) / gd
+        return min(max(t1, t2))
+
+    @ti.func
+    def get_scene_distance(self, P, ro, rd):
+        # distance to the opaque surface already drawn, inf for background
+        ret = inf
+        if self.engine.depth[P] < self.engine.maxdepth:
+            p = float(P) + self.engine.bias[None]
+            vpos = V23(self.engine.from_viewport(p), self.engine.depth[P] / self.engine.maxdepth)
+            ret = (mapply_pos(self.engine.V2W[None], vpos) - ro).dot(rd)
+        return ret
+
+    @ti.kernel
+    def _render_march(self):
+        for P in ti.grouped(self.occup):
+            p = float(P) + self.engine.bias[None]
+            ro, rd = calc_view_ray(self.engine, p)
+
+            # march in grid space, where the volume spans [0, N]^3
+            go = (mapply_pos(self.W2L[None], ro) * 0.5 + 0.5) * self.N
+            gd = mapply_dir(self.W2L[None], rd) * 0.5 * self.N
+            gd = ti.Vector([gd[k] if abs(gd[k]) > eps else eps for k in range(3)])
+            t1, t2 = -go / gd, (self.N - go) / gd
+            tnear = max(max(min(t1, t2)), 0)
+            tfar = min(min(max(t1, t2)), self.get_scene_distance(P, ro, rd))
+
+            # world distance per voxel along this ray
+            dt = self.marchstep / gd.norm()
+            t = tnear + dt * 0.5
+            if ti.static(self.taa):
+                t = tnear + dt * ti.random()
+            tau = 0.0
+            taumax = -ti.log(self.cutoff)
+            while t < tfar and tau < taumax:
+                g = go + gd * t
+                skipped = 0
+                for l in ti.static(reversed(range(self.nlevels))):
+                    if not skipped:
+                        size = self.bricksize << l
+                        C = ifloor(g / size)
+                        if all(C >= 0) and all(C < ti.Vector(self.mips[l].shape)):
+                            mm = self.mips[l][C]
+                            if mm.y <= 0 or (l == 0 and mm.y - mm.x <= eps):
+                                # empty, or homogeneous, integrate to the cell exit
+                                texit = min(self.cell_exit(go, gd, C * size, C * size + size), tfar)
+                                tau += mm.y * self.density / self.N * (texit - t) * gd.norm()
+                                t = texit + dt * 0.01
+                                skipped = 1
+                if not skipped:
+                    tau += self.sample_density(g) * self.density / self.N * self.marchstep
+                    t += dt
+            self.occup[P] = tau
 
     @ti.kernel
     def _render_occup(self):
@@ -121,6 +274,10 @@ class VolumeRaster:
             shader.blend_color(fac, P, P, fac, color)
 
     def render_occup(self):
+        if self.raymarch:
+            self._render_march()
+            return
+
         self._render_occup()
         if self.radius:
             self.blur(self.occup, self.tmcup, 0)
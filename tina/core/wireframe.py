@@ -64,7 +64,7 @@ class WireframeRaster:
             yield pos, i / siz
 
     def render_occup(self):
-        pass
+        self.engine.begin_draw()
 
     @ti.kernel
     def render_color(self, shader: ti.template()):
@@ -89,7 +89,6 @@ class WireframeRaster:
                     wei /= wei.x + wei.y
                     depth_f = wei.x * Av.z + wei.y * Bv.z
                     depth = int(depth_f * self.engine.maxdepth)
-                    if ti.atomic_min(self.engine.depth[P], depth) > depth:
-                        if self.engine.depth[P] >= depth:
-                            color = self.linecolor[None]
-                            shader.blend_color(self.engine, P, pos, 1, color)
+                    if self.engine.write_visibility(P, depth, f):
+                        color = self.linecolor[None]
+                        shader.blend_color(self.engine, P, pos, 1, color)
@@ -638,6 +638,14 @@ class VirtualMaterial(IMaterial):
                 wei = mat.estimate_emission()
         return wei
 
+    @ti.func
+    def sample_ibl(self, ibltab: ti.template(), idir, nrm):
+        wei = V(0., 0., 0.)
+        for i, mat in ti.static(enumerate(self.materials)):
+            if i == self.mid:
+                wei = mat.sample_ibl(ibltab, idir, nrm)
+        return wei
+
 
 @ti.data_oriented
 class MaterialTable:
@@ -8,4 +8,6 @@ if __import__('tina').lazyguard:
     from .simple import *
     from .prim import *
     from .conn import *
+    from .lod import *
+    from .inst import *
     from .export import *
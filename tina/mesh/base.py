@@ -8,3 +8,32 @@ class MeshEditBase:
 
     def __getattr__(self, attr):
         return getattr(self.mesh, attr)
+
+
+@ti.kernel
+def _compute_mesh_bounds(mesh: ti.template(), out: ti.ext_arr()):
+    for i in range(mesh.get_nfaces()):
+        verts = mesh.get_face_verts(i)
+        for vert in ti.static(verts):
+            for k in ti.static(range(3)):
+                ti.atomic_min(out[0, k], vert[k])
+                ti.atomic_max(out[1, k], vert[k])
+
+
+def compute_mesh_bounds(mesh):
+    '''
+    :param mesh: (Mesh) the mesh to be bounded
+    :return: (np.array[2, 3]) minimum and maximum corners of all face vertices
+
+    :note: the result is cached until the mesh version changes
+    '''
+
+    version = object_version(mesh)
+    cached = mesh.__dict__.get('_bounds_cache')
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+
+    out = np.array([[np.inf] * 3, [-np.inf] * 3], dtype=np.float32)
+    _compute_mesh_bounds(mesh, out)
+    mesh._bounds_cache = version, out
+    return out
@@ -1,4 +1,5 @@
 from ..common import *
+from .base import compute_mesh_bounds
 
 
 @ti.data_oriented
@@ -9,6 +10,7 @@ class ConnectiveMesh:
         self.coors = ti.Vector.field(2, float, maxverts)
         self.norms = ti.Vector.field(3, float, maxverts)
         self.nfaces = ti.field(int, ())
+        self.version = ti.field(int, ())
 
         self.maxfaces = maxfaces
         self.maxverts = maxverts
@@ -21,6 +23,16 @@ class ConnectiveMesh:
     def pre_compute(self):
         pass
 
+    def get_version(self):
+        return self.version[None]
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the mesh
+        '''
+
+        return compute_mesh_bounds(self)
+
     def get_max_vert_nindex(self):
         return self.maxverts
 
@@ -68,6 +80,7 @@ class ConnectiveMesh:
 
     @ti.kernel
     def set_vertices(self, verts: ti.ext_arr()):
+        self.version[None] += 1
         nverts = min(verts.shape[0], self.verts.shape[0])
         for i in range(nverts):
             for k in ti.static(range(3)):
@@ -75,6 +88,7 @@ class ConnectiveMesh:
 
     @ti.kernel
     def set_vert_norms(self, norms: ti.ext_arr()):
+        self.version[None] += 1
         nverts = min(norms.shape[0], self.norms.shape[0])
         for i in range(nverts):
             for k in ti.static(range(3)):
@@ -82,6 +96,7 @@ class ConnectiveMesh:
 
     @ti.kernel
     def set_vert_coors(self, coors: ti.ext_arr()):
+        self.version[None] += 1
         nverts = min(coors.shape[0], self.coors.shape[0])
         for i in range(nverts):
             for k in ti.static(range(3)):
@@ -89,6 +104,7 @@ class ConnectiveMesh:
 
     @ti.kernel
     def set_faces(self, faces: ti.ext_arr()):
+        self.version[None] += 1
         self.nfaces[None] = min(faces.shape[0], self.faces.shape[0])
         for i in range(self.nfaces[None]):
             for k in ti.static(range(self.npolygon)):
@@ -1,4 +1,5 @@
 from ..common import *
+from .base import compute_mesh_bounds
 
 
 @ti.data_oriented
@@ -23,6 +24,13 @@ class MeshGrid:
     def get_npolygon(self):
         return 4 if self.as_quad else 3
 
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the mesh
+        '''
+
+        return compute_mesh_bounds(self)
+
     @ti.func
     def pre_compute(self):
         for i, j in self.pos:
@@ -0,0 +1,141 @@
+from ..common import *
+
+
+@ti.data_oriented
+class InstancedMesh:
+    def __init__(self, mesh, trans, colors=None, mtlids=None, maxinstances=None):
+        '''
+        :param mesh: (Mesh) the base mesh to be instanced
+        :param trans: (np.array[N, 4, 4]) world matrix of each instance
+        :param colors: (np.array[N, 3]) color of each instance, white by default
+        :param mtlids: (np.array[N]) index of each instance's material in the list passed to Scene.add_object
+        :param maxinstances: (int) max number of instances, N by default
+        :return: (Mesh) the mesh object to add into scene
+
+        Rasters supporting instancing keep the base mesh once and apply the
+        instance transforms on the fly, other consumers see all instances
+        expanded as one big mesh
+        '''
+
+        self.mesh = mesh
+        trans = np.array(trans, dtype=np.float32).reshape(-1, 4, 4)
+        self.maxinstances = maxinstances or len(trans)
+        self.trans = ti.Matrix.field(4, 4, float, self.maxinstances)
+        self.colors = ti.Vector.field(3, float, self.maxinstances)
+        self.mtlids = ti.field(int, self.maxinstances)
+        self.ninstances = ti.field(int, ())
+        self._check_ninstances(len(trans))
+        self.trans_np = trans
+        self.mtlids_np = np.zeros(len(trans), dtype=np.int32)
+        self.inst_version = 0
+
+        @ti.materialize_callback
+        def init_instances():
+            self.set_instances(trans, colors, mtlids)
+
+    def set_instances(self, trans, colors=None, mtlids=None):
+        '''
+        :param trans: (np.array[N, 4, 4]) world matrix of each instance
+        :param colors: (np.array[N, 3]) color of each instance, white by default
+        :param mtlids: (np.array[N]) material index of each instance, 0 by default
+        '''
+
+        trans = np.array(trans, dtype=np.float32).reshape(-1, 4, 4)
+        n = len(trans)
+        self._check_ninstances(n)
+        if colors is None:
+            colors = np.ones((n, 3), dtype=np.float32)
+        if mtlids is None:
+            mtlids = np.zeros(n, dtype=np.int32)
+        colors = np.array(colors, dtype=np.float32).reshape(n, 3)
+        mtlids = np.array(mtlids, dtype=np.int32).reshape(n)
+        self.trans_np = trans
+        self.mtlids_np = mtlids
+        self._set_instances(n, trans, colors, mtlids)
+        self.inst_version += 1
+
+    def _check_ninstances(self, n):
+        if n > self.maxinstances:
+            raise RuntimeError(f'Out of memory! {n} instances, '
+                    f'increase maxinstances (currently {self.maxinstances})')
+
+    def check_mtlids(self, nmaterials):
+        '''
+        :param nmaterials: (int) length of the material list the instances index into
+        '''
+
+        if len(self.mtlids_np) and (self.mtlids_np.min() < 0
+                or self.mtlids_np.max() >= nmaterials):
+            raise ValueError(f'instance material ids must be in [0, {nmaterials}), '
+                    f'got [{self.mtlids_np.min()}, {self.mtlids_np.max()}]')
+
+    @ti.kernel
+    def _set_instances(self, n: int, trans: ti.ext_arr(),
+            colors: ti.ext_arr(), mtlids: ti.ext_arr()):
+        self.ninstances[None] = n
+        for i in range(n):
+            for j, k in ti.static(ti.ndrange(4, 4)):
+                self.trans[i][j, k] = trans[i, j, k]
+            for k in ti.static(range(3)):
+                self.colors[i][k] = colors[i, k]
+            self.mtlids[i] = mtlids[i]
+
+    def get_version(self):
+        version = object_version(self.mesh)
+        return None if version is None else (version, self.inst_version)
+
+    def get_ninstances(self):
+        return len(self.trans_np)
+
+    def get_npolygon(self):
+        return self.mesh.get_npolygon() if hasattr(self.mesh, 'get_npolygon') else 3
+
+    def get_bounding_box(self):
+        box = object_bounding_box(self.mesh)
+        if box is None or not len(self.trans_np) or np.any(box[0] > box[1]):
+            return box
+        corners = np.array([[box[i >> k & 1, k] for k in range(3)] + [1]
+            for i in range(8)], dtype=np.float32)
+        clip = np.einsum('nij,cj->nci', self.trans_np, corners)
+        pos = clip[..., :3] / clip[..., 3:]
+        return np.array([pos.min(axis=(0, 1)), pos.max(axis=(0, 1))])
+
+    @ti.func
+    def get_instance_transform(self, i):
+        return self.trans[i]
+
+    @ti.func
+    def get_instance_color(self, i):
+        return self.colors[i]
+
+    @ti.func
+    def get_instance_mtlid(self, i):
+        return self.mtlids[i]
+
+    @ti.func
+    def pre_compute(self):
+        self.mesh.pre_compute()
+
+    @ti.func
+    def get_nfaces(self):
+        return self.mesh.get_nfaces() * self.ninstances[None]
+
+    @ti.func
+    def get_face_verts(self, n):
+        nfaces = self.mesh.get_nfaces()
+        trans = self.trans[n // nfaces]
+        verts = self.mesh.get_face_verts(n % nfaces)
+        return [mapply_pos(trans, vert) for vert in verts]
+
+    @ti.func
+    def get_face_norms(self, n):
+        nfaces = self.mesh.get_nfaces()
+        trans = self.trans[n // nfaces]
+        linear = ti.Matrix([[trans[i, j] for j in range(3)] for i in range(3)])
+        trans_normal = linear.inverse().transpose()
+        norms = self.mesh.get_face_norms(n % nfaces)
+        return [(trans_normal @ norm).normalized() for norm in norms]
+
+    @ti.func
+    def get_face_coors(self, n):
+        return self.mesh.get_face_coors(n % self.mesh.get_nfaces())
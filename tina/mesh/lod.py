@@ -0,0 +1,242 @@
+from ..common import *
+import os
+
+
+def _face_planes(v, f):
+    a, b, c = v[f[:, 0]], v[f[:, 1]], v[f[:, 2]]
+    n = np.cross(b - a, c - a)
+    area = np.linalg.norm(n, axis=1)
+    n /= np.maximum(area, 1e-12)[:, None]
+    d = -np.sum(n * a, axis=1)
+    return np.concatenate([n, d[:, None]], axis=1), area
+
+
+def _plane_quadrics(p, w):
+    return p[:, :, None] * p[:, None, :] * w[:, None, None]
+
+
+def _vertex_quadrics(v, f, boundary_weight):
+    planes, area = _face_planes(v, f)
+    K = _plane_quadrics(planes, area)
+    Q = np.zeros((len(v), 4, 4))
+    for k in range(3):
+        np.add.at(Q, f[:, k], K)
+
+    # directed edges, those used by only one face are on the boundary
+    e = np.concatenate([f[:, [0, 1]], f[:, [1, 2]], f[:, [2, 0]]])
+    fid = np.tile(np.arange(len(f)), 3)
+    edges, inv, cnt = np.unique(np.sort(e, axis=1), axis=0,
+            return_inverse=True, return_counts=True)
+    border = cnt[inv.reshape(-1)] == 1
+    if np.any(border):
+        # planes perpendicular to the face through boundary edges keep the outline
+        eb, fb = e[border], fid[border]
+        a, b = v[eb[:, 0]], v[eb[:, 1]]
+        m = np.cross(b - a, planes[fb, :3])
+        m /= np.maximum(np.linalg.norm(m, axis=1), 1e-12)[:, None]
+        d = -np.sum(m * a, axis=1)
+        w = boundary_weight * np.sum((b - a)**2, axis=1)
+        K = _plane_quadrics(np.concatenate([m, d[:, None]], axis=1), w)
+        np.add.at(Q, eb[:, 0], K)
+        np.add.at(Q, eb[:, 1], K)
+
+    return Q, edges
+
+
+def _quadric_cost(Q, x):
+    xh = np.concatenate([x, np.ones((len(x), 1))], axis=1)
+    return np.einsum('ei,eij,ej->e', xh, Q, xh)
+
+
+def _collapse_pass(v, f, ncollapse, boundary_weight):
+    Q, edges = _vertex_quadrics(v, f, boundary_weight)
+    i, j = edges[:, 0], edges[:, 1]
+    Qe = Q[i] + Q[j]
+
+    # candidates: the optimal point where solvable, both ends and the midpoint
+    cands = [v[i], v[j], (v[i] + v[j]) / 2]
+    A, b = Qe[:, :3, :3], -Qe[:, :3, 3]
+    scale = np.maximum(np.abs(np.trace(A, axis1=1, axis2=2)), 1e-12)
+    ok = np.abs(np.linalg.det(A)) > 1e-9 * scale**3
+    opt = cands[2].copy()
+    if np.any(ok):
+        opt[ok] = np.linalg.solve(A[ok], b[ok][:, :, None])[:, :, 0]
+    cands.append(opt)
+    costs = np.stack([_quadric_cost(Qe, x) for x in cands])
+    best = np.argmin(costs, axis=0)
+    cost = costs[best, np.arange(len(edges))]
+    target = np.stack(cands)[best, np.arange(len(edges))]
+
+    # pick edges cheapest among all edges of both their ends, so that
+    # the collapses of one pass touch distinct vertices
+    rank = np.empty(len(edges), dtype=np.int64)
+    rank[np.argsort(cost, kind='stable')] = np.arange(len(edges))
+    vbest = np.full(len(v), len(edges), dtype=np.int64)
+    np.minimum.at(vbest, i, rank)
+    np.minimum.at(vbest, j, rank)
+    sel = np.nonzero((vbest[i] == rank) & (vbest[j] == rank))[0]
+    sel = sel[np.argsort(rank[sel])][:ncollapse]
+
+    remap = np.arange(len(v))
+    remap[j[sel]] = i[sel]
+    nv = v.copy()
+    nv[i[sel]] = target[sel]
+
+    # reject collapses that flip any of the faces around them
+    nf = remap[f]
+    alive = (nf[:, 0] != nf[:, 1]) & (nf[:, 1] != nf[:, 2]) & (nf[:, 2] != nf[:, 0])
+    old_n = _face_planes(v, f)[0][:, :3]
+    new_n = _face_planes(nv, nf)[0][:, :3]
+    flipped = alive & (np.sum(old_n * new_n, axis=1) < 0.2)
+    collapse_of = np.full(len(v), -1, dtype=np.int64)
+    collapse_of[i[sel]] = np.arange(len(sel))
+    collapse_of[j[sel]] = np.arange(len(sel))
+    bad = collapse_of[f[flipped]].reshape(-1)
+    keep = np.ones(len(sel), dtype=bool)
+    keep[bad[bad != -1]] = False
+    sel = sel[keep]
+    if len(sel) == 0:
+        return v, None
+
+    remap = np.arange(len(v))
+    remap[j[sel]] = i[sel]
+    v = v.copy()
+    v[i[sel]] = target[sel]
+    return v, remap
+
+
+def simplify_obj(obj, ratio=0.5, boundary_weight=1e3, maxpasses=64):
+    '''
+    :param obj: (dict) the OBJ model as returned by tina.readobj
+    :param ratio: (float) fraction of faces to keep
+    :param boundary_weight: (float) how strongly open boundaries are preserved
+    :return: (dict) the simplified OBJ model
+
+    Simplify a triangle mesh by quadric error metrics (Garland and Heckbert
+    1997), collapsing many independent edges per vectorized pass
+
+    :note: texture coordinates and normals are kept per face corner
+    '''
+
+    v = np.array(obj['v'], dtype=np.float64)
+    f = np.array(obj['f'])
+    if len(f.shape) == 2:
+        f = np.stack([f, f, f], axis=2)
+    fp, fa = f[:, :, 0], f[:, :, 1:]
+    target = max(int(len(fp) * ratio), 1)
+
+    for i in range(maxpasses):
+        if len(fp) <= target:
+            break
+        ncollapse = max((len(fp) - target) // 2, 1)
+        v, remap = _collapse_pass(v, fp, ncollapse, boundary_weight)
+        if remap is None:
+            break
+        fp = remap[fp]
+        alive = (fp[:, 0] != fp[:, 1]) & (fp[:, 1] != fp[:, 2]) & (fp[:, 2] != fp[:, 0])
+        fp, fa = fp[alive], fa[alive]
+
+    used, fp = np.unique(fp, return_inverse=True)
+    fp = fp.reshape(-1, 3)
+    ret = dict(obj)
+    ret['v'] = v[used].astype(np.float32)
+    ret['f'] = np.concatenate([fp[:, :, None], fa], axis=2).astype(np.int32)
+    ret.pop('usemtl', None)
+    return ret
+
+
+def make_lod_chain(obj, nlevels=4, ratio=0.5, minfaces=32):
+    '''
+    :param obj: (dict) the OBJ model as returned by tina.readobj
+    :param nlevels: (int) max number of levels, including the original model
+    :param ratio: (float) fraction of faces kept by each level from the previous one
+    :param minfaces: (int) stop simplifying below this number of faces
+    :return: (list) OBJ models from the finest to the coarsest
+    '''
+
+    chain = [obj]
+    while len(chain) < nlevels and len(chain[-1]['f']) * ratio >= minfaces:
+        lod = simplify_obj(chain[-1], ratio)
+        if len(lod['f']) >= len(chain[-1]['f']):
+            break
+        chain.append(lod)
+    return chain
+
+
+def load_lod_chain(path, nlevels=4, ratio=0.5, cache=True, **kwargs):
+    '''
+    :param path: (str) path to the OBJ file
+    :param cache: (bool) keep the generated levels in a .lod.npz file next to the model
+    :return: (list) OBJ models from the finest to the coarsest
+
+    :note: the cache is regenerated when the model file, parameters or readobj options change
+    '''
+
+    cache_path = path + '.lod.npz'
+    meta = np.array([os.path.getmtime(path), nlevels, ratio], dtype=np.float64)
+    args = np.array(repr(sorted(kwargs.items())))
+    if cache and os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            if np.array_equal(data['meta'], meta) and 'args' in data.files \
+                    and str(data['args']) == str(args):
+                return [{key: data[f'{key}{i}'] for key in ['v', 'vt', 'vn', 'f']}
+                        for i in range(int(data['nlevels']))]
+
+    chain = make_lod_chain(tina.readobj(path, **kwargs), nlevels, ratio)
+    if cache:
+        arrays = {'meta': meta, 'args': args, 'nlevels': len(chain)}
+        for i, lod in enumerate(chain):
+            for key in ['v', 'vt', 'vn', 'f']:
+                arrays[f'{key}{i}'] = lod[key]
+        try:
+            np.savez_compressed(cache_path, **arrays)
+        except OSError:
+            pass  # read-only asset directory, regenerate next time
+    return chain
+
+
+class MeshLOD:
+    def __init__(self, levels, threshold=128):
+        '''
+        :param levels: (list) meshes from the finest to the coarsest
+        :param threshold: (float) projected size in pixels below which level 1 is used, each further level halves it
+        :return: (MeshLOD) the level-of-detail chain to add into scene
+
+        Scene rasterizes the level matching the projected size of the
+        finest level's bounding box each frame
+        '''
+
+        self.levels = list(levels)
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, obj, nlevels=4, ratio=0.5, cache=True, threshold=128, **kwargs):
+        '''
+        :param obj: (OBJ | str) the OBJ model, or path to the OBJ file
+        :param cache: (bool) cache the generated levels on disk, for paths only
+        :return: (MeshLOD) a chain of MeshModel generated by simplify_obj
+        '''
+
+        if isinstance(obj, str):
+            chain = load_lod_chain(obj, nlevels, ratio, cache, **kwargs)
+        else:
+            chain = make_lod_chain(obj, nlevels, ratio)
+        return cls([tina.MeshModel(lod) for lod in chain], threshold)
+
+    def get_version(self):
+        versions = tuple(object_version(mesh) for mesh in self.levels)
+        return None if None in versions else versions
+
+    def get_bounding_box(self):
+        return object_bounding_box(self.levels[0])
+
+    def select_level(self, size):
+        '''
+        :param size: (float) projected size of the object in pixels
+        :return: (int) index of the level to be used
+        '''
+
+        if size >= self.threshold:
+            return 0
+        level = int(np.log2(self.threshold / max(size, 1e-6))) + 1
+        return min(level, len(self.levels) - 1)
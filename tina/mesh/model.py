@@ -1,4 +1,5 @@
 from ..common import *
+from .base import compute_mesh_bounds
 
 
 @ti.data_oriented
@@ -39,6 +40,16 @@ class MeshModel:
     def pre_compute(self):
         pass
 
+    def get_version(self):
+        return 0
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the mesh
+        '''
+
+        return compute_mesh_bounds(self)
+
     def get_max_vert_nindex(self):
         return self.maxverts
 
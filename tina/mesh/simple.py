@@ -1,4 +1,5 @@
 from ..common import *
+from .base import compute_mesh_bounds
 
 
 @ti.data_oriented
@@ -15,6 +16,7 @@ class SimpleMesh:
         self.norms = ti.Vector.field(3, float, (maxfaces, npolygon))
         self.mtlids = ti.field(int, maxfaces)
         self.nfaces = ti.field(int, ())
+        self.version = ti.field(int, ())
 
         self.maxfaces = maxfaces
         self.npolygon = npolygon
@@ -26,6 +28,16 @@ class SimpleMesh:
     def pre_compute(self):
         pass
 
+    def get_version(self):
+        return self.version[None]
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the mesh
+        '''
+
+        return compute_mesh_bounds(self)
+
     @ti.func
     def get_nfaces(self):
         return min(self.nfaces[None], self.maxfaces)
@@ -60,6 +72,7 @@ class SimpleMesh:
         :note: the number of faces is determined by the array's shape[0]
         '''
 
+        self.version[None] += 1
         self.nfaces[None] = min(verts.shape[0], self.verts.shape[0])
         for i in range(self.nfaces[None]):
             for k in ti.static(range(self.npolygon)):
@@ -77,6 +90,7 @@ class SimpleMesh:
         :note: this should be invoked only *after* set_face_verts for nfaces
         '''
 
+        self.version[None] += 1
         for i in range(self.nfaces[None]):
             for k in ti.static(range(self.npolygon)):
                 for l in ti.static(range(3)):
@@ -92,6 +106,7 @@ class SimpleMesh:
         :note: this should be invoked only *after* set_face_verts for nfaces
         '''
 
+        self.version[None] += 1
         for i in range(self.nfaces[None]):
             for k in ti.static(range(self.npolygon)):
                 for l in ti.static(range(2)):
@@ -106,10 +121,12 @@ class SimpleMesh:
 
         :note: this should be invoked only *after* set_face_verts for nfaces
         '''
+        self.version[None] += 1
         for i in range(self.nfaces[None]):
             self.mtlids[i] = mtlids[i]
 
     @ti.kernel
     def set_material_id(self, mtlid: int):
+        self.version[None] += 1
         for i in range(self.nfaces[None]):
             self.mtlids[i] = mtlid
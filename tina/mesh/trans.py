@@ -1,5 +1,5 @@
 from ..common import *
-from .base import MeshEditBase
+from .base import MeshEditBase, compute_mesh_bounds
 
 
 class MeshTransform(MeshEditBase):
@@ -8,6 +8,7 @@ class MeshTransform(MeshEditBase):
 
         self.trans = ti.Matrix.field(4, 4, float, ())
         self.trans_normal = ti.Matrix.field(3, 3, float, ())
+        self.trans_version = 0
 
         @ti.materialize_callback
         @ti.kernel
@@ -24,6 +25,18 @@ class MeshTransform(MeshEditBase):
         trans_normal = np.transpose(np.linalg.inv(trans))
         self.trans[None] = np.array(trans).tolist()
         self.trans_normal[None] = np.array(trans_normal).tolist()
+        self.trans_version += 1
+
+    def get_version(self):
+        version = object_version(self.mesh)
+        return None if version is None else (version, self.trans_version)
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the mesh
+        '''
+
+        return compute_mesh_bounds(self)
 
     @ti.func
     def get_face_verts(self, n):
@@ -1,3 +1,4 @@
 if __import__('tina').lazyguard:
     from .simple import *
     from .trans import *
+    from .field import *
@@ -8,3 +8,32 @@ class ParsEditBase:
 
     def __getattr__(self, attr):
         return getattr(self.pars, attr)
+
+
+@ti.kernel
+def _compute_pars_bounds(pars: ti.template(), out: ti.ext_arr()):
+    for i in range(pars.get_npars()):
+        pos = pars.get_particle_position(i)
+        rad = pars.get_particle_radius(i)
+        for k in ti.static(range(3)):
+            ti.atomic_min(out[0, k], pos[k] - rad)
+            ti.atomic_max(out[1, k], pos[k] + rad)
+
+
+def compute_pars_bounds(pars):
+    '''
+    :param pars: (Pars) the particles to be bounded
+    :return: (np.array[2, 3]) minimum and maximum corners of all particle spheres
+
+    :note: the result is cached until the particles version changes
+    '''
+
+    version = object_version(pars)
+    cached = pars.__dict__.get('_bounds_cache')
+    if version is not None and cached is not None and cached[0] == version:
+        return cached[1]
+
+    out = np.array([[np.inf] * 3, [-np.inf] * 3], dtype=np.float32)
+    _compute_pars_bounds(pars, out)
+    pars._bounds_cache = version, out
+    return out
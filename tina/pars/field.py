@@ -0,0 +1,105 @@
+from ..common import *
+from .base import compute_pars_bounds
+
+
+@ti.data_oriented
+class FieldParticles:
+    # rasters read the fields directly instead of copying them into their buffers
+    zero_copy = True
+
+    def __init__(self, pos, radius=0.02, color=(1., 1., 1.), npars=None,
+            static=False):
+        '''
+        :param pos: (Vector.field) position of each particle, e.g. the x field of a simulator
+        :param radius: (float | field) radius of all particles, or a field of radius per particle
+        :param color: (3 * [float] | Vector.field) color of all particles, or a field of color per particle
+        :param npars: (int | field | func) number of particles, a 0-D field or a ti.func returning it, pos.shape[0] by default
+        :param static: (bool) the fields only change when touch() is called, so that the bounds are cached in between
+        :return: (Pars) the particles object to add into scene
+
+        Particles bound to fields of the user, nothing is copied when the
+        fields change, so there is no need to call set_particles every frame
+
+        By default they are always dirty, as the fields may change without
+        notice: the bounding box is computed again every frame, culling
+        still applies
+        '''
+
+        self.pos = pos
+        # numpy scalars and arrays are constants too, only fields vary per particle
+        self.per_radius = not isinstance(radius, (int, float, np.number, np.ndarray))
+        self.per_color = not isinstance(color, (tuple, list, np.ndarray))
+        if not self.per_radius:
+            radius = float(radius)
+        if not self.per_color:
+            color = np.asarray(color, dtype=np.float32)
+            assert color.shape == (3,), color.shape
+            color = color.tolist()
+        self.radius = radius if self.per_radius else ti.field(float, ())
+        self.color = color if self.per_color else ti.Vector.field(3, float, ())
+        self.npars = pos.shape[0] if npars is None else npars
+        self.static = static
+        self.version = 0
+
+        @ti.materialize_callback
+        def init_pars():
+            if not self.per_radius:
+                self.radius[None] = radius
+            if not self.per_color:
+                self.color[None] = color
+
+    @ti.func
+    def pre_compute(self):
+        pass
+
+    def get_version(self):
+        return self.version if self.static else None
+
+    def touch(self):
+        '''
+        Notify that the fields have changed, for static=True
+        '''
+
+        self.version += 1
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the particles
+
+        :note: computed every frame, as changes to the fields are not tracked
+        '''
+
+        return compute_pars_bounds(self)
+
+    @ti.func
+    def get_npars(self):
+        ret = 0
+        if ti.static(isinstance(self.npars, int)):
+            ret = self.npars
+        elif ti.static(hasattr(self.npars, 'shape')):
+            ret = self.npars[None]
+        else:
+            ret = self.npars()
+        return ret
+
+    @ti.func
+    def get_particle_position(self, n):
+        return self.pos[n]
+
+    @ti.func
+    def get_particle_radius(self, n):
+        ret = 0.0
+        if ti.static(self.per_radius):
+            ret = self.radius[n]
+        else:
+            ret = self.radius[None]
+        return ret
+
+    @ti.func
+    def get_particle_color(self, n):
+        ret = V(1., 1., 1.)
+        if ti.static(self.per_color):
+            ret = self.color[n]
+        else:
+            ret = self.color[None]
+        return ret
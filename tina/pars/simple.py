@@ -1,4 +1,5 @@
 from ..common import *
+from .base import compute_pars_bounds
 
 
 @ti.data_oriented
@@ -8,6 +9,7 @@ class SimpleParticles:
         self.sizes = ti.field(float, maxpars)
         self.colors = ti.Vector.field(3, float, maxpars)
         self.npars = ti.field(int, ())
+        self.version = ti.field(int, ())
 
         @ti.materialize_callback
         def init_pars():
@@ -20,6 +22,16 @@ class SimpleParticles:
     def pre_compute(self):
         pass
 
+    def get_version(self):
+        return self.version[None]
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the particles
+        '''
+
+        return compute_pars_bounds(self)
+
     @ti.func
     def get_npars(self):
         return min(self.npars[None], self.maxpars)
@@ -38,6 +50,7 @@ class SimpleParticles:
 
     @ti.kernel
     def set_particles(self, verts: ti.ext_arr()):
+        self.version[None] += 1
         self.npars[None] = min(verts.shape[0], self.verts.shape[0])
         for i in range(self.npars[None]):
             for k in ti.static(range(3)):
@@ -45,11 +58,13 @@ class SimpleParticles:
 
     @ti.kernel
     def set_particle_radii(self, sizes: ti.ext_arr()):
+        self.version[None] += 1
         for i in range(self.npars[None]):
             self.sizes[i] = sizes[i]
 
     @ti.kernel
     def set_particle_colors(self, colors: ti.ext_arr()):
+        self.version[None] += 1
         for i in range(self.npars[None]):
             for k in ti.static(range(3)):
                 self.colors[i][k] = colors[i, k]
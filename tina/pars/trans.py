@@ -1,5 +1,5 @@
 from ..common import *
-from .base import ParsEditBase
+from .base import ParsEditBase, compute_pars_bounds
 
 
 class ParsTransform(ParsEditBase):
@@ -8,6 +8,7 @@ class ParsTransform(ParsEditBase):
 
         self.trans = ti.Matrix.field(4, 4, float, ())
         self.scale = ti.field(float, ())
+        self.trans_version = 0
 
         @ti.materialize_callback
         @ti.kernel
@@ -18,6 +19,18 @@ class ParsTransform(ParsEditBase):
     def set_transform(self, trans, scale):
         self.trans[None] = np.array(trans).tolist()
         self.scale[None] = scale
+        self.trans_version += 1
+
+    def get_version(self):
+        version = object_version(self.pars)
+        return None if version is None else (version, self.trans_version)
+
+    def get_bounding_box(self):
+        '''
+        :return: (np.array[2, 3]) minimum and maximum corners of the particles
+        '''
+
+        return compute_pars_bounds(self)
 
     @ti.func
     def get_particle_position(self, n):
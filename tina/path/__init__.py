@@ -5,3 +5,4 @@ if __import__('tina').lazyguard:
     from .triangle import *
     from .volume import *
     from .tree import *
+    from .stats import *
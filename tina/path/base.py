@@ -0,0 +1,107 @@
+from ..advans import *
+
+
+class ObjectTracerBase:
+    def __init__(self, maxelems, standalone=True):
+        '''
+        :param maxelems: (int) max number of elements
+        :param standalone: (bool) build a BVH of its own, False when owned by a MixedGeometryTracer
+
+        Keeps per-object handles over ranges of the element fields, so that
+        objects can be removed, re-uploaded or moved without touching the
+        rest of the scene
+        '''
+
+        self.maxelems = maxelems
+        self.allocator = tina.RangeAllocator(maxelems)
+        self.objects = {}
+        self.next_handle = 0
+        # objects changed since the BVH was last updated, handle -> op
+        self.changes = {}
+        self.cleared = False
+
+        self.standalone = standalone
+        if self.standalone:
+            self.tree = tina.BVHTree(self, self.maxelems * 4)
+
+    def get_max_elements(self):
+        return self.maxelems
+
+    def _set_nelems(self, nelems):
+        raise NotImplementedError
+
+    def _kill_range(self, base, size):
+        raise NotImplementedError
+
+    def _transform_range(self, base, size, trans):
+        raise NotImplementedError
+
+    def clear_objects(self):
+        self.allocator.clear()
+        self.objects.clear()
+        self._set_nelems(0)
+        self.changes.clear()
+        self.cleared = True
+
+    def _alloc_object(self, size, trans):
+        base = self.allocator.malloc(size)
+        handle = self.next_handle
+        self.next_handle += 1
+        self.objects[handle] = [base, size, np.array(trans, dtype=np.float32)]
+        self._set_nelems(self.allocator.get_top())
+        self.changes[handle] = 'build'
+        return handle
+
+    def _realloc_object(self, handle, size):
+        base, old_size, trans = self.objects[handle]
+        if size == old_size:
+            self.changes.setdefault(handle, 'refit')
+            return base
+        self.allocator.free(base)
+        self._kill_range(base, old_size)
+        base = self.allocator.malloc(size)
+        self.objects[handle][:2] = base, size
+        self._set_nelems(self.allocator.get_top())
+        self.changes[handle] = 'build'
+        return base
+
+    def remove(self, handle):
+        '''
+        :param handle: (int) handle returned when the object was added
+
+        Remove an object, its range is reused by later additions
+        '''
+
+        base, size, trans = self.objects.pop(handle)
+        self.allocator.free(base)
+        self._kill_range(base, size)
+        self._set_nelems(self.allocator.get_top())
+        self.changes[handle] = 'remove'
+
+    def set_transform(self, handle, trans):
+        '''
+        :param handle: (int) handle returned when the object was added
+        :param trans: (np.array[4, 4]) new world matrix of the object
+
+        Move an object in place, only a BVH refit is needed afterwards
+        '''
+
+        trans = np.array(trans, dtype=np.float32)
+        base, size, old_trans = self.objects[handle]
+        delta = trans @ np.linalg.inv(old_trans)
+        self._transform_range(base, size, np.float32(delta))
+        self.objects[handle][2] = trans
+        self.changes.setdefault(handle, 'refit')
+
+    def pop_changes(self):
+        '''
+        :return: (tuple) whether all objects were cleared, and the ops of objects changed since the last call, 'build', 'refit' or 'remove' by handle
+        '''
+
+        ret = self.cleared, self.changes
+        self.cleared, self.changes = False, {}
+        return ret
+
+    def update(self):
+        if self.standalone:
+            self.tree.sync([self])
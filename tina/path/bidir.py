@@ -3,7 +3,8 @@ from ..advans import *
 
 @ti.data_oriented
 class BidirEngine:
-    def __init__(self, geom, lighting, mtltab, res=512):
+    def __init__(self, geom, lighting, mtltab, res=512,
+            pixel_order='scanline'):
         if isinstance(res, int): res = res, res
         self.res = ti.Vector(res)
         self.nrays = self.res.x * self.res.y
@@ -14,7 +15,8 @@ class BidirEngine:
         self.geom = geom
         self.lighting = lighting
         self.mtltab = mtltab
-        self.stack = tina.Stack(N_mt=self.nrays)
+        self.order = tina.make_pixel_order(self.res, pixel_order)
+        self.stack = tina.Stack(N_mt=self.order.get_nthreads())
 
         self.W2V = ti.Matrix.field(4, 4, float, ())
         self.V2W = ti.Matrix.field(4, 4, float, ())
@@ -93,7 +95,9 @@ class BidirEngine:
     def trace(self, maxdepth: int, surviverate: float):
         self.uniqid[None] += 1
         for i in ti.smart(self.stack):
-            I = V(i // self.res.x, i % self.res.x)
+            I = self.order.get_pixel(i)
+            if not self.order.contains(I):
+                continue
             rw = tina.random_wav(self.uniqid[None] + I.y)
             ray_ro, ray_rc, ray_depth = self.trace_ray(I, rw, maxdepth, surviverate)
             lay_ro, lay_rc, lay_depth = self.trace_lay(rw, maxdepth, surviverate)
@@ -1,19 +1,30 @@
 from ..advans import *
+import time
 
 
 @ti.data_oriented
 class PathEngine:
-    def __init__(self, geom, mtltab, res=512):
+    def __init__(self, geom, mtltab, res=512, spp_per_launch=None,
+            pixel_order='scanline', stats=False):
         if isinstance(res, int): res = res, res
         self.res = ti.Vector(res)
         self.nrays = self.res.x * self.res.y
 
+        if spp_per_launch is None:
+            # CUDA launches a thread per pixel, so batching samples amortizes
+            # the launch and the global img/cnt atomics; on CPU a single
+            # sample already takes long enough to keep the GUI responsive
+            spp_per_launch = 1 if ti.cfg.arch == ti.cpu else 4
+        self.spp_per_launch = spp_per_launch
+
         self.img = ti.Vector.field(3, float, self.res)
         self.cnt = ti.field(int, self.res)
+        self.stats = tina.RayStats(self.res) if stats else None
 
         self.geom = geom
         self.mtltab = mtltab
-        self.stack = tina.Stack(N_mt=self.nrays)
+        self.order = tina.make_pixel_order(self.res, pixel_order)
+        self.stack = tina.Stack(N_mt=self.order.get_nthreads())
 
         self.W2V = ti.Matrix.field(4, 4, float, ())
         self.V2W = ti.Matrix.field(4, 4, float, ())
@@ -30,6 +41,28 @@ class PathEngine:
     def clear_image(self):
         self.img.fill(0)
         self.cnt.fill(0)
+        if self.stats is not None:
+            self.stats.clear()
+
+    def get_stats(self):
+        '''
+        :return: (dict) total ray and traversal counts since clear_image, and rays per second
+
+        :note: requires PathEngine(stats=True)
+        '''
+
+        assert self.stats is not None, 'ray statistics are disabled'
+        return self.stats.get_stats()
+
+    def get_heatmap(self):
+        '''
+        :return: (np.array[*res, 3]) per-pixel BVH traversal cost image
+
+        :note: requires PathEngine(stats=True)
+        '''
+
+        assert self.stats is not None, 'ray statistics are disabled'
+        return self.stats.get_heatmap(self.cnt)
 
     @ti.kernel
     def _fast_export_image(self, out: ti.ext_arr(), blocksize: int):
@@ -69,30 +102,59 @@ class PathEngine:
         self._get_image(out, raw)
         return out
 
+    def trace(self, maxdepth, surviverate, blocksize=0, spp=None):
+        if spp is None:
+            spp = self.spp_per_launch
+        if blocksize != 0:
+            spp = 1  # preview rays are not jittered
+        if self.stats is None:
+            self._trace(maxdepth, surviverate, blocksize, spp)
+        else:
+            ti.sync()
+            t0 = time.time()
+            self._trace(maxdepth, surviverate, blocksize, spp)
+            ti.sync()
+            self.stats.elapsed += time.time() - t0
+
     @ti.kernel
-    def trace(self, maxdepth: int, surviverate: float, blocksize: int):
+    def _trace(self, maxdepth: int, surviverate: float, blocksize: int,
+            spp: int):
         self.uniqid[None] += 1
 
         for i in ti.smart(self.stack):
             rng = tina.TaichiRNG()
 
-            I = V(i % self.res.x, i // self.res.x)
+            I = self.order.get_pixel(i)
+            if not self.order.contains(I):
+                continue
             if blocksize != 0 and Vany(I % blocksize != 0):
                 continue
 
-            ro, rd = self.generate_ray(I, blocksize)
-            rc = V(1., 1., 1.)
-            rl = V(0., 0., 0.)
-            rs = 0.0
+            tina.RayStats.spec_pixel(self.stats, I)
+            acc = V(0., 0., 0.)
+            nsecondary = 0
+            for s in range(spp):
+                ro, rd = self.generate_ray(I, blocksize)
+                rc = V(1., 1., 1.)
+                rl = V(0., 0., 0.)
+                rs = 0.0
 
-            for depth in range(maxdepth):
-                ro, rd, rc, rl, rs = self.transmit_ray(ro, rd, rc, rl, rs, rng)
-                if not Vany(rc > 0):
-                    break
+                for depth in range(maxdepth):
+                    if depth != 0:
+                        nsecondary += 1
+                    ro, rd, rc, rl, rs = self.transmit_ray(ro, rd, rc, rl, rs, rng)
+                    if not Vany(rc > 0):
+                        break
+
+                acc += rl
+
+            tina.RayStats.count('primary', spp)
+            tina.RayStats.count('secondary', nsecondary)
+            tina.RayStats.clear_pixel()
 
             if blocksize != 0:
                 I //= blocksize
-            self.record_photon(I, rl)
+            self.record_photon(I, acc, spp)
 
     @ti.kernel
     def trace_light(self, maxdepth: int, surviverate: float):
@@ -129,9 +191,9 @@ class PathEngine:
                     break
 
     @ti.func
-    def record_photon(self, I, rl):
+    def record_photon(self, I, rl, n):
         self.img[I] += rl
-        self.cnt[I] += 1
+        self.cnt[I] += n
 
     @ti.func
     def generate_ray(self, I, blocksize):
@@ -207,11 +269,12 @@ class PathEngine:
             li_dis = (ro0 - ro).norm()
             li_clr = rc * max(0, -rd.dot(nrm)) / rn**2
             if Vany(li_clr > 0):
+                tina.RayStats.count('shadow', 1)
                 occ_near, occ_ind, occ_gid, occ_uv = self.geom.hit(ro, new_rd)
                 if occ_gid == -1 or occ_near >= li_dis:  # no shadow occlusion
                     li_clr *= material.brdf(nrm, -rd, new_rd)
                     I = ifloor((vpos.xy * 0.5 + 0.5) * self.res)
-                    self.record_photon(I, li_clr)
+                    self.record_photon(I, li_clr, 1)
 
     @ti.func
     def transmit_ray(self, ro, rd, rc, rl, rs, rng):
@@ -296,6 +359,7 @@ class PathEngine:
             dis = ti.sqrt(dis2)
 
             if Vany(fac > 0):
+                tina.RayStats.count('shadow', 1)
                 near, ind, gid, uv = self.geom.hit(ro, toli)
                 if gid != -1 and near < dis:
                     # shadow occlusion
@@ -1,16 +1,31 @@
 from ..advans import *
 from .geometry import *
+from .base import ObjectTracerBase
+
+
+@ti.kernel
+def _pre_compute_pars_npars(pars: ti.template()) -> int:
+    pars.pre_compute()
+    return pars.get_npars()
 
 
 @ti.data_oriented
-class ParticleTracer:
+class ParticleTracer(ObjectTracerBase):
     @ti.func
     def calc_geometry(self, ind, uv, pos):
         nrm = (pos - self.verts[ind]).normalized()
-        mtlid = self.mtlids[ind]
+        mtlid = self.get_material_id(ind)
         return nrm, V(0., 0.), mtlid
 
-    def __init__(self, maxpars=65536 * 16, coloring=True, multimtl=True, **extra_options):
+    def __init__(self, maxpars=65536 * 16, coloring=True, multimtl=True,
+            standalone=True, **extra_options):
+        '''
+        :param maxpars: (int) max number of particles
+        :param coloring: (bool) store per-particle colors
+        :param multimtl: (bool) store per-particle material ids
+        :param standalone: (bool) build a BVH of its own, False when owned by a MixedGeometryTracer
+        '''
+
         self.coloring = coloring
         self.multimtl = multimtl
         self.maxpars = maxpars
@@ -29,22 +44,17 @@ class ParticleTracer:
             if self.coloring:
                 self.colors.fill(1)
 
-        self.tree = tina.BVHTree(self, self.maxpars * 4)
+        super().__init__(maxpars, standalone)
 
         self.eminds = ti.field(int, maxpars)
         self.neminds = ti.field(int, ())
 
-    @ti.kernel
-    def _export_geometry(self, verts: ti.ext_arr(), sizes: ti.ext_arr()):
-        for i in range(self.npars[None]):
-            sizes[i] = self.sizes[i]
-            for k in ti.static(range(3)):
-                verts[i, k] = self.verts[i][k]
-
     @ti.kernel
     def update_emission(self, mtltab: ti.template()):
         self.neminds[None] = 0
         for i in range(self.npars[None]):
+            if self.sizes[i] == 0:
+                continue
             mtlid = self.get_material_id(i)
             material = mtltab.get(mtlid)
             emission = material.estimate_emission()
@@ -52,54 +62,112 @@ class ParticleTracer:
                 j = ti.atomic_add(self.neminds[None], 1)
                 self.eminds[j] = i
 
-    def update(self):
-        pos = np.empty((self.npars[None], 3), dtype=np.float32)
-        rad = np.empty((self.npars[None]), dtype=np.float32)
-        self._export_geometry(pos, rad)
-        rad = np.stack([rad, rad, rad], axis=1)
-        self.tree.build(pos - rad, pos + rad)
+    @ti.func
+    def element_bounds(self, ind):
+        pos = self.verts[ind]
+        rad = self.sizes[ind]
+        return pos - rad, pos + rad
+
+    def _set_nelems(self, nelems):
+        self.npars[None] = nelems
+
+    def add_pars(self, world, verts, sizes, colors, mtlid):
+        '''
+        :param world: (np.array[4, 4]) model to world matrix
+        :param verts: (np.array[npars, 3]) particle positions
+        :param sizes: (np.array[npars]) particle radii
+        :param colors: (np.array[npars, 3]) particle colors
+        :param mtlid: (int) material id of the particles
+        :return: (int) handle of the added object
+        '''
+
+        handle = self._alloc_object(len(verts), world)
+        base = self.objects[handle][0]
+        self._add_pars(world, verts, sizes, colors, mtlid, base)
+        return handle
+
+    def add_object(self, pars, mtlid):
+        '''
+        :param pars: (Particles) the particles object to read from, on device
+        :param mtlid: (int) material id of the particles
+        :return: (int) handle of the added object
+        '''
+
+        npars = _pre_compute_pars_npars(pars)
+        handle = self._alloc_object(npars, np.eye(4))
+        base = self.objects[handle][0]
+        self._add_object(pars, mtlid, base, npars)
+        return handle
+
+    def update_object(self, handle, pars, mtlid):
+        '''
+        :param handle: (int) handle returned by add_object
+        :param pars: (Particles) the particles object to re-read from
+        :param mtlid: (int) material id of the particles
+
+        Re-upload an object in place, the BVH is only refitted when the
+        number of particles did not change
+        '''
+
+        npars = _pre_compute_pars_npars(pars)
+        base = self._realloc_object(handle, npars)
+        self.objects[handle][2] = np.eye(4, dtype=np.float32)
+        self._add_object(pars, mtlid, base, npars)
 
-    def clear_objects(self):
-        self.npars[None] = 0
+    @ti.kernel
+    def _kill_range(self, base: int, size: int):
+        for i in range(base, base + size):
+            self.sizes[i] = 0
 
     @ti.kernel
-    def add_pars(self, world: ti.ext_arr(), verts: ti.ext_arr(),
-            sizes: ti.ext_arr(), colors: ti.ext_arr(), mtlid: int):
+    def _transform_range(self, base: int, size: int, world: ti.ext_arr()):
+        trans = ti.Matrix.zero(float, 4, 4)
+        linear = ti.Matrix.zero(float, 3, 3)
+        for i, j in ti.static(ti.ndrange(4, 4)):
+            trans[i, j] = world[i, j]
+        for i, j in ti.static(ti.ndrange(3, 3)):
+            linear[i, j] = world[i, j]
+        scale = abs(linear.determinant())**(1 / 3)
+        for j in range(base, base + size):
+            self.verts[j] = mapply_pos(trans, self.verts[j])
+            self.sizes[j] *= scale
+
+    @ti.kernel
+    def _add_pars(self, world: ti.ext_arr(), verts: ti.ext_arr(),
+            sizes: ti.ext_arr(), colors: ti.ext_arr(), mtlid: int, base: int):
         trans = ti.Matrix.zero(float, 4, 4)
         for i, j in ti.static(ti.ndrange(4, 4)):
             trans[i, j] = world[i, j]
         npars = verts.shape[0]
-        base = self.npars[None]
-        self.npars[None] += npars
         for i in range(npars):
             j = base + i
-            self.mtlids[j] = mtlid
+            if ti.static(self.multimtl):
+                self.mtlids[j] = mtlid
             for l in ti.static(range(3)):
                 self.verts[j][l] = verts[i, l]
-                self.verts[j] = mapply_pos(trans, self.verts[j])
-            self.sizes[j] = sizes[j]
+            self.verts[j] = mapply_pos(trans, self.verts[j])
+            self.sizes[j] = sizes[i]
             if ti.static(self.coloring):
                 for l in ti.static(range(3)):
                     self.colors[j][l] = colors[i, l]
                 #self.colors[j] = trans @ self.colors[j]
 
     @ti.kernel
-    def add_object(self, pars: ti.template(), mtlid: ti.template()):
-        pars.pre_compute()
-        npars = pars.get_npars()
-        base = self.npars[None]
-        self.npars[None] += npars
-        for i in range(self.npars[None]):
+    def _add_object(self, pars: ti.template(), mtlid: int, base: int, npars: int):
+        for i in range(npars):
             j = base + i
             if ti.static(self.multimtl):
                 self.mtlids[j] = mtlid
-            vert = pars.get_particle_position(i)
-            self.verts[j] = vert
-            size = pars.get_particle_radius(i)
-            self.sizes[j] = size
+            self.verts[j] = pars.get_particle_position(i)
+            if ti.static(hasattr(pars, 'get_particle_radius')):
+                self.sizes[j] = pars.get_particle_radius(i)
+            else:
+                self.sizes[j] = 0.1
             if ti.static(self.coloring):
-                color = pars.get_particle_color(i)
-                self.colors[j] = color
+                if ti.static(hasattr(pars, 'get_particle_color')):
+                    self.colors[j] = pars.get_particle_color(i)
+                else:
+                    self.colors[j] = V(1., 1., 1.)
 
     @ti.func
     def element_hit(self, ind, ro, rd):
@@ -0,0 +1,90 @@
+from ..advans import *
+
+
+@ti.data_oriented
+class RayStats:
+    kinds = ['primary', 'secondary', 'shadow', 'nodes', 'prims']
+    g_pixel = []
+
+    def __init__(self, res):
+        '''
+        :param res: (int | tuple) resolution of screen
+
+        Per-pixel ray tracing counters, enabled by PathEngine(stats=True)
+        '''
+
+        self.res = tovector(res)
+        self.counts = ti.Vector.field(len(self.kinds), int, self.res)
+        self.elapsed = 0.0
+
+        ti.materialize_callback(self.clear)
+
+    def clear(self):
+        self.counts.fill(0)
+        self.elapsed = 0.0
+
+    @staticmethod
+    def spec_pixel(stats, I):
+        RayStats.g_pixel.insert(0, (stats, I))
+
+    @staticmethod
+    def clear_pixel():
+        RayStats.g_pixel.pop(0)
+
+    @staticmethod
+    def count(kind, n):
+        '''
+        Count n events of the given kind for the pixel being traced
+
+        :note: this emits nothing unless a RayStats is bound by spec_pixel
+        '''
+
+        if len(RayStats.g_pixel):
+            stats, I = RayStats.g_pixel[0]
+            if stats is not None:
+                stats._count(I, RayStats.kinds.index(kind), n)
+
+    @ti.func
+    def _count(self, I, k: ti.template(), n):
+        self.counts[I][k] += n
+
+    def get_totals(self):
+        counts = self.counts.to_numpy().reshape(-1, len(self.kinds))
+        totals = counts.sum(axis=0)
+        return dict(zip(self.kinds, map(int, totals)))
+
+    def get_stats(self):
+        '''
+        :return: (dict) total counts of each kind, plus rays and rays per second
+        '''
+
+        ret = self.get_totals()
+        ret['rays'] = ret['primary'] + ret['secondary'] + ret['shadow']
+        ret['elapsed'] = self.elapsed
+        ret['rays_per_sec'] = ret['rays'] / max(self.elapsed, 1e-6)
+        return ret
+
+    @ti.kernel
+    def _get_cost(self, out: ti.ext_arr(), cnt: ti.template()):
+        nodes, prims = ti.static(self.kinds.index('nodes'), self.kinds.index('prims'))
+        for I in ti.grouped(self.counts):
+            val = 0.0
+            if cnt[I] != 0:
+                val = (self.counts[I][nodes] + self.counts[I][prims]) / cnt[I]
+            out[I] = val
+
+    def get_heatmap(self, cnt):
+        '''
+        :param cnt: (field) number of samples taken at each pixel
+        :return: (np.array[*res, 3]) traversal cost (node visits plus primitive tests) per sample, blue for cheap and red for expensive
+        '''
+
+        cost = np.zeros(tuple(self.res.entries), dtype=np.float32)
+        self._get_cost(cost, cnt)
+        cost /= max(np.percentile(cost, 99), 1e-6)
+        cost = np.clip(cost, 0, 1)
+        out = np.empty((*cost.shape, 3), dtype=np.float32)
+        out[..., 0] = np.clip(cost * 2 - 1, 0, 1)
+        out[..., 1] = 1 - abs(cost * 2 - 1)
+        out[..., 2] = np.clip(1 - cost * 2, 0, 1)
+        return out
@@ -5,6 +5,20 @@ from .geometry import *
 @ti.data_oriented
 class BVHTree:
     def __init__(self, geom, N_tree=MAX, dim=3):
+        '''
+        :param geom: (Geometry) provides element_bounds(ref) and element_hit(ref, ro, rd)
+        :param N_tree: (int) number of nodes shared by all subtrees
+        :param dim: (int) dimension of the space
+
+        Two-level BVH, each object has a subtree of its own in a range of
+        the nodes, and a small top tree is built over the object bounds,
+        so that adding, removing or moving an object only rebuilds or
+        refits its own subtree
+
+        Subtrees use heap order within their range, the children of local
+        node i are 2i and 2i+1, local node 1 is the root
+        '''
+
         self.geom = geom
         self.N_tree = N_tree
         self.dim = dim
@@ -13,44 +27,227 @@ class BVHTree:
         self.min = ti.Vector.field(self.dim, float)
         self.max = ti.Vector.field(self.dim, float)
         self.ind = ti.field(int)
+        self.obase = ti.field(int)
         self.tree = ti.root.dense(ti.i, self.N_tree)
-        self.tree.place(self.dir, self.min, self.max, self.ind)
+        self.tree.place(self.dir, self.min, self.max, self.ind, self.obase)
+        self.root = ti.field(int, ())
+
+        self.nodes = tina.RangeAllocator(self.N_tree)
+        self.subtrees = {}
+        self.top = None
+        ti.materialize_callback(lambda: self._set_root(-1))
+
+    def build(self, pmin, pmax, pind=None):
+        '''
+        :param pmin: (np.array[n, dim]) lower corners of element bounds
+        :param pmax: (np.array[n, dim]) upper corners of element bounds
+        :param pind: (np.array[n]) element references stored in leaves, defaults to 0..n-1
+
+        Build a single tree over all the elements, dropping every object
+        '''
+
+        if pind is None:
+            pind = np.arange(len(pmin))
+        self.nodes.clear()
+        self.subtrees.clear()
+        print('[Tina] building tree...')
+        self.top = self._build_subtree(pmin, pmax, pind)
+        self._set_root(self.top.base + 1 if self.top is not None else -1)
+        print('[Tina] building tree done')
+
+    def refit(self):
+        '''
+        Recompute the node bounds of every subtree bottom-up from
+        geom.element_bounds, keeping their topology
+        '''
+
+        for entry in self.subtrees.values():
+            self._refit_subtree(entry)
+        if self.subtrees:
+            self.build_top()
+        elif self.top is not None:
+            self._refit_subtree(self.top)
+
+    def set_object(self, key, base, size, stride=1, offset=0):
+        '''
+        :param key: (hashable) identifies the object
+        :param base: (int) first element of the object
+        :param size: (int) number of elements of the object
+        :param stride: (int) element references are (base + i) * stride + offset
+        :param offset: (int) see stride
+
+        Build the subtree of an object, bounds are computed on the device
+        for its elements only
+
+        :note: call build_top once all the objects are set
+        '''
+
+        self.remove_object(key)
+        if size <= 0:
+            return
+        pmin = np.empty((size, self.dim), dtype=np.float32)
+        pmax = np.empty((size, self.dim), dtype=np.float32)
+        self._export_bounds(base, stride, offset, pmin, pmax)
+        pind = (np.arange(base, base + size) * stride + offset).astype(np.int32)
+        self.subtrees[key] = self._build_subtree(pmin, pmax, pind)
+
+    def refit_object(self, key):
+        '''
+        :param key: (hashable) identifies the object
+
+        Refit the subtree of an object whose elements moved
+        '''
+
+        if key in self.subtrees:
+            self._refit_subtree(self.subtrees[key])
+
+    def remove_object(self, key):
+        entry = self.subtrees.pop(key, None)
+        if entry is not None:
+            self.nodes.free(entry.base)
+
+    def build_top(self):
+        '''
+        Rebuild the top tree over the bounds of the object subtrees
+        '''
 
-    def build(self, pmin, pmax):
+        if self.top is not None:
+            self.nodes.free(self.top.base)
+        self.top = None
+        keys = list(self.subtrees)
+        if keys:
+            pmin = np.array([self.subtrees[key].bmin for key in keys], dtype=np.float32)
+            pmax = np.array([self.subtrees[key].bmax for key in keys], dtype=np.float32)
+            pind = np.array([self.subtrees[key].base for key in keys], dtype=np.int32)
+            self.top = self._build_subtree(pmin, pmax, pind, instance=True)
+        self._set_root(self.top.base + 1 if self.top is not None else -1)
+
+    def sync(self, tracers):
+        '''
+        :param tracers: (list) object tracers, the element references of tracer i are ind * len(tracers) + i
+
+        Apply the object changes recorded by the tracers since the last
+        sync, only the subtrees of changed objects are touched
+        '''
+
+        changed = False
+        for gid, tracer in enumerate(tracers):
+            cleared, changes = tracer.pop_changes()
+            if cleared:
+                for key in [key for key in self.subtrees if key[0] == gid]:
+                    self.remove_object(key)
+                changes = {handle: 'build' for handle in tracer.objects}
+                changed = True
+            for handle, op in changes.items():
+                key = gid, handle
+                changed = True
+                if op == 'remove':
+                    self.remove_object(key)
+                elif op == 'refit' and key in self.subtrees:
+                    self.refit_object(key)
+                else:
+                    base, size, trans = tracer.objects[handle]
+                    try:
+                        self.set_object(key, base, size, len(tracers), gid)
+                    except RuntimeError:  # fragmented, start over
+                        self.nodes.clear()
+                        self.subtrees.clear()
+                        self.top = None
+                        for g, t in enumerate(tracers):
+                            for h, (b, n, _) in t.objects.items():
+                                self.set_object((g, h), b, n, len(tracers), g)
+                        break
+        if changed or self.top is None:
+            self.build_top()
+
+    def _build_subtree(self, pmin, pmax, pind, instance=False):
         assert len(pmin) == len(pmax)
         assert np.all(pmax >= pmin)
+        assert len(pind) == len(pmin)
+        if not len(pind):
+            return None
         data = lambda: None
-        data.dir = self.dir.to_numpy()
-        data.dir[:] = -1
-        data.min = self.min.to_numpy()
-        data.max = self.max.to_numpy()
-        data.ind = self.ind.to_numpy()
-        print('[Tina] building tree...')
-        self._build(data, pmin, pmax, np.arange(len(pmin)), 1)
-        self._build_from_data(data.dir, data.min, data.max, data.ind)
-        print('[Tina] building tree done')
+        n = 4 * len(pind) + 2
+        data.dir = np.full(n, -1, dtype=np.int32)
+        data.min = np.zeros((n, self.dim), dtype=np.float32)
+        data.max = np.zeros((n, self.dim), dtype=np.float32)
+        data.ind = np.zeros(n, dtype=np.int32)
+        data.top = 1
+        self._build(data, pmin, pmax, pind, 1)
+        size = data.top + 1
+        if instance:  # leaves refer to the root of an object subtree
+            data.dir[:size][data.dir[:size] == 0] = -2
+        base = self.nodes.malloc(size)
+        self._write_nodes(base, data.dir[:size], data.min[:size],
+                data.max[:size], data.ind[:size])
+        return namespace(base=base, size=size,
+                bmin=np.min(pmin, axis=0), bmax=np.max(pmax, axis=0))
+
+    def _refit_subtree(self, entry):
+        for level in reversed(range((entry.size - 1).bit_length())):
+            self._refit_level(entry.base, 2**level, min(2**(level + 1), entry.size))
+        bounds = np.empty((2, self.dim), dtype=np.float32)
+        self._get_root_bounds(entry.base, bounds)
+        entry['bmin'], entry['bmax'] = bounds
 
     @ti.kernel
-    def _build_from_data(self,
+    def _set_root(self, root: int):
+        self.root[None] = root
+
+    @ti.kernel
+    def _get_root_bounds(self, base: int, out: ti.ext_arr()):
+        for k in ti.static(range(self.dim)):
+            out[0, k] = self.min[base + 1][k]
+            out[1, k] = self.max[base + 1][k]
+
+    @ti.kernel
+    def _export_bounds(self, base: int, stride: int, offset: int,
+            pmin: ti.ext_arr(), pmax: ti.ext_arr()):
+        for i in range(pmin.shape[0]):
+            bmin, bmax = self.geom.element_bounds((base + i) * stride + offset)
+            for k in ti.static(range(self.dim)):
+                pmin[i, k] = bmin[k]
+                pmax[i, k] = bmax[k]
+
+    @ti.kernel
+    def _refit_level(self, base: int, lo: int, hi: int):
+        for i in range(lo, hi):
+            curr = base + i
+            if self.dir[curr] == 0:
+                bmin, bmax = self.geom.element_bounds(self.ind[curr])
+                self.min[curr] = bmin
+                self.max[curr] = bmax
+            elif self.dir[curr] == -2:
+                root = self.ind[curr] + 1
+                self.min[curr] = self.min[root]
+                self.max[curr] = self.max[root]
+            elif self.dir[curr] > 0:
+                left = base + i * 2
+                self.min[curr] = min(self.min[left], self.min[left + 1])
+                self.max[curr] = max(self.max[left], self.max[left + 1])
+
+    @ti.kernel
+    def _write_nodes(self, base: int,
             data_dir: ti.ext_arr(),
             data_min: ti.ext_arr(),
             data_max: ti.ext_arr(),
             data_ind: ti.ext_arr()):
-        for i in range(self.dir.shape[0]):
-            if data_dir[i] == -1:
-                continue
-            self.dir[i] = data_dir[i]
+        for i in range(data_dir.shape[0]):
+            curr = base + i
+            self.dir[curr] = data_dir[i]
+            self.obase[curr] = base
             for k in ti.static(range(self.dim)):
-                self.min[i][k] = data_min[i, k]
-                self.max[i][k] = data_max[i, k]
-            self.ind[i] = data_ind[i]
+                self.min[curr][k] = data_min[i, k]
+                self.max[curr][k] = data_max[i, k]
+            self.ind[curr] = data_ind[i]
 
     def _build(self, data, pmin, pmax, pind, curr):
-        assert curr < self.N_tree, curr
+        assert curr < len(data.dir), curr
         if not len(pind):
             return
 
-        elif len(pind) <= 1:
+        data.top = max(data.top, curr)
+        if len(pind) <= 1:
             data.dir[curr] = 0
             data.ind[curr] = pind[0]
             data.min[curr] = pmin[0]
@@ -78,7 +275,7 @@ class BVHTree:
     @ti.kernel
     def _active_indices(self, out: ti.ext_arr()):
         for curr in self.dir:
-            if self.dir[curr] != 0:
+            if self.dir[curr] > 0:
                 out[curr] = 1
 
     def active_indices(self):
@@ -104,15 +301,21 @@ class BVHTree:
         stack = tina.Stack.instance()
         near = inf
         ntimes = 0
+        nprims = 0
         stack.clear()
-        stack.push(1)
+        if self.root[None] != -1:
+            stack.push(self.root[None])
         hitind = -1
         hituv = V(0., 0.)
         while ntimes < self.N_tree and stack.size() != 0:
             curr = stack.pop()
 
+            if self.dir[curr] == -1:
+                continue
+
             if self.dir[curr] == 0:
                 ind = self.ind[curr]
+                nprims += 1
                 hit, depth, uv = self.geom.element_hit(ind, ro, rd)
                 if hit != 0 and depth < near:
                     near = depth
@@ -122,10 +325,17 @@ class BVHTree:
 
             bmin, bmax = self.min[curr], self.max[curr]
             bnear, bfar = ray_aabb_hit(bmin, bmax, ro, rd)
-            if bnear > bfar:
+            if bnear > bfar or bnear > near or bfar < 0:
                 continue
 
             ntimes += 1
-            stack.push(curr * 2)
-            stack.push(curr * 2 + 1)
+            if self.dir[curr] == -2:  # enter the subtree of an object
+                stack.push(self.ind[curr] + 1)
+            else:
+                base = self.obase[curr]
+                left = base + (curr - base) * 2
+                stack.push(left)
+                stack.push(left + 1)
+        tina.RayStats.count('nodes', ntimes)
+        tina.RayStats.count('prims', nprims)
         return near, hitind, hituv
@@ -1,11 +1,25 @@
 from ..advans import *
 from .geometry import *
+from .base import ObjectTracerBase
+
+
+@ti.kernel
+def _pre_compute_mesh_nfaces(mesh: ti.template()) -> int:
+    mesh.pre_compute()
+    return mesh.get_nfaces()
 
 
 @ti.data_oriented
-class TriangleTracer:
+class TriangleTracer(ObjectTracerBase):
     def __init__(self, maxfaces=MAX, smoothing=False, texturing=False,
-                 **extra_options):
+                 standalone=True, **extra_options):
+        '''
+        :param maxfaces: (int) max number of faces
+        :param smoothing: (bool) interpolate vertex normals
+        :param texturing: (bool) interpolate texture coordinates
+        :param standalone: (bool) build a BVH of its own, False when owned by a MixedGeometryTracer
+        '''
+
         self.smoothing = smoothing
         self.texturing = texturing
         self.maxfaces = maxfaces
@@ -18,17 +32,81 @@ class TriangleTracer:
         self.mtlids = ti.field(int, maxfaces)
         self.nfaces = ti.field(int, ())
 
-        self.tree = tina.BVHTree(self, self.maxfaces * 4)
+        super().__init__(maxfaces, standalone)
 
         self.eminds = ti.field(int, maxfaces)
         self.neminds = ti.field(int, ())
 
-    def clear_objects(self):
-        self.nfaces[None] = 0
+    def _set_nelems(self, nelems):
+        self.nfaces[None] = nelems
+
+    def add_mesh(self, world, verts, norms, coors, mtlid):
+        '''
+        :param world: (np.array[4, 4]) model to world matrix
+        :param verts: (np.array[nfaces, 3, 3]) face vertex positions
+        :param norms: (np.array[nfaces, 3, 3]) face vertex normals
+        :param coors: (np.array[nfaces, 3, 2]) face texture coordinates
+        :param mtlid: (int) material id of the faces
+        :return: (int) handle of the added object
+        '''
+
+        handle = self._alloc_object(len(verts), world)
+        base = self.objects[handle][0]
+        self._add_mesh(world, verts, norms, coors, mtlid, base)
+        return handle
+
+    def add_object(self, mesh, mtlid):
+        '''
+        :param mesh: (Mesh) the mesh object to read faces from, on device
+        :param mtlid: (int) material id of the faces
+        :return: (int) handle of the added object
+        '''
+
+        nfaces = _pre_compute_mesh_nfaces(mesh)
+        handle = self._alloc_object(nfaces, np.eye(4))
+        base = self.objects[handle][0]
+        self._add_object(mesh, mtlid, base, nfaces)
+        return handle
+
+    def update_object(self, handle, mesh, mtlid):
+        '''
+        :param handle: (int) handle returned by add_object
+        :param mesh: (Mesh) the mesh object to re-read faces from
+        :param mtlid: (int) material id of the faces
+
+        Re-upload an object in place, the BVH is only refitted when the
+        number of faces did not change
+        '''
+
+        nfaces = _pre_compute_mesh_nfaces(mesh)
+        base = self._realloc_object(handle, nfaces)
+        self.objects[handle][2] = np.eye(4, dtype=np.float32)
+        self._add_object(mesh, mtlid, base, nfaces)
 
     @ti.kernel
-    def add_mesh(self, world: ti.ext_arr(), verts: ti.ext_arr(),
-            norms: ti.ext_arr(), coors: ti.ext_arr(), mtlid: int):
+    def _kill_range(self, base: int, size: int):
+        for i in range(base, base + size):
+            self.mtlids[i] = -1
+
+    @ti.kernel
+    def _transform_range(self, base: int, size: int, world: ti.ext_arr()):
+        trans = ti.Matrix.zero(float, 4, 4)
+        trans_norm = ti.Matrix.zero(float, 3, 3)
+        for i, j in ti.static(ti.ndrange(4, 4)):
+            trans[i, j] = world[i, j]
+        for i, j in ti.static(ti.ndrange(3, 3)):
+            trans_norm[i, j] = world[i, j]
+        trans_norm = trans_norm.inverse().transpose()
+        for j in range(base, base + size):
+            for k in ti.static(range(3)):
+                self.verts[j, k] = mapply_pos(trans, self.verts[j, k])
+            if ti.static(self.smoothing):
+                for k in ti.static(range(3)):
+                    self.norms[j, k] = trans_norm @ self.norms[j, k]
+
+    @ti.kernel
+    def _add_mesh(self, world: ti.ext_arr(), verts: ti.ext_arr(),
+            norms: ti.ext_arr(), coors: ti.ext_arr(), mtlid: int, base: int):
         trans = ti.Matrix.zero(float, 4, 4)
         trans_norm = ti.Matrix.zero(float, 3, 3)
         for i, j in ti.static(ti.ndrange(4, 4)):
@@ -37,8 +115,6 @@ class TriangleTracer:
             trans_norm[i, j] = world[i, j]
         trans_norm = trans_norm.inverse().transpose()
         nfaces = verts.shape[0]
-        base = self.nfaces[None]
-        self.nfaces[None] += nfaces
         for i in range(nfaces):
             j = base + i
             self.mtlids[j] = mtlid
@@ -57,29 +133,30 @@ class TriangleTracer:
                         self.coors[j, k][l] = coors[i, k, l]
 
     @ti.kernel
-    def add_object(self, mesh: ti.template()):
-        mesh.pre_compute()
-        nfaces = mesh.get_nfaces()
-        base = self.nfaces[None]
-        self.nfaces[None] += nfaces
+    def _add_object(self, mesh: ti.template(), mtlid: int, base: int, nfaces: int):
         for i in range(nfaces):
             j = base + i
-            if ti.static(hasattr(mesh, 'get_face_mtlid')):
-                mtlid = mesh.get_face_mtlid(i)
-                self.mtlids[j] = mtlid
-            else:
-                self.mtlids[j] = 0
+            self.mtlids[j] = mtlid
             verts = mesh.get_face_verts(i)
             for k in ti.static(range(3)):
                 self.verts[j, k] = verts[k]
             if ti.static(self.smoothing):
-                norms = mesh.get_face_norms(i)
-                for k in ti.static(range(3)):
-                    self.norms[j, k] = norms[k]
+                if ti.static(hasattr(mesh, 'get_face_norms')):
+                    norms = mesh.get_face_norms(i)
+                    for k in ti.static(range(3)):
+                        self.norms[j, k] = norms[k]
+                else:
+                    nrm = (verts[1] - verts[0]).cross(verts[2] - verts[0]).normalized()
+                    for k in ti.static(range(3)):
+                        self.norms[j, k] = nrm
             if ti.static(self.texturing):
-                coors = mesh.get_face_coors(i)
-                for k in ti.static(range(3)):
-                    self.coors[j, k] = coors[k]
+                if ti.static(hasattr(mesh, 'get_face_coors')):
+                    coors = mesh.get_face_coors(i)
+                    for k in ti.static(range(3)):
+                        self.coors[j, k] = coors[k]
+                else:
+                    for k in ti.static(range(3)):
+                        self.coors[j, k] = V(0., 0.)
 
     @ti.kernel
     def set_face_verts(self, verts: ti.ext_arr()):
@@ -105,30 +182,25 @@ class TriangleTracer:
                 for l in ti.static(range(2)):
                     self.coors[i, k][l] = coors[i, k, l]
 
-    @ti.kernel
-    def _export_vertices(self, verts: ti.ext_arr()):
-        for i in range(self.nfaces[None]):
-            for k in ti.static(range(3)):
-                for l in ti.static(range(3)):
-                    verts[i, k, l] = self.verts[i, k][l]
-
     @ti.kernel
     def update_emission(self, mtltab: ti.template()):
         self.neminds[None] = 0
         for i in range(self.nfaces[None]):
             mtlid = self.get_material_id(i)
+            if mtlid == -1:
+                continue
             material = mtltab.get(mtlid)
             emission = material.estimate_emission()
             if Vany(emission > 0):
                 j = ti.atomic_add(self.neminds[None], 1)
                 self.eminds[j] = i
 
-    def update(self):
-        verts = np.empty((self.nfaces[None], 3, 3), dtype=np.float32)
-        self._export_vertices(verts)
-        bmax = np.max(verts, axis=1)
-        bmin = np.min(verts, axis=1)
-        self.tree.build(bmin, bmax)
+    @ti.func
+    def element_bounds(self, ind):
+        v0 = self.verts[ind, 0]
+        v1 = self.verts[ind, 1]
+        v2 = self.verts[ind, 2]
+        return min(min(v0, v1), v2), max(max(v0, v1), v2)
 
     @ti.func
     def hit(self, ro, rd):
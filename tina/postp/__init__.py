@@ -5,3 +5,5 @@ if __import__('tina').lazyguard:
     from .fxaa import *
     from .ssao import *
     from .ssr import *
+    from .taa import *
+    from .pipeline import *
@@ -3,38 +3,37 @@ from ..advans import *
 
 @ti.data_oriented
 class Blooming:
-    def __init__(self, res):
+    def __init__(self, res, nlevels=None):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param nlevels: (int) number of mip levels, the spread doubles with each, about min(res) / 8 pixels by default
+
+        Dual filtering bloom (Bjorge 2015): the bright parts are
+        progressively downsampled into a mip chain with a 5-tap filter,
+        then upsampled back with an 8-tap tent filter, adding each level
+        on the way, so the cost per pixel is constant at any resolution
+        '''
+
         self.res = tovector(res)
-        self.img = ti.Vector.field(3, float, self.res // 2)
-        self.tmp = ti.Vector.field(3, float, self.res // 2)
-        self.gwei = ti.field(float, 128)
+        if nlevels is None:
+            nlevels = max(1, int(np.log2(min(*self.res) / 8)))
+        self.mips = []
+        size = self.res // 2
+        while len(self.mips) < nlevels and min(*size) >= 2:
+            self.mips.append(ti.Vector.field(3, float, size))
+            size = size // 2
+        self.nlevels = len(self.mips)
+        self.img = self.mips[0]
+
         self.thresh = ti.field(float, ())
         self.factor = ti.field(float, ())
         self.scale = ti.field(float, ())
-        self.sigma = ti.field(float, ())
-        self.radius = ti.field(int, ())
 
         @ti.materialize_callback
         def init_params():
             self.thresh[None] = 1
             self.factor[None] = 1
-            self.radius[None] = min(*self.res) // 16
-            self.sigma[None] = 1
             self.scale[None] = 0.25
-            self.init_gwei()
-
-    @ti.kernel
-    def init_gwei(self):
-        sum = -1.0
-        radius = self.radius[None]
-        sigma = self.sigma[None]
-        for i in range(radius + 1):
-            x = sigma * i / radius
-            y = ti.exp(-x**2)
-            self.gwei[i] = y
-            sum += y * 2
-        for i in range(radius + 1):
-            self.gwei[i] /= sum
 
     @ti.func
     def filter(self, x):
@@ -42,27 +41,55 @@ class Blooming:
         t = 1 - 1 / (1 + self.scale[None] * t)
         return self.factor[None] * t
 
+    @ti.func
+    def sample(self, f: ti.template(), pos):
+        # bilinear with clamp to edge, pos in texel units of f
+        pos = clamp(pos, 0, ti.Vector(f.shape) - 1.001)
+        return bilerp(f, pos)
+
+    def apply(self, image):
+        self.render(image)
+        self._composite(image)
+
+    def prepare(self, engine, image):
+        self.render(image)
+
+    @ti.func
+    def apply_at(self, engine, image, P, color):
+        return color + self.sample(self.img, P / 2 - 0.25) / self.nlevels
+
+    def pixel_traffic(self):
+        return 4 * 12, 0  # bilinear taps of the half resolution image
+
     @ti.kernel
-    def apply(self, image: ti.template()):
-        for I in ti.grouped(self.img):
+    def _composite(self, image: ti.template()):
+        for I in ti.grouped(image):
+            image[I] = self.apply_at(None, image, I, image[I])
+
+    @ti.kernel
+    def render(self, image: ti.template()):
+        for I in ti.grouped(self.mips[0]):
             res = V(0., 0., 0.)
-            for J in ti.grouped(ti.ndrange(2, 2)):
+            for J in ti.static(ti.grouped(ti.ndrange(2, 2))):
                 res += self.filter(image[I * 2 + J])
-            self.img[I] = res / 4
-        for I in ti.grouped(self.img):
-            res = self.img[I] * self.gwei[0]
-            for i in range(1, self.radius[None] + 1):
-                val = self.img[max(0, I.x - i), I.y]
-                val += self.img[min(self.img.shape[0] - 1, I.x + i), I.y]
-                res += val * self.gwei[i]
-            self.tmp[I] = res
-        for I in ti.grouped(self.img):
-            res = self.tmp[I] * self.gwei[0]
-            for i in range(1, self.radius[None] + 1):
-                dir = V(0, 1)
-                val = self.tmp[I.x, max(0, I.y - i)]
-                val += self.tmp[I.x, min(self.img.shape[1] - 1, I.y + i)]
-                res += val * self.gwei[i]
-            self.img[I] = res
-        for I in ti.grouped(image):
-            image[I] += bilerp(self.img, I / 2)
+            self.mips[0][I] = res / 4
+
+        for l in ti.static(range(1, self.nlevels)):
+            src, dst = ti.static(self.mips[l - 1], self.mips[l])
+            for I in ti.grouped(dst):
+                c = I * 2 + 0.5
+                res = self.sample(src, c) * 4
+                for J in ti.static(ti.grouped(ti.ndrange(2, 2))):
+                    res += self.sample(src, c + (J * 2 - 1))
+                dst[I] = res / 8
+
+        for l in ti.static(reversed(range(self.nlevels - 1))):
+            src, dst = ti.static(self.mips[l + 1], self.mips[l])
+            for I in ti.grouped(dst):
+                c = I / 2 - 0.25
+                res = V(0., 0., 0.)
+                for J in ti.static([(1, 0), (-1, 0), (0, 1), (0, -1)]):
+                    res += self.sample(src, c + V(*J))
+                for J in ti.static(ti.grouped(ti.ndrange(2, 2))):
+                    res += self.sample(src, c + (J - 0.5)) * 2
+                dst[I] += res / 12
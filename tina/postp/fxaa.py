@@ -23,26 +23,46 @@ class FXAA:
             self.rel_thresh[None] = 0.063
             self.factor[None] = 1
 
+    @ti.func
+    def apply_at(self, engine, image, P, color):
+        # the luminance pass fuses with the stages before
+        self.lumi[P] = clamp(luminance(color), 0, 1)
+        self.img[P] = color
+        return color
+
+    def pixel_traffic(self):
+        return 0, 4 + 12
+
+    def finish(self, engine, image):
+        self._filter(image)
+
     @ti.kernel
     def apply(self, image: ti.template()):
         for I in ti.grouped(image):
-            self.lumi[I] = clamp(luminance(image[I]), 0, 1)
-            self.img[I] = image[I]
+            self.apply_at(None, image, I, image[I])
         for I in ti.grouped(image):
-            m = self.lumi[I]
-            n = self.lumi[I + V(0, 1)]
-            e = self.lumi[I + V(1, 0)]
-            s = self.lumi[I + V(0, -1)]
-            w = self.lumi[I + V(-1, 0)]
-            ne = self.lumi[I + V(1, 1)]
-            nw = self.lumi[I + V(-1, 1)]
-            se = self.lumi[I + V(1, -1)]
-            sw = self.lumi[I + V(-1, -1)]
-            hi = max(m, n, e, s, w)
-            lo = min(m, n, e, s, w)
-            c = hi - lo
-            if c < self.abs_thresh[None] or c < self.rel_thresh[None] * hi:
-                continue
+            self.filter_at(image, I)
+
+    @ti.kernel
+    def _filter(self, image: ti.template()):
+        for I in ti.grouped(image):
+            self.filter_at(image, I)
+
+    @ti.func
+    def filter_at(self, image, I):
+        m = self.lumi[I]
+        n = self.lumi[I + V(0, 1)]
+        e = self.lumi[I + V(1, 0)]
+        s = self.lumi[I + V(0, -1)]
+        w = self.lumi[I + V(-1, 0)]
+        ne = self.lumi[I + V(1, 1)]
+        nw = self.lumi[I + V(-1, 1)]
+        se = self.lumi[I + V(1, -1)]
+        sw = self.lumi[I + V(-1, -1)]
+        hi = max(m, n, e, s, w)
+        lo = min(m, n, e, s, w)
+        c = hi - lo
+        if c >= self.abs_thresh[None] and c >= self.rel_thresh[None] * hi:
             filt = 2 * (n + e + s + w)
             filt += ne + nw + se + sw
             filt = abs(filt / 12 - m)
@@ -0,0 +1,115 @@
+from ..advans import *
+from ..core.shader import calc_view_ray
+
+
+@ti.data_oriented
+class LowResGBuffer:
+    def __init__(self, res, norm, downsample=1, edge_tolerance=0.05):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param norm: (Vector.field) normal buffer of the screen
+        :param downsample: (int) ratio of the screen resolution to the low resolution, e.g. 1, 2 or 4
+        :param edge_tolerance: (float) relative depth difference beyond which pixels do not blur or upsample into each other
+
+        View distance and normal of the nearest pixel of each block, for
+        effects evaluated at a low resolution, then blurred and upsampled
+        with weights on depth and normal, so that they do not bleed across
+        silhouettes
+        '''
+
+        self.res = tovector(res)
+        self.downsample = downsample
+        self.lres = tovector([(n + downsample - 1) // downsample for n in self.res.entries])
+        self.norm = norm
+        self.dist = ti.field(float, self.lres)
+        self.lnorm = ti.Vector.field(3, float, self.lres)
+        self.lpix = ti.Vector.field(2, int, self.lres)
+        self.edge_tolerance = ti.field(float, ())
+
+        @ti.materialize_callback
+        def init_params():
+            self.edge_tolerance[None] = edge_tolerance
+
+    @ti.kernel
+    def build(self, engine: ti.template()):
+        for L in ti.grouped(self.lpix):
+            best, bestdepth = L * self.downsample, engine.maxdepth + 1
+            for J in ti.static(ti.grouped(ti.ndrange(self.downsample, self.downsample))):
+                P = min(L * self.downsample + J, self.res - 1)
+                if engine.depth[P] < bestdepth:
+                    best, bestdepth = P, engine.depth[P]
+            self.lpix[L] = best
+            self.lnorm[L] = self.norm[best]
+            self.dist[L] = self.get_distance(engine, best)
+
+    @ti.func
+    def get_distance(self, engine, P):
+        # distance along the view ray, inf for background
+        ret = inf
+        if engine.depth[P] < engine.maxdepth:
+            p = P + engine.bias[None]
+            vpos = V23(engine.from_viewport(p), engine.depth[P] / engine.maxdepth)
+            pos = mapply_pos(engine.V2W[None], vpos)
+            ro, rd = calc_view_ray(engine, p)
+            ret = (pos - ro).dot(rd)
+        return ret
+
+    @ti.func
+    def edge_weight(self, dist, normal, L):
+        w = ti.exp(-((self.dist[L] - dist) / (self.edge_tolerance[None] * dist))**2)
+        return w * max(0, self.lnorm[L].dot(normal))**8
+
+    @ti.func
+    def upsample(self, engine, img: ti.template(), P):
+        '''
+        :return: the value of img, a field of the low resolution, at pixel P of the screen, zero for background
+        '''
+
+        dist = self.get_distance(engine, P)
+        ret = img[0, 0] * 0
+        if dist < inf:
+            normal = self.norm[P]
+            c = (P + 0.5) / self.downsample - 0.5
+            I = ifloor(c)
+            x = c - I
+            r, wsum = ret, 0.0
+            rbest, wbest = ret, -1.0
+            for J in ti.static(ti.grouped(ti.ndrange(2, 2))):
+                L = clamp(I + J, 0, self.lres - 1)
+                w = self.edge_weight(dist, normal, L)
+                if w > wbest:
+                    rbest, wbest = img[L], w
+                w *= abs(1 - J.x - x.x) * abs(1 - J.y - x.y)
+                r += img[L] * w
+                wsum += w
+            # all the neighbours across an edge, take the closest match
+            ret = rbest
+            if wsum > 1e-4:
+                ret = r / wsum
+        return ret
+
+    def pixel_traffic(self, nbytes):
+        '''
+        :param nbytes: (int) size of a texel of the upsampled field
+        '''
+
+        return 4 + 12 + 4 * (4 + 12 + nbytes), 0
+
+    @ti.kernel
+    def blur(self, src: ti.template(), dst: ti.template(), axis: ti.template(), rad: int):
+        '''
+        One axis of a rad x rad box filter on the low resolution, skipping the texels across edges
+        '''
+
+        for L in ti.grouped(src):
+            offs = rad // 2
+            dist, normal = self.dist[L], self.lnorm[L]
+            r, wsum = src[L], 1.0
+            if dist < inf:
+                for k in range(rad):
+                    if k != offs:
+                        M = clamp(L + V((k - offs) * (1 - axis), (k - offs) * axis), 0, self.lres - 1)
+                        w = self.edge_weight(dist, normal, M)
+                        r += src[M] * w
+                        wsum += w
+            dst[L] = r / wsum
@@ -0,0 +1,167 @@
+from ..advans import *
+
+
+def _stage_name(stage):
+    return getattr(stage, '__name__', type(stage).__name__)
+
+
+@ti.data_oriented
+class _FusedPass:
+    def __init__(self, stages):
+        self.stages = stages
+
+    @ti.kernel
+    def apply(self, engine: ti.template(), image: ti.template()):
+        for P in ti.grouped(image):
+            color = image[P]
+            for stage in ti.static(self.stages):
+                color = stage.apply_at(engine, image, P, color)
+            image[P] = color
+
+
+@ti.data_oriented
+class _FusedClear:
+    def __init__(self, res, targets):
+        self.res = res
+        self.targets = targets
+
+    @ti.kernel
+    def apply(self):
+        for P in ti.grouped(ti.ndrange(*self.res)):
+            for target in ti.static(self.targets):
+                if ti.static(isinstance(target, tuple)):
+                    field, value = ti.static(target)
+                    if ti.static(isinstance(value, (tuple, list))):
+                        field[P] = ti.Vector(value)
+                    else:
+                        field[P] = value
+                else:
+                    target.clear_at(P)
+
+
+class PostPipeline:
+    def __init__(self, res, stages=(), clears=()):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param stages: (list) post-processing stages, applied to the image in order
+        :param clears: (list) buffers cleared before each frame, as pairs of (field, value), or objects with a clear_at(P) ti.func
+
+        Runs consecutive per-pixel stages in a single kernel, so that the
+        image is read and written once for all of them
+
+        A stage may provide:
+        - apply_at(engine, image, P, color): ti.func returning the new color of pixel P, fused with its neighbours
+        - prepare(engine, image): passes that read the whole image first, e.g. downsampling, ends the fused pass before it
+        - finish(engine, image): passes that filter the result, e.g. FXAA, ends the fused pass after it
+        - apply(image) alone, or be a callable taking (engine, image): run as a pass of its own
+        - pixel_traffic(): (nread, nwrite) bytes per pixel accessed besides the image, for report
+        '''
+
+        self.res = tovector(res)
+        self.stages = list(stages)
+        self.clears = list(clears)
+        self.plan = self._make_plan()
+
+        # fields not covering the screen are cleared on their own
+        fused = []
+        self.other_clears = []
+        for target in self.clears:
+            if isinstance(target, tuple) and tuple(target[0].shape) != tuple(self.res.entries):
+                self.other_clears.append(target)
+            else:
+                fused.append(target)
+        self.fused_clear = _FusedClear(self.res, fused) if fused else None
+
+    def _make_plan(self):
+        plan = []
+        group = []
+
+        def flush():
+            if group:
+                plan.append(('fused', _FusedPass(tuple(group)), list(group)))
+                group.clear()
+
+        for stage in self.stages:
+            if hasattr(stage, 'prepare'):
+                flush()
+                plan.append(('prepare', stage.prepare, [stage]))
+            if hasattr(stage, 'apply_at'):
+                group.append(stage)
+                if hasattr(stage, 'finish'):
+                    flush()
+                    plan.append(('finish', stage.finish, [stage]))
+            elif not hasattr(stage, 'prepare'):
+                flush()
+                plan.append(('opaque', stage, [stage]))
+        flush()
+        return plan
+
+    def clear(self):
+        '''
+        Clear all the buffers in one pass
+        '''
+
+        if self.fused_clear is not None:
+            self.fused_clear.apply()
+        for field, value in self.other_clears:
+            field.fill(value)
+
+    def apply(self, engine, image):
+        '''
+        :param engine: (Engine) the engine holding depth and camera of the frame
+        :param image: (Vector.field) the image to be processed in place
+        '''
+
+        for kind, func, stages in self.plan:
+            if kind == 'fused':
+                func.apply(engine, image)
+            elif kind == 'opaque':
+                if hasattr(func, 'apply'):
+                    func.apply(image)
+                else:
+                    func(engine, image)
+            else:
+                func(engine, image)
+
+    def report(self):
+        '''
+        :return: (list) estimated memory traffic of each pass, as namespaces of kind, stages, and bytes per frame
+
+        The image is counted once read and once written per fused pass,
+        other passes are counted as a full image read and write, plus what
+        their stages report through pixel_traffic
+        '''
+
+        npixels = self.res.x * self.res.y
+        image_bytes = 3 * 4 * 2
+        ret = []
+        if self.fused_clear is not None:
+            nbytes = 0
+            for target in self.fused_clear.targets:
+                if isinstance(target, tuple):  # assume 32-bit components
+                    field = target[0]
+                    nbytes += 4 * getattr(field, 'n', 1) * getattr(field, 'm', 1)
+                elif hasattr(target, 'pixel_traffic'):
+                    nbytes += sum(target.pixel_traffic())
+            ret.append(namespace(kind='clear', stages=[_stage_name(t[0] if
+                isinstance(t, tuple) else t) for t in self.fused_clear.targets],
+                bytes=nbytes * npixels, saved=0))
+
+        for kind, func, stages in self.plan:
+            nbytes = image_bytes
+            if kind in ['fused', 'opaque']:
+                for stage in stages:
+                    if hasattr(stage, 'pixel_traffic'):
+                        nbytes += sum(stage.pixel_traffic())
+            # a fused pass saves the image round trips of its other stages
+            saved = image_bytes * (len(stages) - 1) if kind == 'fused' else 0
+            ret.append(namespace(kind=kind, stages=[_stage_name(s) for s in stages],
+                bytes=nbytes * npixels, saved=saved * npixels))
+        return ret
+
+    def print_report(self):
+        for entry in self.report():
+            line = f'{entry.kind:>8s} {entry.bytes / 2**20:8.2f} MiB  ' + ' + '.join(entry.stages)
+            if entry.saved:
+                line += f'  (saves {entry.saved / 2**20:.2f} MiB)'
+            print(line)
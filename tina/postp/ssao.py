@@ -1,13 +1,30 @@
 from ..advans import *
 from ..core.shader import calc_viewdir
+from .lowres import LowResGBuffer
 
 
 @ti.data_oriented
 class SSAO:
     def __init__(self, res, norm, nsamples=64, thresh=0.0,
-            radius=0.2, factor=1.0, noise_size=4, taa=False):
+            radius=0.2, factor=1.0, noise_size=4, taa=False,
+            downsample=1, edge_tolerance=0.05, pixel_order='scanline'):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param norm: (Vector.field) normal buffer of the screen
+        :param downsample: (int) compute the occlusion at 1/downsample of the resolution, e.g. 2 or 4
+        :param edge_tolerance: (float) relative depth difference beyond which pixels do not blur or upsample into each other
+
+        The occlusion is evaluated for the nearest pixel of each block,
+        blurred and upsampled with weights on depth and normal, so that it
+        does not bleed across silhouettes
+        '''
+
         self.res = tovector(res)
-        self.img = ti.field(float, self.res)
+        self.gbuf = LowResGBuffer(res, norm, downsample, edge_tolerance)
+        self.lres = self.gbuf.lres
+        self.order = tina.make_pixel_order(self.lres, pixel_order)
+        self.img = ti.field(float, self.lres)
+        self.tmp = ti.field(float, self.lres)
         self.radius = ti.field(float, ())
         self.thresh = ti.field(float, ())
         self.factor = ti.field(float, ())
@@ -35,18 +52,17 @@ class SSAO:
             t = ti.tau * ti.random()
             self.rotations[I] = V(ti.cos(t), ti.sin(t))
 
+    @ti.func
+    def apply_at(self, engine, image, P, color):
+        return color * (1 - self.gbuf.upsample(engine, self.img, P))
+
+    def pixel_traffic(self):
+        return self.gbuf.pixel_traffic(4)
+
     @ti.kernel
-    def apply(self, out: ti.template()):
-        for i, j in self.img:
-            if ti.static(self.taa):
-                out[i, j] *= 1 - self.img[i, j]
-            else:
-                r = 0.0
-                rad = self.rotations.shape[0]
-                offs = rad // 2
-                for k, l in ti.ndrange(rad, rad):
-                    r += self.img[i + k - offs, j + l - offs]
-                out[i, j] *= 1 - r / rad**2
+    def apply(self, engine: ti.template(), out: ti.template()):
+        for P in ti.grouped(out):
+            out[P] = self.apply_at(engine, out, P, out[P])
 
     @ti.func
     def make_sample(self):
@@ -55,14 +71,28 @@ class SSAO:
         u = lerp(u, 0.01, 1.0)
         return spherical(u, v) * r
 
+    def render(self, engine):
+        self.gbuf.build(engine)
+        self._render(engine)
+        if not self.taa:
+            # removes the pattern of the rotation noise
+            rad = self.rotations.shape[0]
+            self.gbuf.blur(self.img, self.tmp, 0, rad)
+            self.gbuf.blur(self.tmp, self.img, 1, rad)
+
     @ti.kernel
-    def render(self, engine: ti.template()):
-        for P in ti.grouped(engine.depth):
-            self.render_at(engine, P)
+    def _render(self, engine: ti.template()):
+        for i in range(ti.static(self.order.get_nthreads())):
+            L = self.order.get_pixel(i)
+            if self.order.contains(L):
+                self.img[L] = 0
+                if self.gbuf.dist[L] < inf:
+                    self.render_at(engine, L)
 
     @ti.func
-    def render_at(self, engine, P):
-        normal = self.norm[P]
+    def render_at(self, engine, L):
+        P = self.gbuf.lpix[L]
+        normal = self.gbuf.lnorm[L]
         p = P + engine.bias[None]
         vpos = V23(engine.from_viewport(p), engine.depth[P] / engine.maxdepth)
         pos = mapply_pos(engine.V2W[None], vpos)
@@ -77,7 +107,7 @@ class SSAO:
                 samp = self.make_sample()
             else:
                 samp = self.samples[i]
-                rot = self.rotations[P % self.rotations.shape[0]]
+                rot = self.rotations[L % self.rotations.shape[0]]
                 rotmat = ti.Matrix([[rot.x, rot.y], [-rot.x, rot.y]])
                 samp.x, samp.y = rotmat @ samp.xy
             sample = tangentspace(normal) @ samp
@@ -93,6 +123,4 @@ class SSAO:
 
         ao = occ / self.nsamples[None]
         ao = self.factor[None] * (ao - self.thresh[None])
-        self.img[P] = clamp(ao, 0, 1)
-
-
+        self.img[L] = clamp(ao, 0, 1)
@@ -1,15 +1,38 @@
 from ..advans import *
 from ..core.shader import calc_viewdir
+from .lowres import LowResGBuffer
 
 
 @ti.data_oriented
 class SSR:
-    def __init__(self, res, norm, coor, mtlid, mtltab, taa=False):
+    def __init__(self, res, norm, coor, mtlid, mtltab, taa=False,
+            downsample=1, edge_tolerance=0.05, pixel_order='scanline'):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param norm: (Vector.field) normal buffer of the screen
+        :param coor: (Vector.field) texture coordinate buffer of the screen
+        :param mtlid: (field) material id buffer of the screen
+        :param mtltab: (MaterialTable) the materials to sample the reflected rays from
+        :param downsample: (int) trace the rays at 1/downsample of the resolution, e.g. 2 or 4
+        :param edge_tolerance: (float) relative depth difference beyond which pixels do not blur or upsample into each other
+
+        Rays are traced through a min depth pyramid, skipping over whole
+        cells that they pass in front of, so that the cost grows with the
+        log of the distance travelled rather than linearly
+
+        The reflections are blurred and upsampled with weights on depth
+        and normal, with TAA the frames are accumulated in time instead
+        '''
+
         self.res = tovector(res)
-        self.img = ti.Vector.field(4, float, self.res)
+        self.hiz = tina.DepthPyramid(self.res, op='min')
+        self.gbuf = LowResGBuffer(res, norm, downsample, edge_tolerance)
+        self.lres = self.gbuf.lres
+        self.order = tina.make_pixel_order(self.lres, pixel_order)
+        self.img = ti.Vector.field(4, float, self.lres)
+        self.tmp = ti.Vector.field(4, float, self.lres)
         self.nsamples = ti.field(int, ())
         self.nsteps = ti.field(int, ())
-        self.stepsize = ti.field(float, ())
         self.tolerance = ti.field(float, ())
         self.blurring = ti.field(int, ())
         self.norm = norm
@@ -21,37 +44,136 @@ class SSR:
         @ti.materialize_callback
         def init_params():
             self.nsamples[None] = 32 if not taa else 12
-            self.nsteps[None] = 32 if not taa else 64
-            self.stepsize[None] = 2
-            self.tolerance[None] = 15
+            self.nsteps[None] = 64
+            self.tolerance[None] = 2
             self.blurring[None] = 4
 
-    @ti.kernel
-    def apply(self, image: ti.template()):
-        for i, j in self.img:
-            res = V(0., 0., 0., 0.)
-            if ti.static(self.taa):
-                res = self.img[i, j]
-            else:
-                rad = self.blurring[None]
-                offs = rad // 2
-                for k, l in ti.ndrange(rad, rad):
-                    res += self.img[i + k - offs, j + l - offs]
-                res /= rad**2
-            image[i, j] *= 1 - res.w
-            image[i, j] += res.xyz
+    @ti.func
+    def apply_at(self, engine, image, P, color):
+        res = self.gbuf.upsample(engine, self.img, P)
+        return color * (1 - res.w) + res.xyz
+
+    def prepare(self, engine, image):
+        # reflections are traced from the image as left by the stages before
+        self.render(engine, image)
+
+    def pixel_traffic(self):
+        return self.gbuf.pixel_traffic(16)
 
     @ti.kernel
-    def render(self, engine: ti.template(), image: ti.template()):
+    def apply(self, engine: ti.template(), image: ti.template()):
         for P in ti.grouped(image):
-            if self.norm[P].norm_sqr() < eps:
-                self.img[P] = 0
+            image[P] = self.apply_at(engine, image, P, image[P])
+
+    def render(self, engine, image):
+        self.hiz.build(engine)
+        self.gbuf.build(engine)
+        self._render(engine, image)
+        if not self.taa:
+            # removes the pattern of the per-pixel random sequences
+            rad = self.blurring[None]
+            self.gbuf.blur(self.img, self.tmp, 0, rad)
+            self.gbuf.blur(self.tmp, self.img, 1, rad)
+
+    @ti.kernel
+    def _render(self, engine: ti.template(), image: ti.template()):
+        for i in range(ti.static(self.order.get_nthreads())):
+            L = self.order.get_pixel(i)
+            if not self.order.contains(L):
+                continue
+            if self.gbuf.dist[L] >= inf or self.gbuf.lnorm[L].norm_sqr() < eps:
+                self.img[L] = 0
             else:
-                self.render_at(engine, image, P)
+                self.render_at(engine, image, L)
+
+    @ti.func
+    def get_hiz_depth(self, level, cell):
+        ret = 0
+        for l in ti.static(range(self.hiz.nlevels)):
+            if level == l:
+                ret = self.hiz.levels[l][cell]
+        return ret
 
     @ti.func
-    def render_at(self, engine, image: ti.template(), P):
-        normal = self.norm[P]
+    def get_screen_pos(self, engine, res, rew):
+        v = res / rew
+        return V23(engine.to_viewport(v), v.z)
+
+    @ti.func
+    def cell_exit(self, S0, d, cell, level):
+        # ray parameter slightly past the border of the cell
+        size = 1 << level
+        ret = inf
+        for i in ti.static(range(2)):
+            if d[i] > 0:
+                ret = min(ret, ((cell[i] + 1) * size + 0.01 - S0[i]) / d[i])
+            elif d[i] < 0:
+                ret = min(ret, (cell[i] * size - 0.01 - S0[i]) / d[i])
+        return ret
+
+    @ti.func
+    def trace(self, engine, pos, odir, jitter):
+        '''
+        :return: whether the ray hits, and the viewport position of the hit
+        '''
+
+        # the ray is a line in the (viewport, depth) space, between its
+        # projected origin and where it leaves the frustum, -w < res < w
+        res0, w0 = mapply(engine.W2V[None], pos, 1)
+        res1, w1 = mapply(engine.W2V[None], odir, 0)
+        tend = inf
+        for i in ti.static(range(3)):
+            for s in ti.static([-1, 1]):
+                k = res1[i] - s * w1
+                if s * k > 0:
+                    tend = min(tend, (s * w0 - res0[i]) / k)
+        tend *= 0.999
+        S0 = self.get_screen_pos(engine, res0, w0)
+        S1 = self.get_screen_pos(engine, res0 + res1 * tend, w0 + w1 * tend)
+        d = S1 - S0
+        dmax = max(abs(d.x), abs(d.y))
+
+        hit, t = 0, 0.0
+        if dmax >= 1:
+            # thickness of surfaces, in pixels travelled by the ray
+            vtol = self.tolerance[None] * abs(d.z) / dmax
+            t = (1 + jitter) / dmax
+            level = 0
+            for i in range(self.nsteps[None]):
+                if t >= 1:
+                    break
+                p = S0 + d * t
+                cell = min(max(ifloor(p.xy), 0), self.res - 1) >> level
+                depth = self.get_hiz_depth(level, cell) / engine.maxdepth
+                tcell = max(self.cell_exit(S0, d, cell, level), t + 0.01 / dmax)
+                if p.z < depth:
+                    # in front of everything in the cell, advance to the
+                    # nearest depth of it, or over the whole cell
+                    tdepth = inf
+                    if d.z > 0:
+                        tdepth = t + (depth - p.z) / d.z
+                    if tdepth >= tcell:
+                        t = tcell
+                        level = min(level + 1, self.hiz.nlevels - 1)
+                    else:
+                        t = tdepth
+                        level -= 1
+                elif level > 0:
+                    level -= 1
+                elif p.z - depth < vtol:
+                    level = -1
+                else:
+                    # passing behind a surface, go on past it
+                    t = tcell
+                if level < 0:
+                    hit = 1
+                    break
+        return hit, (S0 + d * t).xy
+
+    @ti.func
+    def render_at(self, engine, image: ti.template(), L):
+        P = self.gbuf.lpix[L]
+        normal = self.gbuf.lnorm[L]
         texcoord = self.coor[P]
         mtlid = self.mtlid[P]
 
@@ -71,33 +193,18 @@ class SSR:
 
         rng = tina.TaichiRNG()
         if ti.static(not self.taa):
-            pid = P % self.blurring[None]
+            pid = L % self.blurring[None]
             rng = ti.static(tina.WangHashRNG(pid))
 
         nsamples = self.nsamples[None]
-        nsteps = self.nsteps[None]
         for i in range(nsamples):
             odir, wei, rough = material.sample(viewdir, normal, 1, rng)
-
-            step = self.stepsize[None] / (
-                    ti.sqrt(1 - odir.dot(viewdir)**2) * nsteps)
-            vtol = self.tolerance[None] * (
-                    mapply_pos(engine.W2V[None], pos - viewdir / nsteps
-                    ).z - mapply_pos(engine.W2V[None], pos).z)
-
-            ro = pos + odir * rng.random() * step
-            for j in range(nsteps):
-                ro += odir * step
-                vro = mapply_pos(engine.W2V[None], ro)
-                if not all(-1 <= vro <= 1):
-                    break
-                D = engine.to_viewport(vro)
-                depth = engine.depth[int(D)] / engine.maxdepth
-                if vro.z - vtol < depth < vro.z:
-                    clr = bilerp(image, D) * wei
-                    res += V34(clr, 1.0)
-                    break
+            hit, D = self.trace(engine, pos, odir, rng.random())
+            if hit:
+                D = clamp(D, 0, self.res - 1.001)
+                clr = bilerp(image, D) * wei
+                res += V34(clr, 1.0)
 
         tina.Input.clear_g_pars()
 
-        self.img[P] = res / nsamples
+        self.img[L] = res / nsamples
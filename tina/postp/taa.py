@@ -0,0 +1,82 @@
+from ..advans import *
+
+
+@ti.data_oriented
+class TemporalAA:
+    def __init__(self, res, blend=0.1):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param blend: (float) weight of the new frame while the camera moves
+
+        Temporal anti-aliasing with reprojection, each pixel finds where
+        its surface was in the last frame from the depth buffer and the
+        last camera, and blends the new frame into the history from there
+
+        While the camera moves the history is clamped to the colors around
+        the pixel in the new frame, and blended exponentially; while it
+        stays still, the frames are averaged like Accumator does
+        '''
+
+        self.res = tovector(res)
+        self.imgs = [ti.Vector.field(3, float, res) for i in range(2)]
+        self.cur = 0
+        self.count = ti.field(int, ())
+        self.prevW2V = ti.Matrix.field(4, 4, float, ())
+        self.maxcount = max(1, round(1 / blend))
+        self.prev = None
+
+    @property
+    def img(self):
+        return self.imgs[self.cur]
+
+    def clear(self):
+        self.count[None] = 0
+
+    def update(self, engine, src):
+        '''
+        :param engine: (Engine) the engine holding depth and camera of the frame
+        :param src: (Vector.field) the new frame
+        '''
+
+        W2V = engine.W2V.to_numpy()
+        moving = self.prev is not None and not np.allclose(W2V, self.prev)
+        if moving:
+            self.count[None] = min(self.count[None], self.maxcount - 1)
+        self._update(engine, src, self.imgs[self.cur], self.imgs[1 - self.cur], moving)
+        self.cur = 1 - self.cur
+        self.prevW2V.from_numpy(W2V)
+        self.prev = W2V
+
+    @ti.func
+    def reproject(self, engine, P):
+        # motion of the surface seen at the center of P, from the cameras
+        vpos = V23(engine.from_viewport(P + 0.5), engine.depth[P] / engine.maxdepth)
+        pos = mapply_pos(engine.V2W[None], vpos)
+        return engine.to_viewport(mapply_pos(self.prevW2V[None], pos))
+
+    @ti.func
+    def sample(self, f: ti.template(), pos):
+        # bilinear with clamp to edge, pos in texel units of f
+        pos = clamp(pos, 0, self.res - 1.001)
+        return bilerp(f, pos)
+
+    @ti.kernel
+    def _update(self, engine: ti.template(), src: ti.template(),
+            hist: ti.template(), dst: ti.template(), moving: ti.template()):
+        self.count[None] += 1
+        inv_count = 1 / self.count[None]
+        for P in ti.grouped(dst):
+            color = src[P]
+            if ti.static(moving):
+                Q = self.reproject(engine, P)
+                history = color
+                if all(0 <= Q) and all(Q < self.res):
+                    history = self.sample(hist, Q - 0.5)
+                    cmin, cmax = color, color
+                    for J in ti.static(ti.grouped(ti.ndrange((-1, 2), (-1, 2)))):
+                        c = src[clamp(P + J, 0, self.res - 1)]
+                        cmin, cmax = min(cmin, c), max(cmax, c)
+                    history = clamp(history, cmin, cmax)
+                dst[P] = lerp(inv_count, history, color)
+            else:
+                dst[P] = lerp(inv_count, hist[P], color)
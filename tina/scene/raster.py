@@ -22,6 +22,10 @@ class Scene:
         self.tonemap = options.get('tonemap', True)
         self.blooming = options.get('blooming', False)
         self.bgcolor = options.get('bgcolor', 0)
+        self.deferred = options.get('deferred', False)
+        self.occlusion = options.get('occlusion', False)
+        self.frustum_culling = options.get('frustum_culling', True)
+        self.pixel_order = options.get('pixel_order', 'scanline')
 
         if not self.ibl:
             self.lighting = tina.Lighting()
@@ -39,7 +43,7 @@ class Scene:
         self.shaders = {}
         self.objects = {}
 
-        if self.ssr:
+        if self.ssr or self.deferred:
             self.mtltab = tina.MaterialTable()
 
             @ti.materialize_callback
@@ -48,12 +52,25 @@ class Scene:
                 for material in self.materials:
                     self.mtltab.add_material(material)
 
-        if self.ssao or self.ssr:
+        if self.deferred:
+            # the G-buffer already holds what SSR and SSAO need
+            self.norm_buffer = ti.Vector.field(3, float, self.res)
+            self.coor_buffer = ti.Vector.field(2, float, self.res)
+            self.mtlid_buffer = ti.field(int, self.res)
+            self.deferred = tina.DeferredShading(self.image, self.lighting,
+                    self.mtltab, self.norm_buffer, self.coor_buffer,
+                    self.mtlid_buffer, pixel_order=self.pixel_order)
+            # objects drawn forward after the deferred pass update the
+            # G-buffer themselves, so that SSAO and SSR see their surface
+            self.gbuffer_shaders = [tina.NormalShader(self.norm_buffer),
+                    tina.TexcoordShader(self.coor_buffer)]
+
+        elif self.ssao or self.ssr:
             self.norm_buffer = ti.Vector.field(3, float, self.res)
             self.norm_shader = tina.NormalShader(self.norm_buffer)
             self.pre_shaders.append(self.norm_shader)
 
-        if self.ssr:
+        if self.ssr and not self.deferred:
             self.mtlid_buffer = ti.field(int, self.res)
             if 'texturing' in options:
                 self.coor_buffer = ti.Vector.field(2, float, self.res)
@@ -63,15 +80,25 @@ class Scene:
                 self.coor_buffer = ti.Vector.field(2, float, (1, 1))
 
         if self.ssao:
-            self.ssao = tina.SSAO(self.res, self.norm_buffer, taa=self.taa)
+            self.ssao = tina.SSAO(self.res, self.norm_buffer, taa=self.taa,
+                    downsample=options.get('ssao_downsample', 1),
+                    pixel_order=self.pixel_order)
 
         if self.ssr:
             self.ssr = tina.SSR(self.res, self.norm_buffer,
-                    self.coor_buffer, self.mtlid_buffer, self.mtltab, taa=self.taa)
+                    self.coor_buffer, self.mtlid_buffer, self.mtltab, taa=self.taa,
+                    downsample=options.get('ssr_downsample', 1),
+                    pixel_order=self.pixel_order)
 
         if self.blooming:
             self.blooming = tina.Blooming(self.res)
 
+        if self.occlusion:
+            self.hiz = tina.DepthPyramid(self.res)
+
+        self.objtree = None
+        self.objtree_key = None
+
         self.pp_img = self.image
 
         if self.tonemap:
@@ -81,11 +108,23 @@ class Scene:
             self.fxaa = tina.FXAA(self.res)
 
         if self.taa:
-            self.accum = tina.Accumator(self.res)
+            self.accum = tina.TemporalAA(self.res)
 
         if self.ibl:
             self.background_shader = tina.BackgroundShader(self.image, self.lighting)
 
+        # stages in the order they apply, per-pixel ones fuse into one pass
+        stages = [stage for stage in [self.ssao, self.ssr,
+            getattr(self, 'background_shader', None), self.blooming,
+            self.tonemap, self.fxaa] if stage]
+        clears = [(self.image, self.bgcolor), self.engine]
+        if self.deferred:
+            clears += [(self.deferred.norm, 0), (self.deferred.mtlid, -1)]
+        self.fused_clears = [s for s in self.pre_shaders + self.post_shaders
+                if type(s).clear_buffer is tina.IShader.clear_buffer]
+        clears += [(s.img, 0) for s in self.fused_clears]
+        self.post = tina.PostPipeline(self.res, stages, clears)
+
         if not self.ibl:
             @ti.materialize_callback
             def add_default_lights():
@@ -99,30 +138,96 @@ class Scene:
         shader = tina.Shader(self.image, self.lighting, material)
 
         base_shaders = [shader]
-        if self.ssr:
+        if self.ssr or self.deferred:
             mtlid = len(self.materials)
             mtlid_shader = tina.ConstShader(self.mtlid_buffer, mtlid)
             base_shaders.append(mtlid_shader)
+        if self.deferred:
+            base_shaders += self.gbuffer_shaders
         shader = tina.ShaderGroup(self.pre_shaders
                 + base_shaders + self.post_shaders)
 
         self.materials.append(material)
         self.shaders[material] = shader
+        if hasattr(self, 'mtltab'):
+            self.mtltab.add_material(material)
+
+    def _get_shader_table(self):
+        # rebuilt only when materials are added, so that kernels are not recompiled every frame
+        if getattr(self, 'shader_table', None) is None or \
+                len(self.shader_table.shaders) != len(self.materials):
+            self.shader_table = tina.ShaderTable([self.shaders[material]
+                for material in self.materials])
+        return self.shader_table
+
+    def _get_object_tree(self):
+        versions = tuple(object_version(object) for object in self.objects)
+        key = tuple(self.objects), versions
+        if self.objtree is not None and None not in versions and key == self.objtree_key:
+            return self.objtree
+
+        self.objtree_items = []
+        self.objtree_unbounded = []
+        boxes = []
+        for object in self.objects:
+            box = object_bounding_box(object)
+            if box is None:
+                self.objtree_unbounded.append(object)
+            elif np.all(box[0] <= box[1]):  # empty objects are never drawn
+                self.objtree_items.append(object)
+                boxes.append(box)
+        self.objtree = tina.BoundingTree(boxes)
+        self.objtree_key = key
+        return self.objtree
+
+    def get_visible_objects(self):
+        '''
+        :return: (list) objects not entirely outside the view frustum, in the order they were added
+        '''
+
+        if not self.frustum_culling:
+            return list(self.objects)
+
+        objtree = self._get_object_tree()
+        planes = tina.frustum_planes(self.engine.W2V.to_numpy())
+        visible = set(self.objtree_unbounded)
+        visible.update(self.objtree_items[i] for i in objtree.query(planes))
+        return [object for object in self.objects if object in visible]
+
+    def select_lod(self, object):
+        '''
+        :param object: (Mesh | Pars | Voxl | MeshLOD) an object in the scene
+        :return: the level of a MeshLOD matching its size on screen, the object itself otherwise
+        '''
+
+        if not isinstance(object, tina.MeshLOD):
+            return object
+        box = object.get_bounding_box()
+        if box is None or np.any(box[0] > box[1]):
+            return object.levels[0]
+        size = tina.projected_size(self.engine.W2V.to_numpy(),
+                self.res.entries, *box)
+        return object.levels[object.select_level(size)]
 
     def add_object(self, object, material=None, raster=None):
         '''
-        :param object: (Mesh | Pars | Voxl) object to add into the scene
-        :param material: (Material) specify material for shading the object, self.default_material by default
+        :param object: (Mesh | Pars | Voxl | MeshLOD) object to add into the scene
+        :param material: (Material | list) specify material for shading the object, self.default_material by default
         :param raster: (Rasterizer) specify the rasterizer for this object, automatically guess if not specified
+
+        :note: a list of materials is indexed by the per-instance material ids of an InstancedMesh
         '''
 
         assert object not in self.objects
         if material is None:
             material = self.default_material
+        materials = list(material) if isinstance(material, (list, tuple)) else [material]
+        material = materials[0]
 
         if raster is None:
-            if hasattr(object, 'get_nfaces'):
-                if hasattr(object, 'get_npolygon') and object.get_npolygon() == 2:
+            probe = object.levels[0] if isinstance(object, tina.MeshLOD) else object
+            if hasattr(probe, 'get_nfaces'):
+                if hasattr(probe, 'get_npolygon') and probe.get_npolygon() == 2:
                     if not hasattr(self, 'wireframe_raster'):
                         self.wireframe_raster = tina.WireframeRaster(self.engine, **self.options)
                     raster = self.wireframe_raster
@@ -130,20 +235,27 @@ class Scene:
                     if not hasattr(self, 'triangle_raster'):
                         self.triangle_raster = tina.TriangleRaster(self.engine, **self.options)
                     raster = self.triangle_raster
-            elif hasattr(object, 'get_npars'):
+            elif hasattr(probe, 'get_npars'):
                 if not hasattr(self, 'particle_raster'):
                     self.particle_raster = tina.ParticleRaster(self.engine, **self.options)
                 raster = self.particle_raster
-            elif hasattr(object, 'sample_volume'):
+            elif hasattr(probe, 'sample_volume'):
                 if not hasattr(self, 'volume_raster'):
                     self.volume_raster = tina.VolumeRaster(self.engine, **self.options)
                 raster = self.volume_raster
             else:
                 raise ValueError(f'cannot determine raster type of object: {object}')
 
-        self._ensure_material_shader(material)
+        levels = object.levels if isinstance(object, tina.MeshLOD) else [object]
+        for level in levels:
+            if hasattr(level, 'check_mtlids'):
+                level.check_mtlids(len(materials))
 
-        self.objects[object] = namespace(material=material, raster=raster)
+        for m in materials:
+            self._ensure_material_shader(m)
+
+        self.objects[object] = namespace(material=material,
+                materials=materials, raster=raster)
 
     def init_control(self, gui, center=None, theta=None, phi=None, radius=None,
                      fov=60, is_ortho=False, blendish=True):
@@ -173,38 +285,69 @@ class Scene:
         if self.taa:
             self.engine.randomize_bias(self.accum.count[None] == 0)
 
-        self.image.fill(self.bgcolor)
-        self.engine.clear_depth()
-        for s in self.pre_shaders:
-            s.clear_buffer()
-        for s in self.post_shaders:
-            s.clear_buffer()
-
-        for object, oinfo in self.objects.items():
+        self.post.clear()
+        self.engine.begin_frame()
+        for s in self.pre_shaders + self.post_shaders:
+            if s not in self.fused_clears:
+                s.clear_buffer()
+
+        objects = self.get_visible_objects()
+
+        batches = {}
+        batched = set()
+        for object in objects:
+            oinfo = self.objects[object]
+            # zero-copy objects are drawn alone, straight from their fields
+            if hasattr(oinfo.raster, 'set_objects') and not getattr(object, 'zero_copy', False):
+                batched.add(object)
+                mtlid = [self.materials.index(m) for m in oinfo.materials]
+                if len(mtlid) == 1:
+                    mtlid = mtlid[0]
+                batches.setdefault(oinfo.raster, []).append(
+                        (self.select_lod(object), mtlid))
+
+        if self.deferred:
+            shader_table = self.deferred.shader
+        elif batches:
+            shader_table = self._get_shader_table()
+        culled = [raster for raster in batches if getattr(raster, 'clustering', False)]
+        for raster, batch in batches.items():
+            raster.set_objects(batch)
+            if raster in culled:
+                if self.occlusion:
+                    raster.cull_occluders()
+                else:
+                    raster.cull_clusters()
+            raster.render_occup()
+            raster.render_color(shader_table)
+
+        if self.occlusion and culled:
+            # what was visible last frame is drawn first, the rest is
+            # tested against the depth of it
+            self.hiz.build(self.engine)
+            for raster in culled:
+                raster.cull_clusters(self.hiz)
+                raster.render_occup()
+                raster.render_color(shader_table)
+
+        if self.deferred:
+            self.deferred.render(self.engine)
+
+        for object in objects:
+            oinfo = self.objects[object]
+            if object in batched:
+                continue
             shader = self.shaders[oinfo.material]
-            oinfo.raster.set_object(object)
+            oinfo.raster.set_object(self.select_lod(object))
             oinfo.raster.render_occup()
             oinfo.raster.render_color(shader)
 
         if self.ssao:
             self.ssao.render(self.engine)
-            self.ssao.apply(self.image)
 
-        if self.ssr:
-            self.ssr.render(self.engine, self.image)
-            self.ssr.apply(self.image)
-
-        if hasattr(self, 'background_shader'):
-            self.engine.render_background(self.background_shader)
-
-        if self.blooming:
-            self.blooming.apply(self.image)
-        if self.tonemap:
-            self.tonemap.apply(self.image)
-        if self.fxaa:
-            self.fxaa.apply(self.image)
+        self.post.apply(self.engine, self.image)
         if self.taa:
-            self.accum.update(self.pp_img)
+            self.accum.update(self.engine, self.pp_img)
 
     @property
     def img(self):
@@ -223,7 +366,8 @@ class Scene:
         if not hasattr(self, 'control'):
             self.control = tina.Control(gui)
         changed = self.control.apply_camera(self.engine)
-        if changed:
+        # with TAA the history is reprojected, no need to clear it
+        if changed and not getattr(self, 'taa', False):
             self.clear()
         return changed
 
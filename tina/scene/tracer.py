@@ -1,10 +1,60 @@
 from ..advans import *
 from .raster import Scene
+import inspect
 
 
+def _pick_options(cls, options):
+    # only the keyword arguments that cls.__init__ declares
+    params = inspect.signature(cls.__init__).parameters
+    return {key: value for key, value in options.items() if key in params}
+
+
+@ti.data_oriented
 class MixedGeometryTracer:
-    def __init__(self):
-        self.tracers = []
+    def __init__(self, tracers):
+        '''
+        :param tracers: (list) geometry tracers sharing one BVH
+
+        Builds a single BVH over the elements of all tracers, so that one
+        traversal finds the closest hit among every kind of geometry
+
+        A tracer takes part by providing get_max_elements(), objects as
+        handle -> (base, size, trans), pop_changes(), element_bounds(ind),
+        element_hit(ind, ro, rd) and update()
+        '''
+
+        self.tracers = tracers
+        self.ntracers = len(self.tracers)
+        self.tree = tina.BVHTree(self, sum(tracer.get_max_elements()
+            for tracer in self.tracers) * 4)
+
+    def update(self):
+        '''
+        Rebuild the BVH subtrees of objects added or resized since the last
+        update, refit those of moved objects, and rebuild the top tree
+        '''
+
+        for tracer in self.tracers:
+            tracer.update()
+        self.tree.sync(self.tracers)
+
+    @ti.func
+    def element_bounds(self, ref):
+        ind, gid = ref // self.ntracers, ref % self.ntracers
+        bmin, bmax = V(0., 0., 0.), V(0., 0., 0.)
+        for i, tracer in ti.static(enumerate(self.tracers)):
+            if i == gid:
+                bmin, bmax = tracer.element_bounds(ind)
+        return bmin, bmax
+
+    @ti.func
+    def element_hit(self, ref, ro, rd):
+        ind, gid = ref // self.ntracers, ref % self.ntracers
+        hit, depth, uv = 0, inf, V(0., 0.)
+        for i, tracer in ti.static(enumerate(self.tracers)):
+            if i == gid:
+                hit, depth, uv = tracer.element_hit(ind, ro, rd)
+        return hit, depth, uv
 
     @ti.func
     def sample_light(self):
@@ -21,17 +71,11 @@ class MixedGeometryTracer:
 
     @ti.func
     def hit(self, ro, rd):
-        if ti.static(len(self.tracers) == 1):
-            near, ind, uv = self.tracers[0].hit(ro, rd)
-            gid = -1 if ind == -1 else 0
-            return near, ind, gid, uv
-
-        ret_near, ret_ind, ret_gid, ret_uv = inf, -1, -1, V(0., 0.)
-        for gid, tracer in ti.static(enumerate(self.tracers)):
-            near, ind, uv = tracer.hit(ro, rd)
-            if near < ret_near:
-                    ret_near, ret_ind, ret_gid, ret_uv = near, ind, gid, uv
-        return ret_near, ret_ind, ret_gid, ret_uv
+        near, ref, uv = self.tree.hit(ro, rd)
+        ind, gid = -1, -1
+        if ref != -1:
+            ind, gid = ref // self.ntracers, ref % self.ntracers
+        return near, ind, gid, uv
 
     @ti.func
     def calc_geometry(self, gid, ind, uv, pos):
@@ -49,15 +93,22 @@ class MixedGeometryTracer:
 class PTScene(Scene):
     def __init__(self, res=512, **options):
         self.mtltab = tina.MaterialTable()
-        self.geom = MixedGeometryTracer()
-        self.engine = tina.PathEngine(self.geom, self.mtltab, res)
-        self.res = self.engine.res
         self.options = options
 
-        self.materials = [tina.Lambert()]
+        classes = [tina.TriangleTracer, tina.ParticleTracer, tina.PathEngine]
+        picked = [_pick_options(cls, options) for cls in classes]
+        unknown = set(options).difference(*picked)
+        if unknown:
+            raise TypeError(f'PTScene got unexpected options: {sorted(unknown)}')
+
+        self.geom = MixedGeometryTracer([
+            tina.TriangleTracer(standalone=False, **picked[0]),
+            tina.ParticleTracer(standalone=False, **picked[1]),
+        ])
+        self.engine = tina.PathEngine(self.geom, self.mtltab, res, **picked[2])
+        self.res = self.engine.res
 
-        self.geom.tracers.append(tina.TriangleTracer(**self.options))
-        self.geom.tracers.append(tina.ParticleTracer(**self.options))
+        self.materials = [tina.Lambert()]
 
         @ti.materialize_callback
         def init_mtltab():
@@ -85,14 +136,12 @@ class PTScene(Scene):
         if hasattr(object, 'get_nfaces'):
             @ti.materialize_callback
             def add_mesh():
-                obj = tina.export_simple_mesh(object)
-                self.add_mesh(np.eye(4), obj['fv'], obj['fn'], obj['ft'], mtlid)
+                self.geom.tracers[0].add_object(object, mtlid)
 
         elif hasattr(object, 'get_npars'):
             @ti.materialize_callback
             def add_pars():
-                obj = tina.export_simple_pars(object)
-                self.add_pars(np.eye(4), obj['v'], obj['vr'], obj['vc'], mtlid)
+                self.geom.tracers[1].add_object(object, mtlid)
 
         else:
             raise RuntimeError(f'cannot determine type of object: {object!r}')
@@ -102,13 +151,12 @@ class PTScene(Scene):
 
     def update(self):
         self.engine.clear_image()
-        for tracer in self.geom.tracers:
-            tracer.update()
+        self.geom.update()
         for tracer in self.geom.tracers:
             tracer.update_emission(self.mtltab)
 
-    def render(self, nsteps=10, russian=2, blocksize=0):
-        self.engine.trace(nsteps, russian, blocksize)
+    def render(self, nsteps=10, russian=2, blocksize=0, spp=None):
+        self.engine.trace(nsteps, russian, blocksize, spp)
 
     def render_light(self, nsteps=10, russian=2):
         self.engine.trace_light(nsteps, russian)
@@ -121,5 +169,9 @@ class PTScene(Scene):
     def raw_img(self):
         return self.engine.get_image(raw=True)
 
+    @property
+    def heatmap(self):
+        return self.engine.get_heatmap()
+
     def _fast_export_image(self, out, blocksize=0):
         self.engine._fast_export_image(out, blocksize)
@@ -4,3 +4,6 @@ if __import__('tina').lazyguard:
     from .matrix import *
     from .mciso import *
     from .stack import *
+    from .order import *
+    from .allocator import *
+    from .bounds import *
@@ -0,0 +1,63 @@
+from ..common import *
+
+
+class RangeAllocator:
+    def __init__(self, size, align=1):
+        '''
+        :param size: (int) number of slots to manage
+        :param align: (int) alignment of allocated bases
+
+        First-fit allocator for ranges of slots in a fixed-size field,
+        freed ranges are coalesced with their neighbours and reused
+        '''
+
+        self.size = size
+        self.align = align
+        self.clear()
+
+    def clear(self):
+        self.free_chunk = [(0, self.size)]
+        self.used_chunk = {}
+
+    def malloc(self, size):
+        # empty ranges still take a slot, so that each base stays unique
+        size = max(size, 1)
+        size = (size + self.align - 1) // self.align * self.align
+        for i, (chk_base, chk_size) in enumerate(self.free_chunk):
+            if chk_size >= size:
+                if chk_size != size:
+                    self.free_chunk[i] = (chk_base + size, chk_size - size)
+                else:
+                    del self.free_chunk[i]
+                break
+        else:
+            raise RuntimeError(f'Out of memory! cannot allocate {size} of {self.size}')
+        self.used_chunk[chk_base] = size
+        return chk_base
+
+    def free(self, base):
+        if base not in self.used_chunk:
+            raise RuntimeError(f'Invalid pointer: {base!r}')
+        size = self.used_chunk.pop(base)
+
+        i = 0
+        while i < len(self.free_chunk) and self.free_chunk[i][0] < base:
+            i += 1
+        if i < len(self.free_chunk) and base + size == self.free_chunk[i][0]:
+            size += self.free_chunk[i][1]
+            del self.free_chunk[i]
+        if i > 0 and sum(self.free_chunk[i - 1]) == base:
+            base, prev_size = self.free_chunk[i - 1]
+            size += prev_size
+            i -= 1
+            del self.free_chunk[i]
+        self.free_chunk.insert(i, (base, size))
+
+    def get_top(self):
+        '''
+        :return: (int) end of the highest allocated range
+        '''
+
+        if not self.used_chunk:
+            return 0
+        return max(base + size for base, size in self.used_chunk.items())
@@ -0,0 +1,112 @@
+from ..common import *
+
+
+def frustum_planes(W2V):
+    '''
+    :param W2V: (np.array[4, 4]) world to clip space matrix of the camera
+    :return: (np.array[6, 4]) planes (a, b, c, d) of the view frustum, ax + by + cz + d >= 0 inside
+    '''
+
+    W2V = np.array(W2V, dtype=np.float64)
+    planes = []
+    for i in range(3):
+        planes.append(W2V[3] + W2V[i])
+        planes.append(W2V[3] - W2V[i])
+    return np.array(planes)
+
+
+def classify_box(planes, bmin, bmax):
+    '''
+    :return: (int) -1 if the box is entirely outside the planes, 1 if entirely inside, 0 otherwise
+    '''
+
+    normals, dists = planes[:, :3], planes[:, 3]
+    far = np.where(normals >= 0, bmax, bmin)
+    if np.any(np.sum(normals * far, axis=1) + dists < 0):
+        return -1
+    near = np.where(normals >= 0, bmin, bmax)
+    if np.all(np.sum(normals * near, axis=1) + dists >= 0):
+        return 1
+    return 0
+
+
+def projected_size(W2V, res, bmin, bmax):
+    '''
+    :param W2V: (np.array[4, 4]) world to clip space matrix of the camera
+    :param res: (tuple) resolution of screen
+    :return: (float) larger extent of the box on screen in pixels, inf if it crosses the camera plane
+    '''
+
+    corners = np.array([[bmax[k] if i >> k & 1 else bmin[k] for k in range(3)]
+        for i in range(8)], dtype=np.float64)
+    clip = np.concatenate([corners, np.ones((8, 1))], axis=1) @ np.transpose(W2V)
+    if np.any(clip[:, 3] <= 0):
+        return np.inf
+    ndc = clip[:, :2] / clip[:, 3:]
+    extent = (ndc.max(axis=0) - ndc.min(axis=0)) * 0.5 * np.array(res)
+    return float(extent.max())
+
+
+class BoundingTree:
+    def __init__(self, boxes, leafsize=4):
+        '''
+        :param boxes: (np.array[n, 2, 3]) minimum and maximum corners of the items
+        :param leafsize: (int) max number of items in a leaf node
+
+        Host side bounding volume hierarchy over scene objects, split at
+        the median of the longest axis
+        '''
+
+        self.boxes = np.array(boxes, dtype=np.float64).reshape(-1, 2, 3)
+        self.leafsize = leafsize
+        self.order = np.arange(len(self.boxes))
+        self.nodes = []
+        if len(self.boxes):
+            self._build(0, len(self.boxes))
+
+    def _build(self, lo, hi):
+        ind = self.order[lo:hi]
+        bmin = self.boxes[ind, 0].min(axis=0)
+        bmax = self.boxes[ind, 1].max(axis=0)
+        node = len(self.nodes)
+        self.nodes.append(None)
+        if hi - lo <= self.leafsize:
+            self.nodes[node] = (bmin, bmax, lo, hi, -1, -1)
+            return node
+
+        centers = self.boxes[ind].mean(axis=1)
+        axis = np.argmax(centers.max(axis=0) - centers.min(axis=0))
+        self.order[lo:hi] = ind[np.argsort(centers[:, axis], kind='stable')]
+        mid = (lo + hi) // 2
+        left = self._build(lo, mid)
+        right = self._build(mid, hi)
+        self.nodes[node] = (bmin, bmax, lo, hi, left, right)
+        return node
+
+    def query(self, planes):
+        '''
+        :param planes: (np.array[k, 4]) planes as returned by frustum_planes
+        :return: (list) indices of the items not entirely outside the planes
+        '''
+
+        ret = []
+        stack = [(0, False)] if self.nodes else []
+        while stack:
+            node, inside = stack.pop()
+            bmin, bmax, lo, hi, left, right = self.nodes[node]
+            if not inside:
+                state = classify_box(planes, bmin, bmax)
+                if state < 0:
+                    continue
+                inside = state > 0
+
+            if inside:  # no need to test the children
+                ret.extend(self.order[lo:hi])
+            elif left == -1:
+                for i in self.order[lo:hi]:
+                    if classify_box(planes, *self.boxes[i]) >= 0:
+                        ret.append(i)
+            else:
+                stack.append((right, False))
+                stack.append((left, False))
+        return [int(i) for i in ret]
@@ -0,0 +1,97 @@
+from ..common import *
+
+
+@ti.data_oriented
+class ScanlineOrder:
+    def __init__(self, res):
+        '''
+        :param res: (int | tuple) resolution of screen
+
+        Maps the flat thread index to pixels row by row, the default order
+        '''
+
+        self.res = tovector(res)
+
+    def get_nthreads(self):
+        return self.res.x * self.res.y
+
+    @ti.func
+    def contains(self, I):
+        return all(I < self.res)
+
+    @ti.func
+    def get_pixel(self, i):
+        return V(i % self.res.x, i // self.res.x)
+
+
+class TiledOrder(ScanlineOrder):
+    def __init__(self, res, tilesize=8):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param tilesize: (int) edge length of a square tile in pixels
+
+        Maps consecutive threads into square tiles, so that neighbouring
+        threads trace neighbouring rays
+
+        :note: the screen is padded to whole tiles, use contains() to skip the padding
+        '''
+
+        super().__init__(res)
+        self.tilesize = tilesize
+        self.ntiles = tovector([(n + tilesize - 1) // tilesize for n in self.res.entries])
+
+    def get_nthreads(self):
+        return self.ntiles.x * self.ntiles.y * self.tilesize**2
+
+    @ti.func
+    def get_pixel(self, i):
+        area = self.tilesize**2
+        t, j = i // area, i % area
+        T = V(t % self.ntiles.x, t // self.ntiles.x)
+        return T * self.tilesize + self.get_tile_pixel(j)
+
+    @ti.func
+    def get_tile_pixel(self, j):
+        return V(j % self.tilesize, j // self.tilesize)
+
+
+class MortonOrder(TiledOrder):
+    def __init__(self, res, tilesize=16):
+        '''
+        :param res: (int | tuple) resolution of screen
+        :param tilesize: (int) edge length of a Z-order tile, must be a power of two
+
+        Maps consecutive threads along the Morton (Z-order) curve inside each tile
+        '''
+
+        assert tilesize & (tilesize - 1) == 0, tilesize
+        super().__init__(res, tilesize)
+        self.nbits = tilesize.bit_length() - 1
+
+    @ti.func
+    def get_tile_pixel(self, j):
+        x, y = 0, 0
+        for k in ti.static(range(self.nbits)):
+            x |= ((j >> (2 * k)) & 1) << k
+            y |= ((j >> (2 * k + 1)) & 1) << k
+        return V(x, y)
+
+
+def make_pixel_order(res, order='scanline'):
+    '''
+    :param res: (int | tuple) resolution of screen
+    :param order: (str | ScanlineOrder) one of 'scanline', 'tiled' or 'morton', or an order object
+
+    Creates the pixel order policy for mapping threads to pixels
+    '''
+
+    if not isinstance(order, str):
+        return order
+    if order == 'scanline':
+        return ScanlineOrder(res)
+    elif order == 'tiled':
+        return TiledOrder(res)
+    elif order == 'morton':
+        return MortonOrder(res)
+    else:
+        raise ValueError(f'unknown pixel order: {order!r}')
@@ -7,6 +7,7 @@ class VolumeScale(VoxlEditBase):
         super().__init__(voxl)
 
         self.scale = ti.field(float, ())
+        self.scale_version = 0
 
         @ti.materialize_callback
         def init_scale():
@@ -14,6 +15,11 @@ class VolumeScale(VoxlEditBase):
 
     def set_scale(self, scale):
         self.scale[None] = scale
+        self.scale_version += 1
+
+    def get_version(self):
+        version = object_version(self.voxl)
+        return None if version is None else (version, self.scale_version)
 
     @ti.func
     def sample_volume(self, pos):
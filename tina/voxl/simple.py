@@ -6,6 +6,7 @@ class SimpleVolume:
     def __init__(self, N):
         self.N = N
         self.dens = ti.field(float, (N, N, N))
+        self.version = 0
 
         @ti.materialize_callback
         def init_pars():
@@ -13,6 +14,10 @@ class SimpleVolume:
 
     def set_volume_density(self, dens):
         self.dens.from_numpy(dens)
+        self.version += 1
+
+    def get_version(self):
+        return self.version
 
     @ti.func
     def pre_compute(self):
@@ -8,6 +8,7 @@ class VolumeTransform(VoxlEditBase):
 
         self.trans = ti.Matrix.field(4, 4, float, ())
         self.inv_trans = ti.Matrix.field(4, 4, float, ())
+        self.trans_version = 0
 
         @ti.materialize_callback
         @ti.kernel
@@ -22,3 +23,8 @@ class VolumeTransform(VoxlEditBase):
     def set_transform(self, trans):
         self.trans[None] = np.array(trans).tolist()
         self.inv_trans[None] = np.linalg.inv(trans).tolist()
+        self.trans_version += 1
+
+    def get_version(self):
+        version = object_version(self.voxl)
+        return None if version is None else (version, self.trans_version)